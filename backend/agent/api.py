@@ -1,8 +1,9 @@
 from fastapi import APIRouter, HTTPException, Depends, Request, Body, File, UploadFile, Form
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 import asyncio
 import json
 import traceback
+from contextlib import aclosing
 from datetime import datetime, timezone
 import uuid
 from typing import Optional, List, Dict, Any
@@ -14,11 +15,20 @@ import os
 from agentpress.thread_manager import ThreadManager
 from services.supabase import DBConnection
 from services import redis
+from services.redis_pubsub import pubsub_multiplexer
 from agent.run import run_agent
+from agent import response_stream, run_broadcast
+from agent.run_broadcast import run_broadcaster
+from agent.response_persister import ResponsePersister
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, verify_thread_access
 from utils.logger import logger
 from services.billing import check_billing_status
+from services.billing_cache import billing_status_cache
+from services import usage_ledger
 from sandbox.sandbox import create_sandbox, get_or_start_sandbox
+from sandbox.browser_client import sandbox_browser_client
+from services.screenshot_store import screenshot_store
+from sandbox.sandbox_io import sandbox_call, SANDBOX_LIFECYCLE_TIMEOUT
 from services.llm import make_llm_api_call
 
 # Initialize shared resources
@@ -27,8 +37,15 @@ thread_manager = None
 db = None
 instance_id = None # Global instance ID for this backend instance
 
-# TTL for Redis response lists (24 hours)
-REDIS_RESPONSE_LIST_TTL = 3600 * 24
+# TTL for Redis response streams (24 hours)
+REDIS_RESPONSE_STREAM_TTL = 3600 * 24
+# Seconds between refreshes of the active run key TTL while a run is going
+ACTIVE_RUN_KEY_REFRESH_INTERVAL = 300
+# Seconds local runs get on shutdown to persist their last responses after STOP
+SHUTDOWN_RUN_TIMEOUT = 30
+
+# Agent runs executing in this process, by agent run ID
+_local_runs: Dict[str, asyncio.Task] = {}
 
 MODEL_NAME_ALIASES = {
     "sonnet-3.7": "anthropic/claude-3-7-sonnet-latest",
@@ -95,7 +112,23 @@ async def cleanup():
     except Exception as e:
         logger.error(f"Failed to clean up running agent runs: {str(e)}")
 
-    # Close Redis connection
+    # Let the local runs handle STOP and persist their remaining responses while Redis is still open
+    await _wait_for_local_runs(SHUTDOWN_RUN_TIMEOUT)
+
+    # Store the messages still queued for writing before the process exits
+    if thread_manager:
+        try:
+            await thread_manager.flush_messages()
+        except Exception as e:
+            logger.error(f"Failed to flush queued messages on shutdown: {str(e)}")
+
+    await sandbox_browser_client.close()
+
+    # Close the shared Redis readers, then the Redis connection
+    run_broadcaster.close()
+    await billing_status_cache.close()
+    await response_stream.stream_multiplexer.close()
+    await pubsub_multiplexer.close()
     await redis.close()
     logger.info("Completed cleanup of agent API resources")
 
@@ -103,11 +136,11 @@ async def update_agent_run_status(
     client,
     agent_run_id: str,
     status: str,
-    error: Optional[str] = None,
-    responses: Optional[List[Any]] = None # Expects parsed list of dicts
+    error: Optional[str] = None
 ) -> bool:
     """
     Centralized function to update agent run status.
+    Responses are persisted separately by the run's ResponsePersister.
     Returns True if update was successful.
     """
     try:
@@ -119,10 +152,6 @@ async def update_agent_run_status(
         if error:
             update_data["error"] = error
 
-        if responses:
-            # Ensure responses are stored correctly as JSONB
-            update_data["responses"] = responses
-
         # Retry up to 3 times
         for retry in range(3):
             try:
@@ -130,13 +159,6 @@ async def update_agent_run_status(
 
                 if hasattr(update_result, 'data') and update_result.data:
                     logger.info(f"Successfully updated agent run {agent_run_id} status to '{status}' (retry {retry})")
-
-                    # Verify the update
-                    verify_result = await client.table('agent_runs').select('status', 'completed_at').eq("id", agent_run_id).execute()
-                    if verify_result.data:
-                        actual_status = verify_result.data[0].get('status')
-                        completed_at = verify_result.data[0].get('completed_at')
-                        logger.info(f"Verified agent run update: status={actual_status}, completed_at={completed_at}")
                     return True
                 else:
                     logger.warning(f"Database update returned no data for agent run {agent_run_id} on retry {retry}: {update_result}")
@@ -162,21 +184,9 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     client = await db.client
     final_status = "failed" if error_message else "stopped"
 
-    # Attempt to fetch final responses from Redis
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    all_responses = []
-    try:
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
-        logger.info(f"Fetched {len(all_responses)} responses from Redis for DB update on stop/fail: {agent_run_id}")
-    except Exception as e:
-        logger.error(f"Failed to fetch responses from Redis for {agent_run_id} during stop/fail: {e}")
-        # Try fetching from DB as a fallback? Or proceed without responses? Proceeding without for now.
-
-    # Update the agent run status in the database
-    update_success = await update_agent_run_status(
-        client, agent_run_id, final_status, error=error_message, responses=all_responses
-    )
+    # Update the agent run status in the database; the run persists its own
+    # remaining responses when it receives the STOP signal
+    update_success = await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
 
     if not update_success:
         logger.error(f"Failed to update database status for stopped/failed run {agent_run_id}")
@@ -189,6 +199,12 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     except Exception as e:
         logger.error(f"Failed to publish STOP signal to global channel {global_control_channel}: {str(e)}")
 
+    # Tell viewers of the run's response stream
+    try:
+        await response_stream.append_control(agent_run_id, "STOP")
+    except Exception as e:
+        logger.error(f"Failed to add STOP signal to response stream for {agent_run_id}: {str(e)}")
+
     # Find all instances handling this agent run and send STOP to instance-specific channels
     try:
         instance_keys = await redis.keys(f"active_run:*:{agent_run_id}")
@@ -208,8 +224,8 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
             else:
                  logger.warning(f"Unexpected key format found: {key}")
 
-        # Clean up the response list immediately on stop/fail
-        await _cleanup_redis_response_list(agent_run_id)
+        # Clean up the response stream immediately on stop/fail
+        await _cleanup_redis_response_stream(agent_run_id)
 
     except Exception as e:
         logger.error(f"Failed to find or signal active instances for {agent_run_id}: {str(e)}")
@@ -217,14 +233,9 @@ async def stop_agent_run(agent_run_id: str, error_message: Optional[str] = None)
     logger.info(f"Successfully initiated stop process for agent run: {agent_run_id}")
 
 
-async def _cleanup_redis_response_list(agent_run_id: str):
-    """Set TTL on the Redis response list."""
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    try:
-        await redis.expire(response_list_key, REDIS_RESPONSE_LIST_TTL)
-        logger.debug(f"Set TTL ({REDIS_RESPONSE_LIST_TTL}s) on response list: {response_list_key}")
-    except Exception as e:
-        logger.warning(f"Failed to set TTL on response list {response_list_key}: {str(e)}")
+async def _cleanup_redis_response_stream(agent_run_id: str):
+    """Set TTL on the Redis response stream."""
+    await response_stream.expire(agent_run_id, REDIS_RESPONSE_STREAM_TTL)
 
 async def restore_running_agent_runs():
     """Mark agent runs that were still 'running' in the database as failed and clean up Redis resources."""
@@ -242,9 +253,8 @@ async def restore_running_agent_runs():
             active_run_key = f"active_run:{instance_id}:{agent_run_id}"
             await redis.delete(active_run_key)
             
-            # Clean up response list
-            response_list_key = f"agent_run:{agent_run_id}:responses"
-            await redis.delete(response_list_key)
+            # Clean up response stream
+            await response_stream.delete(agent_run_id)
             
             # Clean up control channels
             control_channel = f"agent_run:{agent_run_id}:control"
@@ -284,6 +294,31 @@ async def get_agent_run_with_access_check(client, agent_run_id: str, user_id: st
     await verify_thread_access(client, thread_id, user_id)
     return agent_run_data
 
+def _start_agent_run_task(agent_run_id: str, **kwargs) -> asyncio.Task:
+    """Run an agent run in the background of this process, tracked until it ends."""
+    task = asyncio.create_task(run_agent_background(agent_run_id=agent_run_id, **kwargs))
+    _local_runs[agent_run_id] = task
+
+    def _on_done(_task: asyncio.Task) -> None:
+        _local_runs.pop(agent_run_id, None)
+        asyncio.create_task(_cleanup_redis_instance_key(agent_run_id))
+
+    task.add_done_callback(_on_done)
+    return task
+
+async def _wait_for_local_runs(timeout: float):
+    """Wait for the agent runs of this process to end, cancelling those that take too long."""
+    tasks = list(_local_runs.values())
+    if not tasks:
+        return
+    logger.info(f"Waiting up to {timeout}s for {len(tasks)} local agent runs to finish")
+    _, pending = await asyncio.wait(tasks, timeout=timeout)
+    if pending:
+        logger.warning(f"Cancelling {len(pending)} agent runs that did not finish within {timeout}s")
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
 async def _cleanup_redis_instance_key(agent_run_id: str):
     """Clean up the instance-specific Redis key for an agent run."""
     if not instance_id:
@@ -317,12 +352,12 @@ async def get_or_create_project_sandbox(client, project_id: str):
 
     logger.info(f"Creating new sandbox for project {project_id}")
     sandbox_pass = str(uuid.uuid4())
-    sandbox = create_sandbox(sandbox_pass, project_id)
+    sandbox = await sandbox_call(None, create_sandbox, sandbox_pass, project_id, call_timeout=SANDBOX_LIFECYCLE_TIMEOUT)
     sandbox_id = sandbox.id
     logger.info(f"Created new sandbox {sandbox_id}")
 
-    vnc_link = sandbox.get_preview_link(6080)
-    website_link = sandbox.get_preview_link(8080)
+    vnc_link = await sandbox_call(sandbox_id, sandbox.get_preview_link, 6080)
+    website_link = await sandbox_call(sandbox_id, sandbox.get_preview_link, 8080)
     vnc_url = vnc_link.url if hasattr(vnc_link, 'url') else str(vnc_link).split("url='")[1].split("'")[0]
     website_url = website_link.url if hasattr(website_link, 'url') else str(website_link).split("url='")[1].split("'")[0]
     token = None
@@ -395,20 +430,16 @@ async def start_agent(
     except Exception as e:
         logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
 
-    # Run the agent in the background
-    task = asyncio.create_task(
-        run_agent_background(
-            agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
-            project_id=project_id, sandbox=sandbox,
-            model_name=MODEL_NAME_ALIASES.get(body.model_name, body.model_name),
-            enable_thinking=body.enable_thinking, reasoning_effort=body.reasoning_effort,
-            stream=body.stream, enable_context_manager=body.enable_context_manager
-        )
+    # Run the agent in the background; the Redis instance key is cleaned up when it ends
+    _start_agent_run_task(
+        agent_run_id, thread_id=thread_id, instance_id=instance_id,
+        project_id=project_id, sandbox=sandbox,
+        model_name=MODEL_NAME_ALIASES.get(body.model_name, body.model_name),
+        enable_thinking=body.enable_thinking, reasoning_effort=body.reasoning_effort,
+        stream=body.stream, enable_context_manager=body.enable_context_manager,
+        account_id=account_id
     )
 
-    # Set a callback to clean up Redis instance key when task is done
-    task.add_done_callback(lambda _: asyncio.create_task(_cleanup_redis_instance_key(agent_run_id)))
-
     return {"agent_run_id": agent_run_id, "status": "running"}
 
 @router.post("/agent-run/{agent_run_id}/stop")
@@ -428,8 +459,42 @@ async def get_agent_runs(thread_id: str, user_id: str = Depends(get_current_user
     await verify_thread_access(client, thread_id, user_id)
     agent_runs = await client.table('agent_runs').select('*').eq("thread_id", thread_id).order('created_at', desc=True).execute()
     logger.debug(f"Found {len(agent_runs.data)} agent runs for thread: {thread_id}")
+    if agent_runs.data:
+        # Responses are stored as segment rows; fetch them for all runs in one round trip
+        segments = await client.rpc('get_agent_run_responses', {
+            'p_agent_run_ids': [run['id'] for run in agent_runs.data]
+        }).execute()
+        responses = {row['agent_run_id']: row['responses'] for row in segments.data or []}
+        for run in agent_runs.data:
+            run['responses'] = responses.get(run['id'], [])
     return {"agent_runs": agent_runs.data}
 
+@router.get("/thread/{thread_id}/browser-state/{message_id}/screenshot")
+async def get_browser_state_screenshot(thread_id: str, message_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
+    """Get the screenshot of a browser_state message, stored by hash by the browser tool."""
+    client = await db.client
+    await verify_thread_access(client, thread_id, user_id)
+    result = await client.table('messages').select('content') \
+        .eq('thread_id', thread_id) \
+        .eq('message_id', message_id) \
+        .eq('type', 'browser_state') \
+        .execute()
+    if not result.data:
+        raise HTTPException(status_code=404, detail="Browser state not found")
+
+    content = result.data[0]['content']
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            content = {}
+    screenshot_hash = content.get('screenshot_hash') if isinstance(content, dict) else None
+    image = await screenshot_store.get(screenshot_hash) if screenshot_hash else None
+    if image is None:
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    # Content-addressed, so the response never changes
+    return Response(content=image, media_type="image/jpeg", headers={"Cache-Control": "private, max-age=86400"})
+
 @router.get("/agent-run/{agent_run_id}")
 async def get_agent_run(agent_run_id: str, user_id: str = Depends(get_current_user_id_from_jwt)):
     """Get agent run status and responses."""
@@ -452,175 +517,60 @@ async def stream_agent_run(
     token: Optional[str] = None,
     request: Request = None
 ):
-    """Stream the responses of an agent run using Redis Lists and Pub/Sub."""
+    """Stream the responses of an agent run from its Redis stream."""
     logger.info(f"Starting stream for agent run: {agent_run_id}")
     client = await db.client
 
     user_id = await get_user_id_from_stream_auth(request, token)
     agent_run_data = await get_agent_run_with_access_check(client, agent_run_id, user_id)
 
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
-    control_channel = f"agent_run:{agent_run_id}:control" # Global control channel
-
     async def stream_generator():
-        logger.debug(f"Streaming responses for {agent_run_id} using Redis list {response_list_key} and channel {response_channel}")
-        last_processed_index = -1
-        pubsub_response = None
-        pubsub_control = None
-        listener_task = None
-        terminate_stream = False
+        logger.debug(f"Streaming responses for {agent_run_id} using Redis stream {response_stream.response_stream_key(agent_run_id)}")
+        last_id = response_stream.STREAM_START_ID
         initial_yield_complete = False
 
         try:
-            # 1. Fetch and yield initial responses from Redis list
-            initial_responses_json = await redis.lrange(response_list_key, 0, -1)
-            initial_responses = []
-            if initial_responses_json:
-                initial_responses = [json.loads(r) for r in initial_responses_json]
-                logger.debug(f"Sending {len(initial_responses)} initial responses for {agent_run_id}")
-                for response in initial_responses:
-                    yield f"data: {json.dumps(response)}\n\n"
-                last_processed_index = len(initial_responses) - 1
+            # 1. A run with a hub in this process is running; otherwise ask the database
+            hub = run_broadcaster.get(agent_run_id)
+            if hub is None:
+                run_status = await client.table('agent_runs').select('status').eq("id", agent_run_id).maybe_single().execute()
+                current_status = run_status.data.get('status') if run_status.data else None
+
+                if current_status != 'running':
+                    # Yield the stored responses and end the stream
+                    while True:
+                        entries = await response_stream.read_entries(agent_run_id, last_id)
+                        for entry_id, fields in entries:
+                            last_id = entry_id
+                            if "data" in fields:
+                                yield run_broadcast.encode_frame(fields)[0]
+                        if len(entries) < response_stream.READ_COUNT:
+                            break
+                    initial_yield_complete = True
+                    logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
+                    yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
+                    return
+                hub = run_broadcaster.open(agent_run_id, response_stream.STREAM_START_ID)
+
+            # 2. Replay the run and follow it through the hub shared with the other local viewers
             initial_yield_complete = True
-
-            # 2. Check run status *after* yielding initial data
-            run_status = await client.table('agent_runs').select('status').eq("id", agent_run_id).maybe_single().execute()
-            current_status = run_status.data.get('status') if run_status.data else None
-
-            if current_status != 'running':
-                logger.info(f"Agent run {agent_run_id} is not running (status: {current_status}). Ending stream.")
-                yield f"data: {json.dumps({'type': 'status', 'status': 'completed'})}\n\n"
-                return
-
-            # 3. Set up Pub/Sub listeners for new responses and control signals
-            pubsub_response = await redis.create_pubsub()
-            await pubsub_response.subscribe(response_channel)
-            logger.debug(f"Subscribed to response channel: {response_channel}")
-
-            pubsub_control = await redis.create_pubsub()
-            await pubsub_control.subscribe(control_channel)
-            logger.debug(f"Subscribed to control channel: {control_channel}")
-
-            # Queue to communicate between listeners and the main generator loop
-            message_queue = asyncio.Queue()
-
-            async def listen_messages():
-                response_reader = pubsub_response.listen()
-                control_reader = pubsub_control.listen()
-                tasks = [asyncio.create_task(response_reader.__anext__()), asyncio.create_task(control_reader.__anext__())]
-
-                while not terminate_stream:
-                    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-                    for task in done:
-                        try:
-                            message = task.result()
-                            if message and isinstance(message, dict) and message.get("type") == "message":
-                                channel = message.get("channel")
-                                data = message.get("data")
-                                if isinstance(data, bytes): data = data.decode('utf-8')
-
-                                if channel == response_channel and data == "new":
-                                    await message_queue.put({"type": "new_response"})
-                                elif channel == control_channel and data in ["STOP", "END_STREAM", "ERROR"]:
-                                    logger.info(f"Received control signal '{data}' for {agent_run_id}")
-                                    await message_queue.put({"type": "control", "data": data})
-                                    return # Stop listening on control signal
-
-                        except StopAsyncIteration:
-                            logger.warning(f"Listener {task} stopped.")
-                            # Decide how to handle listener stopping, maybe terminate?
-                            await message_queue.put({"type": "error", "data": "Listener stopped unexpectedly"})
-                            return
-                        except Exception as e:
-                            logger.error(f"Error in listener for {agent_run_id}: {e}")
-                            await message_queue.put({"type": "error", "data": "Listener failed"})
-                            return
-                        finally:
-                            # Reschedule the completed listener task
-                            if task in tasks:
-                                tasks.remove(task)
-                                if message and isinstance(message, dict) and message.get("channel") == response_channel:
-                                     tasks.append(asyncio.create_task(response_reader.__anext__()))
-                                elif message and isinstance(message, dict) and message.get("channel") == control_channel:
-                                     tasks.append(asyncio.create_task(control_reader.__anext__()))
-
-                # Cancel pending listener tasks on exit
-                for p_task in pending: p_task.cancel()
-                for task in tasks: task.cancel()
-
-
-            listener_task = asyncio.create_task(listen_messages())
-
-            # 4. Main loop to process messages from the queue
-            while not terminate_stream:
-                try:
-                    queue_item = await message_queue.get()
-
-                    if queue_item["type"] == "new_response":
-                        # Fetch new responses from Redis list starting after the last processed index
-                        new_start_index = last_processed_index + 1
-                        new_responses_json = await redis.lrange(response_list_key, new_start_index, -1)
-
-                        if new_responses_json:
-                            new_responses = [json.loads(r) for r in new_responses_json]
-                            num_new = len(new_responses)
-                            logger.debug(f"Received {num_new} new responses for {agent_run_id} (index {new_start_index} onwards)")
-                            for response in new_responses:
-                                yield f"data: {json.dumps(response)}\n\n"
-                                # Check if this response signals completion
-                                if response.get('type') == 'status' and response.get('status') in ['completed', 'failed', 'stopped']:
-                                    logger.info(f"Detected run completion via status message in stream: {response.get('status')}")
-                                    terminate_stream = True
-                                    break # Stop processing further new responses
-                            last_processed_index += num_new
-                        if terminate_stream: break
-
-                    elif queue_item["type"] == "control":
-                        control_signal = queue_item["data"]
-                        terminate_stream = True # Stop the stream on any control signal
-                        yield f"data: {json.dumps({'type': 'status', 'status': control_signal})}\n\n"
-                        break
-
-                    elif queue_item["type"] == "error":
-                        logger.error(f"Listener error for {agent_run_id}: {queue_item['data']}")
-                        terminate_stream = True
-                        yield f"data: {json.dumps({'type': 'status', 'status': 'error'})}\n\n"
+            async with aclosing(run_broadcast.follow_frames(hub, last_id)) as frames:
+                async for entry_id, frame, terminal in frames:
+                    yield frame
+                    if terminal:
+                        logger.info(f"Detected end of agent run {agent_run_id} in stream")
                         break
 
-                except asyncio.CancelledError:
-                     logger.info(f"Stream generator main loop cancelled for {agent_run_id}")
-                     terminate_stream = True
-                     break
-                except Exception as loop_err:
-                    logger.error(f"Error in stream generator main loop for {agent_run_id}: {loop_err}", exc_info=True)
-                    terminate_stream = True
-                    yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {loop_err}'})}\n\n"
-                    break
-
+        except asyncio.CancelledError:
+            logger.info(f"Stream generator cancelled for {agent_run_id}")
+            raise
         except Exception as e:
-            logger.error(f"Error setting up stream for agent run {agent_run_id}: {e}", exc_info=True)
-            # Only yield error if initial yield didn't happen
+            logger.error(f"Error streaming agent run {agent_run_id}: {e}", exc_info=True)
             if not initial_yield_complete:
-                 yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Failed to start stream: {e}'})}\n\n"
+            else:
+                yield f"data: {json.dumps({'type': 'status', 'status': 'error', 'message': f'Stream failed: {e}'})}\n\n"
         finally:
-            terminate_stream = True
-            # Graceful shutdown order: unsubscribe → close → cancel
-            if pubsub_response: await pubsub_response.unsubscribe(response_channel)
-            if pubsub_control: await pubsub_control.unsubscribe(control_channel)
-            if pubsub_response: await pubsub_response.close()
-            if pubsub_control: await pubsub_control.close()
-
-            if listener_task:
-                listener_task.cancel()
-                try:
-                    await listener_task  # Reap inner tasks & swallow their errors
-                except asyncio.CancelledError:
-                    pass
-                except Exception as e:
-                    logger.debug(f"listener_task ended with: {e}")
-            # Wait briefly for tasks to cancel
-            await asyncio.sleep(0.1)
             logger.debug(f"Streaming cleanup complete for agent run: {agent_run_id}")
 
     return StreamingResponse(stream_generator(), media_type="text/event-stream", headers={
@@ -639,57 +589,76 @@ async def run_agent_background(
     enable_thinking: Optional[bool],
     reasoning_effort: Optional[str],
     stream: bool,
-    enable_context_manager: bool
+    enable_context_manager: bool,
+    account_id: Optional[str] = None
 ):
     """Run the agent in the background using Redis for state."""
     logger.debug(f"Starting background agent run: {agent_run_id} for thread: {thread_id} (Instance: {instance_id})")
     client = await db.client
     start_time = datetime.now(timezone.utc)
     total_responses = 0
-    pubsub = None
+    control_queue = None
     stop_checker = None
+    ttl_refresher = None
+    agent_gen = None
     stop_signal_received = False
+    run_task = asyncio.current_task()
+    stream_writer = response_stream.ResponseStreamWriter(agent_run_id)
+    persister = ResponsePersister(client, agent_run_id)
 
     # Define Redis keys and channels
-    response_list_key = f"agent_run:{agent_run_id}:responses"
-    response_channel = f"agent_run:{agent_run_id}:new_response"
     instance_control_channel = f"agent_run:{agent_run_id}:control:{instance_id}"
     global_control_channel = f"agent_run:{agent_run_id}:control"
     instance_active_key = f"active_run:{instance_id}:{agent_run_id}"
 
     async def check_for_stop_signal():
+        """Wait for STOP and cancel the run's task, interrupting whatever it awaits."""
         nonlocal stop_signal_received
-        if not pubsub: return
+        if not control_queue: return
         try:
-            while not stop_signal_received:
-                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-                if message and message.get("type") == "message":
-                    data = message.get("data")
-                    if isinstance(data, bytes): data = data.decode('utf-8')
-                    if data == "STOP":
-                        logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
-                        stop_signal_received = True
-                        break
-                # Periodically refresh the active run key TTL
-                if total_responses % 50 == 0: # Refresh every 50 responses or so
-                    try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
-                    except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
-                await asyncio.sleep(0.1) # Short sleep to prevent tight loop
+            while True:
+                _, data = await control_queue.get()
+                if data == "STOP":
+                    logger.info(f"Received STOP signal for agent run {agent_run_id} (Instance: {instance_id})")
+                    break
         except asyncio.CancelledError:
             logger.info(f"Stop signal checker cancelled for {agent_run_id} (Instance: {instance_id})")
+            return
         except Exception as e:
             logger.error(f"Error in stop signal checker for {agent_run_id}: {e}", exc_info=True)
-            stop_signal_received = True # Stop the run if the checker fails
+        # Also stop the run if the checker fails
+        stop_signal_received = True
+        run_task.cancel()
+
+    async def refresh_active_run_key():
+        """Keep the active run key alive for as long as the run goes on."""
+        while True:
+            await asyncio.sleep(ACTIVE_RUN_KEY_REFRESH_INTERVAL)
+            try: await redis.expire(instance_active_key, redis.REDIS_KEY_TTL)
+            except Exception as ttl_err: logger.warning(f"Failed to refresh TTL for {instance_active_key}: {ttl_err}")
+
+    async def stop_background_task(task: Optional[asyncio.Task]):
+        if task and not task.done():
+            task.cancel()
+            try: await task
+            except asyncio.CancelledError: pass
+            except Exception as e: logger.warning(f"Error during background task cancellation for {agent_run_id}: {e}")
 
     try:
-        # Setup Pub/Sub listener for control signals
-        pubsub = await redis.create_pubsub()
-        await pubsub.subscribe(instance_control_channel, global_control_channel)
+        # Listen for control signals on the process-wide pubsub connection
+        control_queue = asyncio.Queue()
+        await pubsub_multiplexer.subscribe(control_queue, instance_control_channel, global_control_channel)
         logger.debug(f"Subscribed to control channels: {instance_control_channel}, {global_control_channel}")
         stop_checker = asyncio.create_task(check_for_stop_signal())
 
+        # The new run counts towards the account's usage
+        if account_id:
+            await usage_ledger.track_live_run(account_id, agent_run_id, start_time)
+            await billing_status_cache.invalidate(account_id)
+
         # Ensure active run key exists and has TTL
         await redis.set(instance_active_key, "running", ex=redis.REDIS_KEY_TTL)
+        ttl_refresher = asyncio.create_task(refresh_active_run_key())
 
         # Initialize agent generator
         agent_gen = run_agent(
@@ -702,27 +671,42 @@ async def run_agent_background(
         final_status = "running"
         error_message = None
 
-        async for response in agent_gen:
-            if stop_signal_received:
+        try:
+            try:
+                async for response in agent_gen:
+                    # A STOP cancels this task; code that catches the cancellation
+                    # while cleaning up can still yield, so check the flag as well
+                    if stop_signal_received:
+                        break
+
+                    # Queue response for the run's Redis stream; terminal statuses are written at once
+                    await stream_writer.add(response)
+                    persister.add(response)
+                    total_responses += 1
+
+                    # Check for agent-signaled completion or error
+                    if response.get('type') == 'status':
+                         status_val = response.get('status')
+                         if status_val in ['completed', 'failed', 'stopped']:
+                             logger.info(f"Agent run {agent_run_id} finished via status message: {status_val}")
+                             final_status = status_val
+                             if status_val == 'failed' or status_val == 'stopped':
+                                 error_message = response.get('message', f"Run ended with status: {status_val}")
+                             break
+            finally:
+                # Once the checker is gone no further cancellation can come from it
+                await stop_background_task(stop_checker)
+        except asyncio.CancelledError:
+            if not stop_signal_received:
+                raise
+
+        if stop_signal_received:
+            # The cancellation was ours; let the final bookkeeping below run normally
+            if run_task.cancelling():
+                run_task.uncancel()
+            if final_status == "running":
                 logger.info(f"Agent run {agent_run_id} stopped by signal.")
                 final_status = "stopped"
-                break
-
-            # Store response in Redis list and publish notification
-            response_json = json.dumps(response)
-            await redis.rpush(response_list_key, response_json)
-            await redis.publish(response_channel, "new")
-            total_responses += 1
-
-            # Check for agent-signaled completion or error
-            if response.get('type') == 'status':
-                 status_val = response.get('status')
-                 if status_val in ['completed', 'failed', 'stopped']:
-                     logger.info(f"Agent run {agent_run_id} finished via status message: {status_val}")
-                     final_status = status_val
-                     if status_val == 'failed' or status_val == 'stopped':
-                         error_message = response.get('message', f"Run ended with status: {status_val}")
-                     break
 
         # If loop finished without explicit completion/error/stop signal, mark as completed
         if final_status == "running":
@@ -730,24 +714,23 @@ async def run_agent_background(
              duration = (datetime.now(timezone.utc) - start_time).total_seconds()
              logger.info(f"Agent run {agent_run_id} completed normally (duration: {duration:.2f}s, responses: {total_responses})")
              completion_message = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
-             await redis.rpush(response_list_key, json.dumps(completion_message))
-             await redis.publish(response_channel, "new") # Notify about the completion message
+             await stream_writer.add(completion_message)
+             persister.add(completion_message)
 
-        # Fetch final responses from Redis for DB update
-        all_responses_json = await redis.lrange(response_list_key, 0, -1)
-        all_responses = [json.loads(r) for r in all_responses_json]
+        # Write the last responses to the stream and the database
+        await stream_writer.flush()
+        await persister.flush(final=True)
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, final_status, error=error_message, responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, final_status, error=error_message)
 
-        # Publish final control signal (END_STREAM or ERROR)
+        # Send final control signal (END_STREAM or ERROR) to stream viewers
         control_signal = "END_STREAM" if final_status == "completed" else "ERROR" if final_status == "failed" else "STOP"
         try:
-            await redis.publish(global_control_channel, control_signal)
-            # No need to publish to instance channel as the run is ending on this instance
-            logger.debug(f"Published final control signal '{control_signal}' to {global_control_channel}")
+            await response_stream.append_control(agent_run_id, control_signal)
+            logger.debug(f"Added final control signal '{control_signal}' to response stream of {agent_run_id}")
         except Exception as e:
-            logger.warning(f"Failed to publish final control signal {control_signal}: {str(e)}")
+            logger.warning(f"Failed to add final control signal {control_signal}: {str(e)}")
 
     except Exception as e:
         error_message = str(e)
@@ -756,56 +739,60 @@ async def run_agent_background(
         logger.error(f"Error in agent run {agent_run_id} after {duration:.2f}s: {error_message}\n{traceback_str} (Instance: {instance_id})")
         final_status = "failed"
 
-        # Push error message to Redis list
+        # Append error message to the Redis stream
         error_response = {"type": "status", "status": "error", "message": error_message}
         try:
-            await redis.rpush(response_list_key, json.dumps(error_response))
-            await redis.publish(response_channel, "new")
+            await stream_writer.add(error_response)
+            await stream_writer.flush()
         except Exception as redis_err:
              logger.error(f"Failed to push error response to Redis for {agent_run_id}: {redis_err}")
 
-        # Fetch final responses (including the error)
-        all_responses = []
-        try:
-             all_responses_json = await redis.lrange(response_list_key, 0, -1)
-             all_responses = [json.loads(r) for r in all_responses_json]
-        except Exception as fetch_err:
-             logger.error(f"Failed to fetch responses from Redis after error for {agent_run_id}: {fetch_err}")
-             all_responses = [error_response] # Use the error message we tried to push
+        # Persist the remaining responses, including the error
+        persister.add(error_response)
+        await persister.flush(final=True)
 
         # Update DB status
-        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}", responses=all_responses)
+        await update_agent_run_status(client, agent_run_id, "failed", error=f"{error_message}\n{traceback_str}")
 
-        # Publish ERROR signal
+        # Send ERROR signal to stream viewers
         try:
-            await redis.publish(global_control_channel, "ERROR")
-            logger.debug(f"Published ERROR signal to {global_control_channel}")
+            await response_stream.append_control(agent_run_id, "ERROR")
+            logger.debug(f"Added ERROR signal to response stream of {agent_run_id}")
         except Exception as e:
-            logger.warning(f"Failed to publish ERROR signal: {str(e)}")
+            logger.warning(f"Failed to add ERROR signal: {str(e)}")
 
     finally:
-        # Cleanup stop checker task
-        if stop_checker and not stop_checker.done():
-            stop_checker.cancel()
-            try: await stop_checker
-            except asyncio.CancelledError: pass
-            except Exception as e: logger.warning(f"Error during stop_checker cancellation: {e}")
+        # Close the agent generator now, so its cleanup (and that of the tools it
+        # still runs) happens before the run is reported as ended
+        if agent_gen is not None:
+            try:
+                await agent_gen.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing agent generator for {agent_run_id}: {str(e)}")
+
+        # Cleanup stop checker and TTL refresh tasks
+        await stop_background_task(stop_checker)
+        await stop_background_task(ttl_refresher)
 
-        # Close pubsub connection
-        if pubsub:
+        # Release the control channel subscriptions
+        if control_queue:
             try:
-                await pubsub.unsubscribe()
-                await pubsub.close()
-                logger.debug(f"Closed pubsub connection for {agent_run_id}")
+                await pubsub_multiplexer.unsubscribe(control_queue, instance_control_channel, global_control_channel)
+                logger.debug(f"Unsubscribed from control channels for {agent_run_id}")
             except Exception as e:
-                logger.warning(f"Error closing pubsub for {agent_run_id}: {str(e)}")
+                logger.warning(f"Error unsubscribing control channels for {agent_run_id}: {str(e)}")
 
-        # Set TTL on the response list in Redis
-        await _cleanup_redis_response_list(agent_run_id)
+        # Set TTL on the response stream in Redis
+        await _cleanup_redis_response_stream(agent_run_id)
 
         # Remove the instance-specific active run key
         await _cleanup_redis_instance_key(agent_run_id)
 
+        # The run's minutes are in the usage ledger now
+        if account_id:
+            await usage_ledger.untrack_live_run(account_id, agent_run_id)
+            await billing_status_cache.invalidate(account_id)
+
         logger.info(f"Agent run background task fully completed for: {agent_run_id} (Instance: {instance_id}) with final status: {final_status}")
 
 async def generate_and_update_project_name(project_id: str, prompt: str):
@@ -914,11 +901,7 @@ async def initiate_agent_with_files(
                         upload_successful = False
                         try:
                             if hasattr(sandbox, 'fs') and hasattr(sandbox.fs, 'upload_file'):
-                                import inspect
-                                if inspect.iscoroutinefunction(sandbox.fs.upload_file):
-                                    await sandbox.fs.upload_file(target_path, content)
-                                else:
-                                    sandbox.fs.upload_file(target_path, content)
+                                await sandbox_call(sandbox_id, sandbox.fs.upload_file, target_path, content)
                                 logger.debug(f"Called sandbox.fs.upload_file for {target_path}")
                                 upload_successful = True
                             else:
@@ -930,7 +913,7 @@ async def initiate_agent_with_files(
                             try:
                                 await asyncio.sleep(0.2)
                                 parent_dir = os.path.dirname(target_path)
-                                files_in_dir = sandbox.fs.list_files(parent_dir)
+                                files_in_dir = await sandbox_call(sandbox_id, sandbox.fs.list_files, parent_dir)
                                 file_names_in_dir = [f.name for f in files_in_dir]
                                 if safe_filename in file_names_in_dir:
                                     successful_uploads.append(target_path)
@@ -982,16 +965,14 @@ async def initiate_agent_with_files(
             logger.warning(f"Failed to register agent run in Redis ({instance_key}): {str(e)}")
 
         # Run agent in background
-        task = asyncio.create_task(
-            run_agent_background(
-                agent_run_id=agent_run_id, thread_id=thread_id, instance_id=instance_id,
-                project_id=project_id, sandbox=sandbox,
-                model_name=MODEL_NAME_ALIASES.get(model_name, model_name),
-                enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
-                stream=stream, enable_context_manager=enable_context_manager
-            )
+        _start_agent_run_task(
+            agent_run_id, thread_id=thread_id, instance_id=instance_id,
+            project_id=project_id, sandbox=sandbox,
+            model_name=MODEL_NAME_ALIASES.get(model_name, model_name),
+            enable_thinking=enable_thinking, reasoning_effort=reasoning_effort,
+            stream=stream, enable_context_manager=enable_context_manager,
+            account_id=account_id
         )
-        task.add_done_callback(lambda _: asyncio.create_task(_cleanup_redis_instance_key(agent_run_id)))
 
         return {"thread_id": thread_id, "agent_run_id": agent_run_id}
 
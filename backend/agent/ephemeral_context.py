@@ -0,0 +1,59 @@
+"""
+Per-thread store for context the agent should see on its next iteration only.
+
+Browser actions produce the page state with a base64 screenshot, and
+see_image produces a base64 image. The agent needs the latest of each in the
+next LLM call and never again, so instead of going through the messages table
+they are kept in a Redis hash per thread, with a TTL in case no iteration
+consumes them. run_agent takes and deletes the whole hash in one transaction
+before each iteration.
+"""
+
+import json
+from typing import Any, Dict
+
+from services import redis
+from utils.logger import logger
+
+# Context kinds, one field of the thread's hash each; a newer value replaces the older one
+BROWSER_STATE = "browser_state"
+IMAGE_CONTEXT = "image_context"
+
+# Seconds unconsumed context is kept
+EPHEMERAL_CONTEXT_TTL = 3600
+
+
+def _context_key(thread_id: str) -> str:
+    """Get the Redis key of a thread's ephemeral context."""
+    return f"thread:{thread_id}:ephemeral_context"
+
+
+async def put(thread_id: str, kind: str, content: Dict[str, Any]) -> None:
+    """Store context for the thread's next iteration, replacing context of the same kind.
+
+    Args:
+        thread_id: The ID of the thread
+        kind: BROWSER_STATE or IMAGE_CONTEXT
+        content: The context; must be JSON serializable
+    """
+    await redis.hset_and_expire(_context_key(thread_id), kind, json.dumps(content), EPHEMERAL_CONTEXT_TTL)
+    logger.debug(f"Stored {kind} for thread {thread_id}")
+
+
+async def consume(thread_id: str) -> Dict[str, Dict[str, Any]]:
+    """Take the pending context of a thread; it is removed from the store.
+
+    Args:
+        thread_id: The ID of the thread
+
+    Returns:
+        Dict mapping each pending kind to its content
+    """
+    fields = await redis.hgetall_and_delete(_context_key(thread_id))
+    context = {}
+    for kind, value in fields.items():
+        try:
+            context[kind] = json.loads(value)
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse {kind} of thread {thread_id}: {e}")
+    return context
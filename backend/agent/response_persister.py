@@ -0,0 +1,138 @@
+"""
+Incremental, compacting persistence of agent run responses.
+
+The responses of a run are kept as segment rows in agent_run_response_segments
+and concatenated on read by the get_agent_run_responses database function.
+Instead of reading the whole response stream back and writing it in one update
+when the run ends, run_agent_background hands every response to a
+ResponsePersister. The persister inserts them in segments while the run goes
+on, through the append_agent_run_responses database function, so each write
+only covers its own segment and the final write only the last one.
+
+Streamed content chunks (stream_status "chunk") are not stored: the complete
+assistant message saved after the stream already holds their text. Chunks of
+a stream that never completed, e.g. because the run was stopped, are stored
+as one merged chunk when the run ends.
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from utils.background_tasks import BackgroundTasks
+from utils.logger import logger
+
+
+def _stream_status(response: Dict[str, Any]) -> Optional[str]:
+    """Get the stream_status of an assistant message, if it has one."""
+    if response.get('type') != 'assistant':
+        return None
+    metadata = response.get('metadata')
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            return None
+    return metadata.get('stream_status') if isinstance(metadata, dict) else None
+
+
+def _merge_chunks(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge the content chunks of one stream into a single chunk."""
+    text = []
+    for chunk in chunks:
+        try:
+            text.append(json.loads(chunk['content']).get('content') or '')
+        except (KeyError, TypeError, json.JSONDecodeError):
+            continue
+    return {
+        **chunks[-1],
+        "content": json.dumps({"role": "assistant", "content": "".join(text)}),
+        "created_at": chunks[0].get('created_at'),
+    }
+
+
+class ResponsePersister:
+    """Appends the compacted responses of one run to the database in segments.
+
+    A segment is written in the background once segment_size responses are
+    pending or flush_interval has passed since the last write. Writes are
+    serialized and keep the order of the responses.
+
+    Attributes:
+        agent_run_id (str): The ID of the agent run
+        segment_size (int): Number of pending responses that triggers a write
+        flush_interval (float): Seconds after which pending responses are written
+
+    Methods:
+        add: Queue a response for persistence
+        flush: Write the pending responses
+    """
+
+    def __init__(self, client, agent_run_id: str, segment_size: int = 100, flush_interval: float = 5.0):
+        """Initialize the persister.
+
+        Args:
+            client: Supabase client
+            agent_run_id: The ID of the agent run
+            segment_size: Number of pending responses that triggers a write
+            flush_interval: Seconds after which pending responses are written
+        """
+        self.client = client
+        self.agent_run_id = agent_run_id
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self._pending: List[Dict[str, Any]] = []
+        self._chunks: List[Dict[str, Any]] = []  # Chunks of the stream in progress
+        self._last_write = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._background = BackgroundTasks()
+
+    def add(self, response: Dict[str, Any]) -> None:
+        """Queue a response for persistence, writing a segment in the background when due.
+
+        Args:
+            response: Response message yielded by the agent
+        """
+        stream_status = _stream_status(response)
+        if stream_status == 'chunk':
+            self._chunks.append(response)
+            return
+        if stream_status == 'complete':
+            # The complete message holds the text of the chunks
+            self._chunks = []
+        self._pending.append(response)
+
+        if len(self._pending) >= self.segment_size or time.monotonic() - self._last_write >= self.flush_interval:
+            self._background.start(self.flush())
+
+    async def flush(self, final: bool = False) -> bool:
+        """Write the pending responses.
+
+        Args:
+            final: The run has ended; chunks of an unfinished stream are merged and written too
+
+        Returns:
+            True if everything pending was written
+        """
+        async with self._lock:
+            if final and self._chunks:
+                self._pending.append(_merge_chunks(self._chunks))
+                self._chunks = []
+            if not self._pending:
+                return True
+            segment = self._pending
+            self._pending = []
+            self._last_write = time.monotonic()
+            try:
+                await self.client.rpc('append_agent_run_responses', {
+                    'p_agent_run_id': self.agent_run_id,
+                    'p_responses': segment,
+                }).execute()
+                logger.debug(f"Persisted {len(segment)} responses for agent run {self.agent_run_id}")
+                return True
+            except Exception as e:
+                logger.error(f"Failed to persist responses for agent run {self.agent_run_id}: {str(e)}")
+                # Keep them for the next write, in order
+                self._pending = segment + self._pending
+                return False
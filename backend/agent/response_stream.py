@@ -0,0 +1,407 @@
+"""
+Redis Streams transport for agent run responses.
+
+run_agent_background appends every response of a run to one Redis stream
+with XADD. Viewers read the stream with a blocking XREAD from the id of the
+last entry they have seen, so there is no extra round trip to tell readers
+that something is new. A reader that
+reconnects resumes from its last entry id instead of re-reading the run.
+
+Control signals meant for viewers (STOP, END_STREAM, ERROR) are appended to
+the same stream as control entries, so they arrive in order with the responses.
+
+Streaming content deltas arrive dozens of times per second, so the producer
+writes through a ResponseStreamWriter, which coalesces the responses of a
+short window into one pipelined round trip.
+
+Viewers do not each hold a blocking read: a per-process
+ResponseStreamMultiplexer reads every followed stream with a single XREAD and
+hands the entries to the queues of the viewers following each run.
+
+Response entries hold the JSON payload exactly as it goes into the SSE frame,
+plus the status of status messages in a separate field, so readers can build
+frames and detect the end of a run without parsing the payload. The payload is
+encoded with orjson when it is installed.
+"""
+
+import asyncio
+import json
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Dict, List, Optional, Set, Tuple
+
+from services import redis
+from utils.background_tasks import BackgroundTasks
+from utils.logger import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Approximate cap on entries per run, enough for the chunks of very long runs
+RESPONSE_STREAM_MAXLEN = 100000
+# Blocking read timeout; must stay below the Redis client's 5s socket timeout
+READ_BLOCK_MS = 2000
+# Maximum entries returned by one read
+READ_COUNT = 500
+# Id that sorts before every stream entry
+STREAM_START_ID = "0-0"
+
+# Statuses of response messages after which a run produces nothing more
+TERMINAL_STATUSES = ('completed', 'failed', 'stopped')
+
+# Entries a follower may have queued before it is detached and catches up by itself
+FOLLOWER_QUEUE_SIZE = 1000
+# TTL of the key used to wake up the multiplexer's blocking read
+WAKEUP_KEY_TTL = 3600
+
+StreamEntry = Tuple[str, Dict[str, str]]
+
+
+def parse_entry_id(entry_id: str) -> Tuple[int, int]:
+    """Split a stream entry id into its (milliseconds, sequence) parts for comparison."""
+    milliseconds, _, sequence = entry_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def encode_response(response: Dict[str, Any]) -> str:
+    """Encode a response as the JSON payload of its SSE frame."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(response).decode('utf-8')
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the standard encoder handles them
+    return json.dumps(response)
+
+
+def response_fields(response: Dict[str, Any]) -> Dict[str, str]:
+    """Build the stream entry fields of a response.
+
+    Args:
+        response: Response message yielded by the agent
+
+    Returns:
+        The encoded payload under "data" and, under "status", the status of a
+        status message or an empty string for every other response
+    """
+    status = response.get('status') if response.get('type') == 'status' else None
+    return {"data": encode_response(response), "status": status if isinstance(status, str) else ""}
+
+
+def is_terminal(fields: Dict[str, str]) -> bool:
+    """Check whether a response entry ends the run, without parsing its payload."""
+    status = fields.get("status")
+    if status is None:
+        # Entry written before the status field existed
+        response = json.loads(fields["data"])
+        status = response.get('status') if response.get('type') == 'status' else None
+    return status in TERMINAL_STATUSES
+
+
+def response_stream_key(agent_run_id: str) -> str:
+    """Get the Redis key of a run's response stream."""
+    return f"agent_run:{agent_run_id}:response_stream"
+
+
+async def append_response(agent_run_id: str, response: Dict[str, Any]) -> str:
+    """Append a response to the run's stream.
+
+    Args:
+        agent_run_id: The ID of the agent run
+        response: Response message yielded by the agent
+
+    Returns:
+        Id of the new stream entry
+    """
+    return await redis.xadd(
+        response_stream_key(agent_run_id), response_fields(response), maxlen=RESPONSE_STREAM_MAXLEN
+    )
+
+
+async def append_control(agent_run_id: str, signal: str) -> str:
+    """Append a control signal for viewers to the run's stream.
+
+    Args:
+        agent_run_id: The ID of the agent run
+        signal: STOP, END_STREAM or ERROR
+
+    Returns:
+        Id of the new stream entry
+    """
+    return await redis.xadd(
+        response_stream_key(agent_run_id), {"control": signal}, maxlen=RESPONSE_STREAM_MAXLEN
+    )
+
+
+class ResponseStreamWriter:
+    """Coalesces the responses of one run into pipelined stream writes.
+
+    Responses are queued and written together once max_batch_size are queued
+    or flush_interval has passed since the first one, whichever comes first.
+    Terminal status messages are written at once, together with everything
+    queued before them. Writes are serialized, so entries keep their order.
+
+    Attributes:
+        agent_run_id (str): The ID of the agent run
+        max_batch_size (int): Number of queued responses that triggers an immediate write
+        flush_interval (float): Seconds a response may wait before it is written
+
+    Methods:
+        add: Queue a response, writing at once if it ends the run
+        flush: Write every queued response and wait for the write to finish
+    """
+
+    def __init__(self, agent_run_id: str, max_batch_size: int = 50, flush_interval: float = 0.05):
+        """Initialize the writer.
+
+        Args:
+            agent_run_id: The ID of the agent run
+            max_batch_size: Number of queued responses that triggers an immediate write
+            flush_interval: Seconds a response may wait before it is written
+        """
+        self.agent_run_id = agent_run_id
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._queue: List[Dict[str, str]] = []
+        self._lock = asyncio.Lock()
+        self._delayed_flush: Optional[asyncio.Task] = None
+        self._background = BackgroundTasks()
+
+    async def add(self, response: Dict[str, Any]) -> None:
+        """Queue a response for the run's stream.
+
+        Args:
+            response: Response message yielded by the agent
+
+        Raises:
+            Exception: If a write triggered by this response failed
+        """
+        fields = response_fields(response)
+        self._queue.append(fields)
+        if fields["status"] in TERMINAL_STATUSES:
+            await self.flush()
+        elif len(self._queue) >= self.max_batch_size:
+            await self.flush()
+        elif self._delayed_flush is None or self._delayed_flush.done():
+            self._delayed_flush = self._background.start(self._flush_later())
+
+    async def flush(self) -> None:
+        """Write every queued response and wait for the write to finish.
+
+        Raises:
+            Exception: If the write failed; the responses stay queued for the next flush
+        """
+        async with self._lock:
+            if not self._queue:
+                return
+            batch = self._queue
+            self._queue = []
+            try:
+                if len(batch) == 1:
+                    await redis.xadd(response_stream_key(self.agent_run_id), batch[0], maxlen=RESPONSE_STREAM_MAXLEN)
+                else:
+                    await redis.xadd_many(response_stream_key(self.agent_run_id), batch, maxlen=RESPONSE_STREAM_MAXLEN)
+            except BaseException:
+                # Responses added during the XADD follow the batch in the stream, so it goes first
+                self._queue = batch + self._queue
+                raise
+
+    async def _flush_later(self) -> None:
+        """Background flush once the coalescing window has passed."""
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"Failed to write responses to stream for {self.agent_run_id}: {str(e)}")
+
+
+async def read_entries(agent_run_id: str, last_id: str = STREAM_START_ID, block_ms: Optional[int] = None) -> List[StreamEntry]:
+    """Read the entries added to a run's stream after last_id.
+
+    Args:
+        agent_run_id: The ID of the agent run
+        last_id: Id of the last entry already seen
+        block_ms: Wait up to this long for new entries if there are none; None returns at once
+
+    Returns:
+        Up to READ_COUNT (entry id, fields) pairs, oldest first
+    """
+    return await redis.xread(response_stream_key(agent_run_id), last_id, count=READ_COUNT, block=block_ms)
+
+
+@dataclass(eq=False)
+class StreamFollower:
+    """One reader of a run's stream registered with the multiplexer.
+
+    Attributes:
+        cursor (Tuple[int, int]): Parsed id of the last entry queued for the follower
+        queue (asyncio.Queue): Entries waiting to be consumed
+        detached (bool): Set when the queue overflowed and the follower was dropped
+    """
+    cursor: Tuple[int, int]
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=FOLLOWER_QUEUE_SIZE))
+    detached: bool = False
+
+
+class ResponseStreamMultiplexer:
+    """Reads the streams of every followed run with one blocking XREAD.
+
+    Each run is read from the oldest cursor among its followers, and an entry
+    is queued only for followers that have not seen it yet, so followers that
+    join at different positions share the same read. Registering a follower
+    wakes the pending read through a per-process wakeup stream, so the new run
+    is included right away rather than after the block timeout.
+
+    Methods:
+        follow: Register a follower of a run
+        unfollow: Remove a follower
+        close: Stop reading and drop every follower
+    """
+
+    def __init__(self):
+        """Initialize a multiplexer; the read loop starts with the first follower."""
+        self._followers: Dict[str, Set[StreamFollower]] = {}
+        self._wakeup_key = f"response_stream_mux:{uuid.uuid4()}"
+        self._reader: Optional[asyncio.Task] = None
+        self._reading = False
+        # Id of the last wakeup seen; a wakeup added before the XREAD is sent is still read
+        self._wakeup_id = STREAM_START_ID
+
+    async def follow(self, agent_run_id: str, last_id: str = STREAM_START_ID) -> StreamFollower:
+        """Register a follower of a run.
+
+        Args:
+            agent_run_id: The ID of the agent run
+            last_id: Id of the last entry the follower has already seen
+
+        Returns:
+            Follower whose queue receives the (entry id, fields) pairs after last_id
+        """
+        follower = StreamFollower(cursor=parse_entry_id(last_id))
+        self._followers.setdefault(agent_run_id, set()).add(follower)
+
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+        elif self._reading:
+            # Interrupt the pending read so it picks up the new follower
+            await redis.xadd(self._wakeup_key, {"wakeup": "1"}, maxlen=1)
+            await redis.expire(self._wakeup_key, WAKEUP_KEY_TTL)
+        return follower
+
+    def unfollow(self, agent_run_id: str, follower: StreamFollower) -> None:
+        """Remove a follower; a run is no longer read once it has none.
+
+        Args:
+            agent_run_id: The ID of the agent run
+            follower: Follower returned by follow()
+        """
+        followers = self._followers.get(agent_run_id)
+        if followers is None:
+            return
+        followers.discard(follower)
+        if not followers:
+            del self._followers[agent_run_id]
+
+    async def close(self) -> None:
+        """Stop reading and drop every follower."""
+        self._followers.clear()
+        if self._reader and not self._reader.done():
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        self._reader = None
+
+    async def _read(self) -> None:
+        """Read and dispatch entries until no run is followed."""
+        while self._followers:
+            run_ids = {response_stream_key(agent_run_id): agent_run_id for agent_run_id in self._followers}
+            starts: Dict[str, Tuple[int, int]] = {}
+            streams = {self._wakeup_key: self._wakeup_id}
+            for key, agent_run_id in run_ids.items():
+                starts[agent_run_id] = min(follower.cursor for follower in self._followers[agent_run_id])
+                streams[key] = f"{starts[agent_run_id][0]}-{starts[agent_run_id][1]}"
+
+            try:
+                self._reading = True
+                results = await redis.xread_streams(streams, count=READ_COUNT, block=READ_BLOCK_MS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error reading response streams: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            finally:
+                self._reading = False
+
+            for key, entries in results:
+                if key == self._wakeup_key:
+                    self._wakeup_id = entries[-1][0]
+                    continue
+                agent_run_id = run_ids.get(key)
+                if agent_run_id is not None:
+                    self._dispatch(agent_run_id, entries, starts[agent_run_id])
+
+    def _dispatch(self, agent_run_id: str, entries: List[StreamEntry], start: Tuple[int, int]) -> None:
+        """Queue entries for the followers of a run that have not seen them."""
+        for follower in list(self._followers.get(agent_run_id, ())):
+            if follower.cursor < start:
+                # Joined during this read; the entries before start come with the next one
+                continue
+            for entry_id, fields in entries:
+                parsed_id = parse_entry_id(entry_id)
+                if parsed_id <= follower.cursor:
+                    continue
+                if follower.queue.full():
+                    # A slow consumer must not hold back the read for everyone else
+                    logger.debug(f"Detaching lagging follower of {agent_run_id}")
+                    follower.detached = True
+                    self.unfollow(agent_run_id, follower)
+                    break
+                follower.queue.put_nowait((entry_id, fields))
+                follower.cursor = parsed_id
+
+
+stream_multiplexer = ResponseStreamMultiplexer()
+
+
+async def follow_entries(agent_run_id: str, last_id: str = STREAM_START_ID) -> AsyncGenerator[StreamEntry, None]:
+    """Yield the entries of a run's stream after last_id as they are added.
+
+    Entries are read through the process-wide multiplexer. The generator never
+    finishes on its own; callers stop iterating once they see a terminal status
+    or a control entry, and should close it (e.g. with contextlib.aclosing) so
+    the follower is removed right away.
+
+    Args:
+        agent_run_id: The ID of the agent run
+        last_id: Id of the last entry already seen
+    """
+    follower = await stream_multiplexer.follow(agent_run_id, last_id)
+    try:
+        while True:
+            if follower.detached and follower.queue.empty():
+                # Dropped for lagging behind; rejoin from the last entry yielded
+                follower = await stream_multiplexer.follow(agent_run_id, last_id)
+            entry_id, fields = await follower.queue.get()
+            last_id = entry_id
+            yield entry_id, fields
+    finally:
+        stream_multiplexer.unfollow(agent_run_id, follower)
+
+
+async def expire(agent_run_id: str, ttl: int) -> None:
+    """Set a TTL on a run's stream."""
+    key = response_stream_key(agent_run_id)
+    try:
+        await redis.expire(key, ttl)
+        logger.debug(f"Set TTL ({ttl}s) on response stream: {key}")
+    except Exception as e:
+        logger.warning(f"Failed to set TTL on response stream {key}: {str(e)}")
+
+
+async def delete(agent_run_id: str) -> None:
+    """Delete a run's stream."""
+    await redis.delete(response_stream_key(agent_run_id))
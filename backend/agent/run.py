@@ -1,6 +1,7 @@
 import os
 import json
 import re
+from contextlib import aclosing
 from uuid import uuid4
 from typing import Optional
 
@@ -23,6 +24,8 @@ from utils import logger
 from utils.auth_utils import get_account_id_from_thread
 from services.billing import check_billing_status
 from agent.tools.sb_vision_tool import SandboxVisionTool
+from agent import ephemeral_context
+from services.screenshot_store import screenshot_store
 
 load_dotenv()
 
@@ -40,7 +43,8 @@ async def run_agent(
 ):
     """Run the development agent with specified configuration."""
     
-    thread_manager = ThreadManager()
+    # Share the process-wide connection and caches, but register this run's tools separately
+    thread_manager = (thread_manager or ThreadManager()).for_run()
 
     client = await thread_manager.db.client
 
@@ -61,18 +65,22 @@ async def run_agent(
     
     # Initialize tools with project_id instead of sandbox object
     # This ensures each tool independently verifies it's operating on the correct project
-    thread_manager.add_tool(SandboxShellTool, project_id=project_id, thread_manager=thread_manager)
-    thread_manager.add_tool(SandboxFilesTool, project_id=project_id, thread_manager=thread_manager)
-    thread_manager.add_tool(SandboxBrowserTool, project_id=project_id, thread_id=thread_id, thread_manager=thread_manager)
-    thread_manager.add_tool(SandboxDeployTool, project_id=project_id, thread_manager=thread_manager)
-    thread_manager.add_tool(SandboxExposeTool, project_id=project_id, thread_manager=thread_manager)
-    thread_manager.add_tool(MessageTool) # we are just doing this via prompt as there is no need to call it as a tool
-    thread_manager.add_tool(WebSearchTool)
-    thread_manager.add_tool(SandboxVisionTool, project_id=project_id, thread_id=thread_id, thread_manager=thread_manager)
+    tools = [
+        (SandboxShellTool, {"project_id": project_id, "thread_manager": thread_manager}),
+        (SandboxFilesTool, {"project_id": project_id, "thread_manager": thread_manager}),
+        (SandboxBrowserTool, {"project_id": project_id, "thread_id": thread_id, "thread_manager": thread_manager}),
+        (SandboxDeployTool, {"project_id": project_id, "thread_manager": thread_manager}),
+        (SandboxExposeTool, {"project_id": project_id, "thread_manager": thread_manager}),
+        (MessageTool, {}), # we are just doing this via prompt as there is no need to call it as a tool
+        (WebSearchTool, {}),
+        (SandboxVisionTool, {"project_id": project_id, "thread_id": thread_id, "thread_manager": thread_manager}),
+    ]
         
     # Add data providers tool if RapidAPI key is available
     if config.RAPID_API_KEY:
-        thread_manager.add_tool(DataProvidersTool)
+        tools.append((DataProvidersTool, {}))
+
+    thread_manager.add_tools(tools)
 
     system_message = { "role": "system", "content": get_system_prompt() }
 
@@ -94,30 +102,45 @@ async def run_agent(
                 "message": error_msg
             }
             break
-        # Check if last message is from assistant using direct Supabase query
-        latest_message = await client.table('messages').select('*').eq('thread_id', thread_id).in_('type', ['assistant', 'tool', 'user']).order('created_at', desc=True).limit(1).execute()  
-        if latest_message.data and len(latest_message.data) > 0:
-            message_type = latest_message.data[0].get('type')
-            if message_type == 'assistant':
-                print(f"Last message was from assistant, stopping execution")
-                continue_execution = False
-                break
+
+        # Messages are written in batches - make sure the reads below see all of them
+        await thread_manager.flush_messages(thread_id)
+
+        # One round trip for the last message type and the history added since the last read
+        state_result = await client.rpc('get_agent_iteration_state', {
+            'p_thread_id': thread_id,
+            'p_after_seq': thread_manager.message_cache.refresh_after(thread_id),
+        }).execute()
+        iteration_state = state_result.data or {}
+        if iteration_state.get('messages'):
+            await thread_manager.message_cache.apply_rows(thread_id, iteration_state['messages'])
+
+        # Check if last message is from assistant
+        if iteration_state.get('last_message_type') == 'assistant':
+            print(f"Last message was from assistant, stopping execution")
+            continue_execution = False
+            break
             
         # ---- Temporary Message Handling (Browser State & Image Context) ----
         temporary_message = None
         temp_message_content_list = [] # List to hold text/image blocks
 
-        # Get the latest browser_state message
-        latest_browser_state_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'browser_state').order('created_at', desc=True).limit(1).execute()
-        if latest_browser_state_msg.data and len(latest_browser_state_msg.data) > 0:
+        # Take the browser state and image context left by the previous iteration's tools
+        pending_context = await ephemeral_context.consume(thread_id)
+
+        # Use the latest browser state
+        if pending_context.get(ephemeral_context.BROWSER_STATE):
             try:
-                browser_content = json.loads(latest_browser_state_msg.data[0]["content"])
+                browser_content = pending_context[ephemeral_context.BROWSER_STATE]
                 screenshot_base64 = browser_content.get("screenshot_base64")
+                if not screenshot_base64 and browser_content.get("screenshot_hash"):
+                    screenshot_base64 = await screenshot_store.get_base64(browser_content["screenshot_hash"])
                 # Create a copy of the browser state without screenshot
                 browser_state_text = browser_content.copy()
                 browser_state_text.pop('screenshot_base64', None)
                 browser_state_text.pop('screenshot_url', None)
                 browser_state_text.pop('screenshot_url_base64', None)
+                browser_state_text.pop('screenshot_hash', None)
 
                 if browser_state_text:
                     temp_message_content_list.append({
@@ -133,16 +156,13 @@ async def run_agent(
                     })
                 else:
                     logger.warning("Browser state found but no screenshot base64 data.")
-                
-                await client.table('messages').delete().eq('message_id', latest_browser_state_msg.data[0]["message_id"]).execute()
             except Exception as e:
                 logger.error(f"Error parsing browser state: {e}")
 
-        # Get the latest image_context message (NEW)
-        latest_image_context_msg = await client.table('messages').select('*').eq('thread_id', thread_id).eq('type', 'image_context').order('created_at', desc=True).limit(1).execute()
-        if latest_image_context_msg.data and len(latest_image_context_msg.data) > 0:
+        # Use the latest image context
+        if pending_context.get(ephemeral_context.IMAGE_CONTEXT):
             try:
-                image_context_content = json.loads(latest_image_context_msg.data[0]["content"])
+                image_context_content = pending_context[ephemeral_context.IMAGE_CONTEXT]
                 base64_image = image_context_content.get("base64")
                 mime_type = image_context_content.get("mime_type")
                 file_path = image_context_content.get("file_path", "unknown file")
@@ -160,8 +180,6 @@ async def run_agent(
                     })
                 else:
                     logger.warning(f"Image context found for '{file_path}' but missing base64 or mime_type.")
-                
-                await client.table('messages').delete().eq('message_id', latest_image_context_msg.data[0]["message_id"]).execute()
             except Exception as e:
                 logger.error(f"Error parsing image context: {e}")
 
@@ -205,46 +223,48 @@ async def run_agent(
         # Track if we see ask, complete, or web-browser-takeover tool calls
         last_tool_call = None
         
-        async for chunk in response:
-            # print(f"CHUNK: {chunk}") # Uncomment for detailed chunk logging
-
-            # Check for XML versions like <ask>, <complete>, or <web-browser-takeover> in assistant content chunks
-            if chunk.get('type') == 'assistant' and 'content' in chunk:
-                try:
-                    # The content field might be a JSON string or object
-                    content = chunk.get('content', '{}')
-                    if isinstance(content, str):
-                        assistant_content_json = json.loads(content)
-                    else:
-                        assistant_content_json = content
+        # Closing run_agent closes the response generator too, which stops its running tools
+        async with aclosing(response):
+            async for chunk in response:
+                # print(f"CHUNK: {chunk}") # Uncomment for detailed chunk logging
+
+                # Check for XML versions like <ask>, <complete>, or <web-browser-takeover> in assistant content chunks
+                if chunk.get('type') == 'assistant' and 'content' in chunk:
+                    try:
+                        # The content field might be a JSON string or object
+                        content = chunk.get('content', '{}')
+                        if isinstance(content, str):
+                            assistant_content_json = json.loads(content)
+                        else:
+                            assistant_content_json = content
                         
-                    # The actual text content is nested within
-                    assistant_text = assistant_content_json.get('content', '')
-                    if isinstance(assistant_text, str): # Ensure it's a string
-                         # Check for the closing tags as they signal the end of the tool usage
-                        if '</ask>' in assistant_text or '</complete>' in assistant_text or '</web-browser-takeover>' in assistant_text:
-                           if '</ask>' in assistant_text:
-                               xml_tool = 'ask'
-                           elif '</complete>' in assistant_text:
-                               xml_tool = 'complete'
-                           elif '</web-browser-takeover>' in assistant_text:
-                               xml_tool = 'web-browser-takeover'
-                           
-                           last_tool_call = xml_tool
-                           print(f"Agent used XML tool: {xml_tool}")
-                except json.JSONDecodeError:
-                    # Handle cases where content might not be valid JSON
-                    print(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}")
-                except Exception as e:
-                    print(f"Error processing assistant chunk: {e}")
+                        # The actual text content is nested within
+                        assistant_text = assistant_content_json.get('content', '')
+                        if isinstance(assistant_text, str): # Ensure it's a string
+                            # Check for the closing tags as they signal the end of the tool usage
+                            # (one pass with the registry's tag matcher instead of one scan per tag)
+                            closed_tags = thread_manager.tool_registry.tag_matcher.closed_tags(assistant_text)
+                            for xml_tool in ('ask', 'complete', 'web-browser-takeover'):
+                                if xml_tool in closed_tags:
+                                    last_tool_call = xml_tool
+                                    print(f"Agent used XML tool: {xml_tool}")
+                                    break
+                    except json.JSONDecodeError:
+                        # Handle cases where content might not be valid JSON
+                        print(f"Warning: Could not parse assistant content JSON: {chunk.get('content')}")
+                    except Exception as e:
+                        print(f"Error processing assistant chunk: {e}")
                     
-            yield chunk
+                yield chunk
         
         # Check if we should stop based on the last tool call
         if last_tool_call in ['ask', 'complete', 'web-browser-takeover']:
             print(f"Agent decided to stop with tool: {last_tool_call}")
             continue_execution = False
 
+    # Store any status messages still queued before the run is reported as finished
+    await thread_manager.flush_messages(thread_id)
+
 
 # # TESTING
 
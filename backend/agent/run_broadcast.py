@@ -0,0 +1,284 @@
+"""
+In-process fan-out of agent run output to every local viewer of a run.
+
+Several browser tabs or share-page viewers often watch the same run. Instead
+of each viewer following the run's Redis stream and building its own SSE
+frames, the first viewer in a process opens a RunBroadcastHub for the run. The
+hub follows the stream once, builds each SSE frame once and hands the same
+frame to every local subscriber. The most recent frames are kept in a bounded
+ring buffer, so a viewer that joins late replays them from memory and only
+reads the older part of the run from Redis.
+
+A subscriber that falls too far behind is dropped by the hub and continues on
+its own from the last frame it received, so it never holds back the others.
+"""
+
+import asyncio
+import json
+from collections import deque
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from typing import AsyncGenerator, Deque, Dict, Optional, Set, Tuple
+
+from agent import response_stream
+from utils.logger import logger
+
+# Frames kept in memory per run for viewers that join late
+RING_BUFFER_SIZE = 1000
+# Frames a subscriber may have queued before it is dropped by the hub
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# (parsed entry id, entry id, SSE frame, whether the frame ends the run)
+Frame = Tuple[Tuple[int, int], str, bytes, bool]
+
+
+def encode_frame(fields: Dict[str, str]) -> Tuple[bytes, bool]:
+    """Build the SSE frame of a stream entry.
+
+    The stored payload is already the frame's JSON, so it is not parsed.
+
+    Args:
+        fields: Fields of a response or control entry
+
+    Returns:
+        The encoded frame and whether it ends the run
+    """
+    if "control" in fields:
+        return f"data: {json.dumps({'type': 'status', 'status': fields['control']})}\n\n".encode('utf-8'), True
+    return b"data: " + fields["data"].encode('utf-8') + b"\n\n", response_stream.is_terminal(fields)
+
+
+@dataclass(eq=False)
+class HubSubscriber:
+    """One local viewer registered with a hub.
+
+    Attributes:
+        queue (asyncio.Queue): Frames waiting to be sent; None marks that the hub went away
+        dropped (bool): Set when the subscriber lagged behind and was removed from the hub
+    """
+    queue: asyncio.Queue = field(default_factory=lambda: asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE))
+    dropped: bool = False
+
+
+class RunBroadcastHub:
+    """Follows one run's stream and broadcasts its frames to local subscribers.
+
+    Attributes:
+        agent_run_id (str): The ID of the agent run
+        replay_from (Tuple[int, int]): Parsed id of the newest entry that is not in the ring buffer
+        closed (bool): Set once the hub stopped following the run
+
+    Methods:
+        subscribe: Register a subscriber and get the buffered frames to replay
+        unsubscribe: Remove a subscriber; the hub closes when the last one leaves
+        close: Stop following the run and release every subscriber
+    """
+
+    def __init__(self, agent_run_id: str, start_id: str, on_close=None):
+        """Initialize a hub that broadcasts the entries after start_id.
+
+        Args:
+            agent_run_id: The ID of the agent run
+            start_id: Id of the last entry the hub does not need to broadcast
+            on_close: Called with the hub once it closes
+        """
+        self.agent_run_id = agent_run_id
+        self.replay_from = response_stream.parse_entry_id(start_id)
+        self.closed = False
+        self._start_id = start_id
+        self._buffer: Deque[Frame] = deque(maxlen=RING_BUFFER_SIZE)
+        self._subscribers: Set[HubSubscriber] = set()
+        self._on_close = on_close
+        self._pump = asyncio.create_task(self._follow())
+        # A done callback also runs when the task is cancelled before it ever started,
+        # which a finally block inside _follow would miss
+        self._pump.add_done_callback(self._shutdown)
+
+    def subscribe(self) -> Tuple[HubSubscriber, Tuple[int, int], Tuple[Frame, ...]]:
+        """Register a subscriber and get the buffered frames to replay.
+
+        The snapshot and the registration happen without yielding to the event
+        loop, so every frame is either in the snapshot or queued for the subscriber.
+
+        Returns:
+            The subscriber, the parsed id of the newest entry not in the
+            snapshot, and the buffered frames, oldest first
+        """
+        subscriber = HubSubscriber()
+        self._subscribers.add(subscriber)
+        return subscriber, self.replay_from, tuple(self._buffer)
+
+    def unsubscribe(self, subscriber: HubSubscriber) -> None:
+        """Remove a subscriber; the hub closes when the last one leaves.
+
+        Args:
+            subscriber: Subscriber returned by subscribe()
+        """
+        self._subscribers.discard(subscriber)
+        if not self._subscribers and not self.closed:
+            self._pump.cancel()
+
+    def close(self) -> None:
+        """Stop following the run and release every subscriber."""
+        if not self._pump.done():
+            self._pump.cancel()
+
+    async def _follow(self) -> None:
+        """Follow the run's stream and broadcast every entry until the run ends."""
+        try:
+            async with aclosing(response_stream.follow_entries(self.agent_run_id, self._start_id)) as entries:
+                async for entry_id, fields in entries:
+                    frame, terminal = encode_frame(fields)
+                    self._publish((response_stream.parse_entry_id(entry_id), entry_id, frame, terminal))
+                    if terminal:
+                        break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Error broadcasting agent run {self.agent_run_id}: {str(e)}")
+
+    def _shutdown(self, _: asyncio.Task) -> None:
+        """Unregister the hub and release its subscribers once the pump task is done."""
+        self.closed = True
+        if self._on_close:
+            self._on_close(self)
+        # Subscribers left behind without a terminal frame continue on their own
+        for subscriber in self._subscribers:
+            if not subscriber.queue.full():
+                subscriber.queue.put_nowait(None)
+            else:
+                subscriber.dropped = True
+        self._subscribers.clear()
+
+    def _publish(self, frame: Frame) -> None:
+        """Buffer a frame and queue it for every subscriber."""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.replay_from = self._buffer[0][0]
+        self._buffer.append(frame)
+        for subscriber in list(self._subscribers):
+            if subscriber.queue.full():
+                logger.debug(f"Dropping lagging subscriber of {self.agent_run_id}")
+                subscriber.dropped = True
+                self._subscribers.discard(subscriber)
+                continue
+            subscriber.queue.put_nowait(frame)
+
+
+class RunBroadcaster:
+    """Keeps the hub of every run with local viewers in this process.
+
+    Methods:
+        get: Get the open hub of a run, if any
+        open: Get the hub of a run, opening one that starts after start_id if needed
+        close: Close every hub
+    """
+
+    def __init__(self):
+        """Initialize a broadcaster without hubs."""
+        self._hubs: Dict[str, RunBroadcastHub] = {}
+
+    def get(self, agent_run_id: str) -> Optional[RunBroadcastHub]:
+        """Get the open hub of a run.
+
+        Args:
+            agent_run_id: The ID of the agent run
+
+        Returns:
+            The hub, or None if no local viewer is following the run
+        """
+        hub = self._hubs.get(agent_run_id)
+        return hub if hub is not None and not hub.closed else None
+
+    def open(self, agent_run_id: str, start_id: str) -> RunBroadcastHub:
+        """Get the hub of a run, opening one that starts after start_id if needed.
+
+        Args:
+            agent_run_id: The ID of the agent run
+            start_id: Id of the last entry a new hub does not need to broadcast
+
+        Returns:
+            The run's hub
+        """
+        hub = self.get(agent_run_id)
+        if hub is None:
+            hub = RunBroadcastHub(agent_run_id, start_id, on_close=self._forget)
+            self._hubs[agent_run_id] = hub
+            logger.debug(f"Opened broadcast hub for agent run {agent_run_id}")
+        return hub
+
+    def close(self) -> None:
+        """Close every hub."""
+        for hub in list(self._hubs.values()):
+            hub.close()
+        self._hubs.clear()
+
+    def _forget(self, hub: RunBroadcastHub) -> None:
+        """Remove a closed hub unless it was already replaced."""
+        if self._hubs.get(hub.agent_run_id) is hub:
+            del self._hubs[hub.agent_run_id]
+
+
+run_broadcaster = RunBroadcaster()
+
+
+async def _read_frames(agent_run_id: str, last_id: str, until: Tuple[int, int]) -> AsyncGenerator[Tuple[str, bytes, bool], None]:
+    """Yield the frames of the stored entries after last_id up to and including until."""
+    while True:
+        entries = await response_stream.read_entries(agent_run_id, last_id)
+        for entry_id, fields in entries:
+            if response_stream.parse_entry_id(entry_id) > until:
+                return
+            last_id = entry_id
+            frame, terminal = encode_frame(fields)
+            yield entry_id, frame, terminal
+        if len(entries) < response_stream.READ_COUNT:
+            return
+
+
+async def follow_frames(hub: RunBroadcastHub, last_id: str = response_stream.STREAM_START_ID) -> AsyncGenerator[Tuple[str, bytes, bool], None]:
+    """Yield the SSE frames of a run after last_id through its broadcast hub.
+
+    Frames that left the hub's ring buffer are read from Redis first. If the
+    hub drops the subscriber or closes before the run ends, the run is
+    followed directly from the last frame yielded. Callers stop iterating
+    after a terminal frame and should close the generator (e.g. with
+    contextlib.aclosing) so the subscriber is removed right away.
+
+    Args:
+        hub: Hub of the run
+        last_id: Id of the last entry already sent to the viewer
+
+    Yields:
+        (entry id, frame, whether the frame ends the run) tuples
+    """
+    subscriber, replay_from, buffered = hub.subscribe()
+    cursor = response_stream.parse_entry_id(last_id)
+    try:
+        # 1. Entries older than the ring buffer
+        if replay_from > cursor:
+            async for entry_id, frame, terminal in _read_frames(hub.agent_run_id, last_id, replay_from):
+                last_id, cursor = entry_id, response_stream.parse_entry_id(entry_id)
+                yield entry_id, frame, terminal
+
+        # 2. Buffered frames, then live ones
+        for parsed_id, entry_id, frame, terminal in buffered:
+            if parsed_id > cursor:
+                last_id, cursor = entry_id, parsed_id
+                yield entry_id, frame, terminal
+        while not (subscriber.dropped and subscriber.queue.empty()):
+            item = await subscriber.queue.get()
+            if item is None:
+                break
+            parsed_id, entry_id, frame, terminal = item
+            if parsed_id > cursor:
+                last_id, cursor = entry_id, parsed_id
+                yield entry_id, frame, terminal
+    finally:
+        hub.unsubscribe(subscriber)
+
+    # 3. Left behind by the hub; follow the run from the last frame sent
+    logger.debug(f"Following agent run {hub.agent_run_id} directly from {last_id}")
+    async with aclosing(response_stream.follow_entries(hub.agent_run_id, last_id)) as entries:
+        async for entry_id, fields in entries:
+            frame, terminal = encode_frame(fields)
+            yield entry_id, frame, terminal
@@ -10,6 +10,8 @@ from agent.tools.data_providers.TwitterProvider import TwitterProvider
 class DataProvidersTool(Tool):
     """Tool for making requests to various data providers."""
 
+    stateless = True
+
     def __init__(self):
         super().__init__()
 
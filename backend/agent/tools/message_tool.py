@@ -8,6 +8,8 @@ class MessageTool(Tool):
     This tool provides methods for asking questions, with support for
     attachments and user takeover suggestions.
     """
+
+    stateless = True
     
     def __init__(self):
         super().__init__()
@@ -1,10 +1,16 @@
 import traceback
 import json
 
+import httpx
+
 from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from agentpress.thread_manager import ThreadManager
 from sandbox.sandbox import SandboxToolsBase, Sandbox
+from sandbox.browser_client import sandbox_browser_client, BrowserAPIUnreachable, BrowserAPIError
+from sandbox.sandbox_io import SDK_TIMEOUT_MARGIN
 from utils.logger import logger
+from agent import ephemeral_context
+from services.screenshot_store import screenshot_store
 
 
 class SandboxBrowserTool(SandboxToolsBase):
@@ -14,6 +20,41 @@ class SandboxBrowserTool(SandboxToolsBase):
         super().__init__(project_id, thread_manager)
         self.thread_id = thread_id
 
+    async def _execute_browser_action_via_exec(self, endpoint: str, params: dict = None, method: str = "POST") -> dict:
+        """Call the browser API with curl inside the sandbox, for when it cannot be reached directly
+
+        Args:
+            endpoint (str): The API endpoint to call
+            params (dict, optional): Parameters to send. Defaults to None.
+            method (str, optional): HTTP method to use. Defaults to "POST".
+
+        Returns:
+            dict: The parsed JSON response
+        """
+        # Build the curl command
+        url = f"http://localhost:8002/api/automation/{endpoint}"
+
+        if method == "GET" and params:
+            query_params = "&".join([f"{k}={v}" for k, v in params.items()])
+            url = f"{url}?{query_params}"
+            curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
+        else:
+            curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
+            if params:
+                json_data = json.dumps(params)
+                curl_cmd += f" -d '{json_data}'"
+
+        logger.debug("\033[95mExecuting curl command:\033[0m")
+        logger.debug(f"{curl_cmd}")
+
+        response = await self._sandbox_call(
+            self.sandbox.process.exec, curl_cmd, timeout=30,
+            call_timeout=30 + SDK_TIMEOUT_MARGIN
+        )
+        if response.exit_code != 0:
+            raise RuntimeError(f"Browser automation request failed: {response}")
+        return json.loads(response.result)
+
     async def _execute_browser_action(self, endpoint: str, params: dict = None, method: str = "POST") -> ToolResult:
         """Execute a browser automation action through the API
         
@@ -29,75 +70,72 @@ class SandboxBrowserTool(SandboxToolsBase):
             # Ensure sandbox is initialized
             await self._ensure_sandbox()
             
-            # Build the curl command
-            url = f"http://localhost:8002/api/automation/{endpoint}"
-            
-            if method == "GET" and params:
-                query_params = "&".join([f"{k}={v}" for k, v in params.items()])
-                url = f"{url}?{query_params}"
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-            else:
-                curl_cmd = f"curl -s -X {method} '{url}' -H 'Content-Type: application/json'"
-                if params:
-                    json_data = json.dumps(params)
-                    curl_cmd += f" -d '{json_data}'"
-            
-            logger.debug("\033[95mExecuting curl command:\033[0m")
-            logger.debug(f"{curl_cmd}")
-            
-            response = self.sandbox.process.exec(curl_cmd, timeout=30)
-            
-            if response.exit_code == 0:
+            try:
+                result = await sandbox_browser_client.request(self.sandbox, endpoint, params, method)
+            except BrowserAPIUnreachable as e:
+                # Only safe because the request never reached the sandbox; actions must not run twice
+                logger.warning(f"Browser API not reachable through the preview link, using curl in the sandbox: {e}")
+                result = await self._execute_browser_action_via_exec(endpoint, params, method)
+            except BrowserAPIError as e:
+                logger.error(str(e))
+                return self.fail_response(str(e))
+            except httpx.TimeoutException as e:
+                logger.error(f"Browser action {endpoint} timed out: {e}")
+                return self.fail_response(f"Browser action {endpoint} timed out; it may or may not have been performed")
+
+            if not "content" in result:
+                result["content"] = ""
+
+            if not "role" in result:
+                result["role"] = "assistant"
+
+            logger.info("Browser automation request completed successfully")
+
+            # Pass the screenshot on by hash; identical screenshots are stored once
+            if result.get("screenshot_base64"):
                 try:
-                    result = json.loads(response.result)
-
-                    if not "content" in result:
-                        result["content"] = ""
-                    
-                    if not "role" in result:
-                        result["role"] = "assistant"
-
-                    logger.info("Browser automation request completed successfully")
-
-                    # Add full result to thread messages for state tracking
-                    added_message = await self.thread_manager.add_message(
-                        thread_id=self.thread_id,
-                        type="browser_state",
-                        content=result,
-                        is_llm_message=False
-                    )
-
-                    # Return tool-specific success response
-                    success_response = {
-                        "success": True,
-                        "message": result.get("message", "Browser action completed successfully")
-                    }
+                    result["screenshot_hash"] = await screenshot_store.put_base64(result["screenshot_base64"])
+                    del result["screenshot_base64"]
+                except Exception as e:
+                    logger.warning(f"Failed to store screenshot, passing it inline: {e}")
+
+            # The full result, screenshot included, is only needed for the next iteration
+            await ephemeral_context.put(self.thread_id, ephemeral_context.BROWSER_STATE, result)
+
+            # Keep a compact record of the action in the thread history; the UI fetches a
+            # stored screenshot by hash, one that could not be stored stays inline
+            compact_state = {k: v for k, v in result.items() if k not in ("screenshot_url_base64", "ocr_text")}
+            added_message = await self.thread_manager.add_message(
+                thread_id=self.thread_id,
+                type="browser_state",
+                content=compact_state,
+                is_llm_message=False
+            )
+
+            # Return tool-specific success response
+            success_response = {
+                "success": True,
+                "message": result.get("message", "Browser action completed successfully")
+            }
+
+            # Add message ID if available
+            if added_message and 'message_id' in added_message:
+                success_response['message_id'] = added_message['message_id']
+
+            # Add relevant browser-specific info
+            if result.get("url"):
+                success_response["url"] = result["url"]
+            if result.get("title"):
+                success_response["title"] = result["title"]
+            if result.get("element_count"):
+                success_response["elements_found"] = result["element_count"]
+            if result.get("pixels_below"):
+                success_response["scrollable_content"] = result["pixels_below"] > 0
+            # Add OCR text when available
+            if result.get("ocr_text"):
+                success_response["ocr_text"] = result["ocr_text"]
 
-                    # Add message ID if available
-                    if added_message and 'message_id' in added_message:
-                        success_response['message_id'] = added_message['message_id']
-
-                    # Add relevant browser-specific info
-                    if result.get("url"):
-                        success_response["url"] = result["url"]
-                    if result.get("title"):
-                        success_response["title"] = result["title"]
-                    if result.get("element_count"):
-                        success_response["elements_found"] = result["element_count"]
-                    if result.get("pixels_below"):
-                        success_response["scrollable_content"] = result["pixels_below"] > 0
-                    # Add OCR text when available
-                    if result.get("ocr_text"):
-                        success_response["ocr_text"] = result["ocr_text"]
-
-                    return self.success_response(success_response)
-
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse response JSON: {response.result} {e}")
-                    return self.fail_response(f"Failed to parse response JSON: {response.result} {e}")
-            else:
-                logger.error(f"Browser automation request failed 2: {response}")
-                return self.fail_response(f"Browser automation request failed 2: {response}")
+            return self.success_response(success_response)
 
         except Exception as e:
             logger.error(f"Error executing browser action: {e}")
@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from sandbox.sandbox import SandboxToolsBase, Sandbox
+from sandbox.sandbox_io import SDK_TIMEOUT_MARGIN
 from utils.files_utils import clean_path
 from agentpress.thread_manager import ThreadManager
 
@@ -83,7 +84,7 @@ class SandboxDeployTool(SandboxToolsBase):
             
             # Verify the directory exists
             try:
-                dir_info = self.sandbox.fs.get_file_info(full_path)
+                dir_info = await self._sandbox_call(self.sandbox.fs.get_file_info, full_path)
                 if not dir_info.is_dir:
                     return self.fail_response(f"'{directory_path}' is not a directory")
             except Exception as e:
@@ -103,7 +104,10 @@ class SandboxDeployTool(SandboxToolsBase):
                     npx wrangler pages deploy {full_path} --project-name {project_name}))'''
 
                 # Execute the command directly using the sandbox's process.exec method
-                response = self.sandbox.process.exec(deploy_cmd, timeout=300)
+                response = await self._sandbox_call(
+                    self.sandbox.process.exec, deploy_cmd, timeout=300,
+                    call_timeout=300 + SDK_TIMEOUT_MARGIN
+                )
                 
                 print(f"Deployment command output: {response.result}")
                 
@@ -1,7 +1,9 @@
+import asyncio
 from typing import Optional, Dict, List
 from uuid import uuid4
 from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from sandbox.sandbox import SandboxToolsBase, Sandbox
+from sandbox.sandbox_io import sandbox_call, SDK_TIMEOUT_MARGIN
 from agentpress.thread_manager import ThreadManager
 
 class SandboxShellTool(SandboxToolsBase):
@@ -19,7 +21,7 @@ class SandboxShellTool(SandboxToolsBase):
             session_id = str(uuid4())
             try:
                 await self._ensure_sandbox()  # Ensure sandbox is initialized
-                self.sandbox.process.create_session(session_id)
+                await self._sandbox_call(self.sandbox.process.create_session, session_id)
                 self._sessions[session_name] = session_id
             except Exception as e:
                 raise RuntimeError(f"Failed to create session: {str(e)}")
@@ -30,11 +32,24 @@ class SandboxShellTool(SandboxToolsBase):
         if session_name in self._sessions:
             try:
                 await self._ensure_sandbox()  # Ensure sandbox is initialized
-                self.sandbox.process.delete_session(self._sessions[session_name])
+                await self._sandbox_call(self.sandbox.process.delete_session, self._sessions[session_name])
                 del self._sessions[session_name]
             except Exception as e:
                 print(f"Warning: Failed to cleanup session {session_name}: {str(e)}")
 
+    async def _kill_session(self, session_name: str):
+        """Delete a session whose command was interrupted, without waiting on the sandbox."""
+        session_id = self._sessions.pop(session_name, None)
+        if session_id is None:
+            return
+        try:
+            # Not counted against the sandbox's limit, which the interrupted command may still hold
+            await asyncio.shield(sandbox_call(None, self.sandbox.process.delete_session, session_id))
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Warning: Failed to kill session {session_name}: {str(e)}")
+
     @openapi_schema({
         "type": "function",
         "function": {
@@ -179,14 +194,23 @@ class SandboxShellTool(SandboxToolsBase):
                 cwd=cwd  # Still set the working directory for reference
             )
             
-            response = self.sandbox.process.execute_session_command(
-                session_id=session_id,
-                req=req,
-                timeout=timeout
-            )
+            # Run the blocking call on the sandbox I/O pool so a stopped agent run can cancel the wait
+            try:
+                response = await self._sandbox_call(
+                    self.sandbox.process.execute_session_command,
+                    session_id=session_id,
+                    req=req,
+                    timeout=timeout,
+                    call_timeout=timeout + SDK_TIMEOUT_MARGIN
+                )
+            except (asyncio.CancelledError, TimeoutError):
+                # Deleting the session kills the command still running in the sandbox
+                await self._kill_session(session_name)
+                raise
             
             # Get detailed logs
-            logs = self.sandbox.process.get_session_command_logs(
+            logs = await self._sandbox_call(
+                self.sandbox.process.get_session_command_logs,
                 session_id=session_id,
                 command_id=response.cmd_id
             )
@@ -7,6 +7,7 @@ from agentpress.tool import ToolResult, openapi_schema, xml_schema
 from sandbox.sandbox import SandboxToolsBase, Sandbox
 from agentpress.thread_manager import ThreadManager
 from utils.logger import logger
+from agent import ephemeral_context
 import json
 
 # Add common image MIME types if mimetypes module is limited
@@ -68,7 +69,7 @@ class SandboxVisionTool(SandboxToolsBase):
 
             # Check if file exists and get info
             try:
-                file_info = self.sandbox.fs.get_file_info(full_path)
+                file_info = await self._sandbox_call(self.sandbox.fs.get_file_info, full_path)
                 if file_info.is_dir:
                     return self.fail_response(f"Path '{cleaned_path}' is a directory, not an image file.")
             except Exception as e:
@@ -81,7 +82,7 @@ class SandboxVisionTool(SandboxToolsBase):
 
             # Read image file content
             try:
-                image_bytes = self.sandbox.fs.download_file(full_path)
+                image_bytes = await self._sandbox_call(self.sandbox.fs.download_file, full_path)
             except Exception as e:
                 logger.error(f"Error reading image file {full_path}: {e}")
                 return self.fail_response(f"Could not read image file: {cleaned_path}")
@@ -110,15 +111,17 @@ class SandboxVisionTool(SandboxToolsBase):
                 "file_path": cleaned_path # Include path for context
             }
 
-            # Add the temporary message using the thread_manager callback
-            # Use a distinct type like 'image_context'
+            # The image itself is only needed for the next iteration
+            await ephemeral_context.put(self.thread_id, ephemeral_context.IMAGE_CONTEXT, image_context_data)
+
+            # Keep a compact record of the image in the thread history
             await self.thread_manager.add_message(
                 thread_id=self.thread_id,
-                type="image_context", # Use a specific type for this
-                content=image_context_data, # Store the dict directly
+                type="image_context",
+                content={"mime_type": mime_type, "file_path": cleaned_path},
                 is_llm_message=False # This is context generated by a tool
             )
-            logger.info(f"Added image context message for '{cleaned_path}' to thread {self.thread_id}")
+            logger.info(f"Added image context for '{cleaned_path}' to thread {self.thread_id}")
 
             # Inform the agent the image will be available next turn
             return self.success_response(f"Successfully loaded the image '{cleaned_path}'.")
@@ -13,6 +13,8 @@ import json
 class WebSearchTool(Tool):
     """Tool for performing web searches using Tavily API and web scraping using Firecrawl."""
 
+    stateless = True
+
     def __init__(self, api_key: str = None):
         super().__init__()
         # Load environment variables
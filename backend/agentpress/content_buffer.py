@@ -0,0 +1,159 @@
+"""
+Chunked text buffer for streamed LLM output.
+
+Streaming responses arrive as many small deltas. Building the full text with
+repeated string concatenation only stays cheap while CPython can resize the
+string in place, and searching the result again to find positions copies it
+once more. This buffer stages deltas in a list, folds them into large blocks
+and only joins the blocks when the text is actually needed.
+"""
+
+from bisect import bisect_right
+from typing import List, Optional
+
+# Staged deltas are joined into a block once they reach this many characters,
+# so the buffer holds a few large strings instead of one object per delta
+BLOCK_SIZE = 64 * 1024
+
+
+class ContentBuffer:
+    """Append-only text buffer backed by a list of chunks.
+
+    Offsets are absolute: they count every character ever appended, including
+    a prefix that has since been consumed, so positions recorded while
+    streaming stay valid after the front of the buffer is dropped.
+
+    Attributes:
+        start (int): Absolute offset of the first character still held
+
+    Methods:
+        append: Add text and return the offset it starts at
+        slice: Get the text between two absolute offsets
+        consume: Drop the text before an offset
+        truncate: Drop the text after an offset
+        getvalue: Join the held text into a single string
+    """
+
+    def __init__(self):
+        """Initialize an empty buffer."""
+        self._chunks: List[str] = []
+        self._offsets: List[int] = []  # Absolute start offset of each chunk
+        self._pending: List[str] = []  # Deltas not yet folded into a chunk
+        self._pending_len = 0
+        self._end = 0
+        self.start = 0
+
+    def __len__(self) -> int:
+        """Absolute offset just past the last character appended."""
+        return self._end
+
+    def __bool__(self) -> bool:
+        return self._end > self.start
+
+    def append(self, text: str) -> int:
+        """Append text to the buffer.
+
+        Args:
+            text: Text to append
+
+        Returns:
+            Absolute offset at which the text starts
+        """
+        offset = self._end
+        if text:
+            self._pending.append(text)
+            self._pending_len += len(text)
+            self._end += len(text)
+            if self._pending_len >= BLOCK_SIZE:
+                self._flush()
+        return offset
+
+    def _flush(self) -> None:
+        """Fold the staged deltas into a single chunk."""
+        if not self._pending:
+            return
+        self._chunks.append(self._pending[0] if len(self._pending) == 1 else "".join(self._pending))
+        self._offsets.append(self._end - self._pending_len)
+        self._pending = []
+        self._pending_len = 0
+
+    def slice(self, start: int, end: Optional[int] = None) -> str:
+        """Get the text between two absolute offsets.
+
+        Args:
+            start: Absolute start offset (clamped to the held text)
+            end: Absolute end offset, defaults to the end of the buffer
+
+        Returns:
+            The text in [start, end)
+        """
+        end = self._end if end is None else min(end, self._end)
+        start = max(start, self.start)
+        if start >= end:
+            return ""
+
+        self._flush()
+        first = bisect_right(self._offsets, start) - 1
+        last = bisect_right(self._offsets, end - 1) - 1
+        if first == last:
+            chunk_start = self._offsets[first]
+            return self._chunks[first][start - chunk_start:end - chunk_start]
+
+        parts = [self._chunks[first][start - self._offsets[first]:]]
+        parts.extend(self._chunks[first + 1:last])
+        parts.append(self._chunks[last][:end - self._offsets[last]])
+        return "".join(parts)
+
+    def consume(self, offset: int) -> None:
+        """Drop the text before an absolute offset.
+
+        Args:
+            offset: Absolute offset of the first character to keep
+        """
+        offset = min(max(offset, self.start), self._end)
+        if offset == self._end:
+            self._chunks = []
+            self._offsets = []
+            self._pending = []
+            self._pending_len = 0
+        else:
+            self._flush()
+            index = bisect_right(self._offsets, offset) - 1
+            if index > 0:
+                del self._chunks[:index]
+                del self._offsets[:index]
+            if self._offsets[0] < offset:
+                self._chunks[0] = self._chunks[0][offset - self._offsets[0]:]
+                self._offsets[0] = offset
+        self.start = offset
+
+    def truncate(self, offset: int) -> None:
+        """Drop the text after an absolute offset.
+
+        Args:
+            offset: Absolute offset just past the last character to keep
+        """
+        offset = min(max(offset, self.start), self._end)
+        if offset == self._end:
+            return
+        self._flush()
+        index = bisect_right(self._offsets, offset - 1) - 1 if offset > self.start else -1
+        del self._chunks[index + 1:]
+        del self._offsets[index + 1:]
+        if index >= 0:
+            self._chunks[index] = self._chunks[index][:offset - self._offsets[index]]
+        self._end = offset
+
+    def getvalue(self) -> str:
+        """Join the held text into a single string.
+
+        The joined string replaces the chunk list, so calling this repeatedly
+        without appending in between does not copy the text again.
+        """
+        self._flush()
+        if not self._chunks:
+            return ""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+            self._offsets = [self.start]
+        return self._chunks[0]
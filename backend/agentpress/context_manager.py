@@ -6,6 +6,7 @@ reaching the context window limitations of LLM models.
 """
 
 import json
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 
 from litellm import token_counter, completion, completion_cost
@@ -17,18 +18,72 @@ from utils.logger import logger
 DEFAULT_TOKEN_THRESHOLD = 120000  # 80k tokens threshold for summarization
 SUMMARY_TARGET_TOKENS = 10000    # Target ~10k tokens for the summary message
 RESERVE_TOKENS = 5000            # Reserve tokens for new messages
+TOKEN_COUNT_MODEL = "gpt-4"      # Tokenizer used for stored per-message token counts
+
+
+def count_message_tokens(message: Any, model: str = TOKEN_COUNT_MODEL) -> int:
+    """Count the tokens of a single LLM message.
+
+    Counts are stored with each message (metadata.message_token_count) and
+    summed per thread, so only new messages ever need to be tokenized.
+
+    Args:
+        message: Message in LLM format (role/content dict)
+        model: Model whose tokenizer is used
+
+    Returns:
+        Token count, or 0 if the message could not be counted
+    """
+    if not isinstance(message, dict):
+        message = {"role": "user", "content": str(message)}
+    try:
+        return token_counter(model=model, messages=[message])
+    except Exception as e:
+        logger.warning(f"Could not count message tokens: {str(e)}")
+        return 0
+
+
+@lru_cache(maxsize=16)
+def _count_text_message_tokens(role: str, content: str, model: str) -> int:
+    return count_message_tokens({"role": role, "content": content}, model)
+
+
+def count_system_prompt_tokens(system_prompt: Dict[str, Any], model: str = TOKEN_COUNT_MODEL) -> int:
+    """Count the tokens of a system prompt, cached by its text and model.
+
+    The same prompt is sent with every LLM call of every run, so it is only
+    tokenized the first time it is seen.
+
+    Args:
+        system_prompt: System message in LLM format
+        model: Model whose tokenizer is used
+
+    Returns:
+        Token count of the system message
+    """
+    content = system_prompt.get('content')
+    if isinstance(content, list) and all(isinstance(item, dict) and item.get('type') == 'text' for item in content):
+        # Text blocks, e.g. wrapped for prompt caching - count the text they hold
+        content = "".join(item.get('text', '') for item in content)
+    if isinstance(content, str):
+        return _count_text_message_tokens(system_prompt.get('role', 'system'), content, model)
+    return count_message_tokens(system_prompt, model)
+
 
 class ContextManager:
     """Manages thread context including token counting and summarization."""
     
-    def __init__(self, token_threshold: int = DEFAULT_TOKEN_THRESHOLD):
+    def __init__(self, token_threshold: int = DEFAULT_TOKEN_THRESHOLD, message_cache=None):
         """Initialize the ContextManager.
         
         Args:
             token_threshold: Token count threshold to trigger summarization
+            message_cache: Optional ThreadMessageCache whose running token totals
+                           are used instead of recounting the thread
         """
         self.db = DBConnection()
         self.token_threshold = token_threshold
+        self.message_cache = message_cache
     
     async def get_thread_token_count(self, thread_id: str) -> int:
         """Get the current token count for a thread using LiteLLM.
@@ -42,6 +97,12 @@ class ContextManager:
         logger.debug(f"Getting token count for thread {thread_id}")
         
         try:
+            if self.message_cache:
+                # Running total of the stored per-message counts, only new messages are counted
+                token_count = await self.message_cache.get_token_count(thread_id)
+                logger.info(f"Thread {thread_id} has {token_count} tokens (running total)")
+                return token_count
+
             # Get messages for the thread
             messages = await self.get_messages_for_summarization(thread_id)
             
@@ -0,0 +1,290 @@
+"""
+Per-thread cache of the messages sent to the LLM.
+
+ThreadManager.get_llm_messages runs before every LLM call, and a single agent
+run can make hundreds of them. Instead of loading and parsing the whole
+post-summary history each time, the cache keeps the parsed messages of each
+thread together with a high-water mark and only fetches rows added after it.
+The mark is the server-assigned seq of the messages table rather than
+created_at, which is set by the writing client and so depends on its clock.
+It also keeps running token totals per thread and tokenizer model. The total
+for TOKEN_COUNT_MODEL is built from the token count stored with each message;
+the total for another model is counted once, the first time it is asked for,
+and from then on only new messages are ever tokenized.
+"""
+
+import json
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from agentpress.context_manager import TOKEN_COUNT_MODEL, count_message_tokens
+from services.supabase import DBConnection
+from utils.logger import logger
+
+# Page size for loading a history; PostgREST caps responses at max_rows (1000)
+PAGE_SIZE = 1000
+
+
+def _format_message(row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Convert a messages row into the format sent to the LLM.
+
+    Mirrors get_llm_formatted_messages: content stored as a JSON string is
+    parsed, and tool_call arguments are serialized as strings.
+    """
+    content = row.get('content')
+    if isinstance(content, str):
+        try:
+            content = json.loads(content)
+        except json.JSONDecodeError:
+            logger.error(f"Failed to parse message: {content}")
+            return None
+    if not isinstance(content, dict):
+        return content
+
+    if content.get('tool_calls'):
+        for tool_call in content['tool_calls']:
+            if isinstance(tool_call, dict) and 'function' in tool_call:
+                # Ensure function.arguments is a string
+                if 'arguments' in tool_call['function'] and not isinstance(tool_call['function']['arguments'], str):
+                    tool_call['function']['arguments'] = json.dumps(tool_call['function']['arguments'])
+    return content
+
+
+def _message_token_count(row: Dict[str, Any], message: Any, model: str) -> int:
+    """Token count stored with a row if it was counted for the model, or counted now."""
+    metadata = row.get('metadata')
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except json.JSONDecodeError:
+            metadata = None
+    if (isinstance(metadata, dict) and isinstance(metadata.get('message_token_count'), int)
+            and metadata.get('message_token_model', TOKEN_COUNT_MODEL) == model):
+        return metadata['message_token_count']
+    return count_message_tokens(message, model)
+
+
+def copy_llm_message(message: Any) -> Any:
+    """Copy a cached message deeply enough for make_llm_api_call to modify it.
+
+    Prompt caching rewrites message content and adds keys to text blocks, so the
+    message and its content blocks are copied; everything else is shared.
+    """
+    if not isinstance(message, dict):
+        return message
+    copied = dict(message)
+    content = copied.get('content')
+    if isinstance(content, list):
+        copied['content'] = [dict(item) if isinstance(item, dict) else item for item in content]
+    return copied
+
+
+@dataclass
+class _ThreadMessages:
+    """Cached history of one thread, oldest message first."""
+    since_seq: Optional[int] = None  # Seq of the summary the history starts at
+    last_seq: int = 0  # Highest seq fetched; newer rows have a higher one
+    messages: List[Any] = field(default_factory=list)
+    # Sum of the token counts of the cached messages, per tokenizer model
+    token_counts: Dict[str, int] = field(default_factory=lambda: {TOKEN_COUNT_MODEL: 0})
+    prefetched: bool = False  # Brought up to date by apply_rows(); the next read skips its fetch
+
+
+class ThreadMessageCache:
+    """Caches the LLM messages of recently used threads.
+
+    Attributes:
+        db (DBConnection): Database connection used to load messages
+        max_threads (int): Number of threads kept before the least recently used is dropped
+
+    Methods:
+        get_messages: Get the LLM messages of a thread, fetching only new rows
+        get_token_count: Get the token total of a thread's LLM messages for a model
+        refresh_after: Get the seq after which new rows of a cached thread are fetched
+        apply_rows: Add rows fetched by the caller, so the next read needs no fetch
+        note_write: Record that a message was added to a thread
+        invalidate: Drop the cached history of one thread, or of all threads
+    """
+
+    def __init__(self, db: DBConnection, max_threads: int = 100):
+        """Initialize an empty cache.
+
+        Args:
+            db: Database connection used to load messages
+            max_threads: Number of threads kept before the least recently used is dropped
+        """
+        self.db = db
+        self.max_threads = max_threads
+        self._threads: "OrderedDict[str, _ThreadMessages]" = OrderedDict()
+
+    async def get_messages(self, thread_id: str) -> List[Any]:
+        """Get the LLM messages of a thread.
+
+        Returns the latest summary and everything after it, or the whole history
+        if the thread has no summary, in the same format as the
+        get_llm_formatted_messages RPC.
+
+        Args:
+            thread_id: The ID of the thread
+
+        Returns:
+            List of messages; each call returns fresh copies that may be modified
+        """
+        cached = await self._get(thread_id)
+        return [copy_llm_message(message) for message in cached.messages]
+
+    async def get_token_count(self, thread_id: str, refresh: bool = True, model: str = TOKEN_COUNT_MODEL) -> int:
+        """Get the token total of the messages get_messages() returns.
+
+        Args:
+            thread_id: The ID of the thread
+            refresh: Fetch new messages first; pass False right after get_messages()
+            model: Model whose tokenizer the total is counted with
+
+        Returns:
+            Sum of the per-message token counts
+        """
+        cached = self._threads.get(thread_id)
+        if refresh or cached is None:
+            cached = await self._get(thread_id)
+        if model not in cached.token_counts:
+            # First time this thread is counted for the model; kept up to date from now on
+            cached.token_counts[model] = sum(count_message_tokens(message, model) for message in cached.messages)
+        return cached.token_counts[model]
+
+    def refresh_after(self, thread_id: str) -> Optional[int]:
+        """Get the seq after which new rows of a cached thread are fetched.
+
+        Lets a caller fetch the new rows together with other data in one query
+        and hand them to apply_rows().
+
+        Args:
+            thread_id: The ID of the thread
+
+        Returns:
+            Seq of the newest cached row, or None if the thread's history is not cached
+        """
+        cached = self._threads.get(thread_id)
+        return cached.last_seq if cached is not None else None
+
+    async def apply_rows(self, thread_id: str, rows: List[Dict[str, Any]]) -> None:
+        """Add the LLM message rows with a seq above refresh_after().
+
+        The next get_messages() or get_token_count() uses the history as it is,
+        unless note_write() is called for the thread first.
+
+        Args:
+            thread_id: The ID of the thread
+            rows: Rows with seq, message_id, type, content and metadata, in seq order
+        """
+        cached = self._threads.get(thread_id)
+        if cached is None:
+            return
+        cached = self._merge(thread_id, cached, rows)
+        cached.prefetched = True
+        self._threads[thread_id] = cached
+        self._threads.move_to_end(thread_id)
+
+    def note_write(self, thread_id: str) -> None:
+        """Record that a message was added to a thread, so the next read fetches again.
+
+        Args:
+            thread_id: The ID of the thread
+        """
+        cached = self._threads.get(thread_id)
+        if cached is not None:
+            cached.prefetched = False
+
+    def invalidate(self, thread_id: Optional[str] = None) -> None:
+        """Drop the cached history of one thread, or of all threads.
+
+        Args:
+            thread_id: Thread to drop; drops every thread if None
+        """
+        if thread_id is None:
+            self._threads.clear()
+        else:
+            self._threads.pop(thread_id, None)
+
+    async def _get(self, thread_id: str) -> _ThreadMessages:
+        """Get the cached history of a thread, brought up to date."""
+        cached = self._threads.get(thread_id)
+        if cached is None:
+            cached = await self._load(thread_id)
+        elif cached.prefetched:
+            cached.prefetched = False
+        else:
+            cached = self._merge(thread_id, cached, await self._fetch_rows(thread_id, after_seq=cached.last_seq))
+
+        self._threads[thread_id] = cached
+        self._threads.move_to_end(thread_id)
+        while len(self._threads) > self.max_threads:
+            self._threads.popitem(last=False)
+        return cached
+
+    async def _load(self, thread_id: str) -> _ThreadMessages:
+        """Load the post-summary history of a thread."""
+        client = await self.db.client
+        summary_result = await client.table('messages').select('seq') \
+            .eq('thread_id', thread_id) \
+            .eq('type', 'summary') \
+            .eq('is_llm_message', True) \
+            .order('seq', desc=True) \
+            .limit(1) \
+            .execute()
+        since_seq = summary_result.data[0]['seq'] if summary_result.data else None
+
+        # The summary itself is the first message of the history
+        after_seq = since_seq - 1 if since_seq is not None else 0
+        cached = _ThreadMessages(since_seq=since_seq, last_seq=after_seq)
+        self._append(cached, await self._fetch_rows(thread_id, after_seq=after_seq))
+        logger.debug(f"Loaded {len(cached.messages)} messages for thread {thread_id}")
+        return cached
+
+    def _merge(self, thread_id: str, cached: _ThreadMessages, rows: List[Dict[str, Any]]) -> _ThreadMessages:
+        """Add new rows, in seq order, to a cached history."""
+        rows = [row for row in rows if row['seq'] > cached.last_seq]
+        if not rows:
+            return cached
+
+        summary_index = max((i for i, row in enumerate(rows) if row['type'] == 'summary'), default=None)
+        if summary_index is not None:
+            # A new summary replaces everything before it
+            logger.debug(f"New summary in thread {thread_id}, dropping older cached messages")
+            rows = rows[summary_index:]
+            cached = _ThreadMessages(
+                since_seq=rows[0]['seq'],
+                token_counts=dict.fromkeys(cached.token_counts, 0)
+            )
+
+        self._append(cached, rows)
+        return cached
+
+    async def _fetch_rows(self, thread_id: str, after_seq: int) -> List[Dict[str, Any]]:
+        """Fetch the LLM message rows of a thread with a seq above a given one."""
+        client = await self.db.client
+        rows = []
+        while True:
+            result = await client.table('messages').select('seq, message_id, type, content, metadata') \
+                .eq('thread_id', thread_id) \
+                .eq('is_llm_message', True) \
+                .gt('seq', after_seq) \
+                .order('seq') \
+                .range(len(rows), len(rows) + PAGE_SIZE - 1) \
+                .execute()
+            rows.extend(result.data or [])
+            if not result.data or len(result.data) < PAGE_SIZE:
+                return rows
+
+    def _append(self, cached: _ThreadMessages, rows: List[Dict[str, Any]]) -> None:
+        """Parse rows and append them to a cached history."""
+        for row in rows:
+            # Move past unparseable rows too, so they are not fetched as new again
+            cached.last_seq = max(cached.last_seq, row['seq'])
+            message = _format_message(row)
+            if message is None:
+                continue
+            cached.messages.append(message)
+            for model in cached.token_counts:
+                cached.token_counts[model] += _message_token_count(row, message, model)
@@ -0,0 +1,229 @@
+"""
+Write-behind persistence for thread messages.
+
+ThreadManager.add_message builds each row client-side (message_id and
+created_at included) and hands it to a MessageWriter, which inserts queued
+rows in batches with one multi-row insert per thread and flush. Callers that
+need the row to be stored before they continue await flush(thread_id), which
+acts as a durability barrier for everything queued for that thread before it.
+
+Threads are batched, locked and retried separately, so a row that cannot be
+stored only holds back, and is only reported to, its own thread. A batch that
+fails stays queued and is retried in the background; after
+MAX_BACKGROUND_ATTEMPTS consecutive failures it is logged and dropped, and the
+caller of the flush that gave up gets the error.
+"""
+
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from services.supabase import DBConnection
+from utils.background_tasks import BackgroundTasks
+from utils.logger import logger
+
+
+class MessageWriteError(Exception):
+    """Queued messages could not be stored; they stay queued and are retried unless
+    their thread ran out of attempts.
+
+    Attributes:
+        errors (Dict[str, Exception]): The insert error of each thread that failed
+    """
+
+    def __init__(self, errors: Dict[str, Exception]):
+        self.errors = errors
+        details = "; ".join(f"thread {thread_id}: {error}" for thread_id, error in errors.items())
+        super().__init__(f"Failed to store messages of {len(errors)} thread(s): {details}")
+
+
+class MessageWriter:
+    """Batches message inserts for the messages table, per thread.
+
+    Rows of a thread are inserted in the order they were queued. Flushes of a
+    thread are serialized by a lock of its own, so a row is never stored before
+    a row queued ahead of it while other threads flush independently, and
+    created_at is strictly increasing so the database ordering matches the
+    queue ordering.
+
+    Attributes:
+        db (DBConnection): Database connection used for the inserts
+        max_batch_size (int): Number of rows queued for a thread that triggers an immediate flush
+        flush_interval (float): Seconds a row may wait before a background flush
+
+    Methods:
+        new_row: Build a complete message row with a client-side id and timestamp
+        enqueue: Queue a row for insertion
+        flush: Insert the queued rows of a thread, or of all threads, and wait for the inserts
+    """
+
+    # Consecutive failed inserts of a thread after which its queued rows are dropped
+    MAX_BACKGROUND_ATTEMPTS = 5
+
+    def __init__(self, db: DBConnection, max_batch_size: int = 50, flush_interval: float = 0.2):
+        """Initialize the writer.
+
+        Args:
+            db: Database connection used for the inserts
+            max_batch_size: Number of rows queued for a thread that triggers an immediate flush
+            flush_interval: Seconds a row may wait before a background flush
+        """
+        self.db = db
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._queues: Dict[str, List[Dict[str, Any]]] = {}
+        self._attempts: Dict[str, int] = {}  # Consecutive failed inserts per thread
+        # Per-thread flush locks, dropped when no flush of the thread is running or waiting
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+        self._delayed_flush: Optional[asyncio.Task] = None
+        self._background = BackgroundTasks()
+        self._last_created_at: Optional[datetime] = None
+
+    def new_row(
+        self,
+        thread_id: str,
+        type: str,
+        content: str,
+        is_llm_message: bool,
+        metadata: str
+    ) -> Dict[str, Any]:
+        """Build a message row as the database would return it.
+
+        Args:
+            thread_id: The ID of the thread the message belongs to
+            type: The type of the message
+            content: JSON-encoded message content
+            is_llm_message: Flag indicating if the message is sent to the LLM
+            metadata: JSON-encoded message metadata
+
+        Returns:
+            Dict with every column of the messages table
+        """
+        created_at = datetime.now(timezone.utc)
+        if self._last_created_at and created_at <= self._last_created_at:
+            created_at = self._last_created_at + timedelta(microseconds=1)
+        self._last_created_at = created_at
+        timestamp = created_at.isoformat()
+
+        return {
+            'message_id': str(uuid.uuid4()),
+            'thread_id': thread_id,
+            'type': type,
+            'is_llm_message': is_llm_message,
+            'content': content,
+            'metadata': metadata,
+            'created_at': timestamp,
+            'updated_at': timestamp,
+        }
+
+    def enqueue(self, row: Dict[str, Any]) -> None:
+        """Queue a row for insertion.
+
+        Args:
+            row: Complete message row, usually built with new_row()
+        """
+        queue = self._queues.setdefault(row['thread_id'], [])
+        queue.append(row)
+        if len(queue) >= self.max_batch_size:
+            self._schedule_flush(0)
+        else:
+            self._schedule_flush(self.flush_interval)
+
+    async def flush(self, thread_id: Optional[str] = None) -> None:
+        """Insert the queued rows and wait for the inserts to finish.
+
+        Args:
+            thread_id: Only insert the rows of this thread; all threads if None
+
+        Raises:
+            MessageWriteError: If rows of the flushed thread(s) could not be inserted; they
+                stay queued and are retried, unless their thread ran out of attempts
+        """
+        if thread_id is not None:
+            # A flush of the thread may be in progress even if nothing is queued
+            thread_ids = [thread_id]
+        else:
+            thread_ids = list({tid for tid, queue in self._queues.items() if queue} | set(self._locks))
+        if not thread_ids:
+            return
+        results = await asyncio.gather(
+            *(self._flush_thread(tid) for tid in thread_ids), return_exceptions=True
+        )
+
+        errors = {}
+        for tid, result in zip(thread_ids, results):
+            if isinstance(result, asyncio.CancelledError):
+                raise result
+            if isinstance(result, Exception):
+                errors[tid] = result
+        if errors:
+            raise MessageWriteError(errors)
+
+    async def _flush_thread(self, thread_id: str) -> None:
+        """Wait for the running flush of one thread, then insert what is still queued."""
+        lock = self._locks.get(thread_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[thread_id] = lock
+        self._lock_users[thread_id] = self._lock_users.get(thread_id, 0) + 1
+        try:
+            async with lock:
+                batch = self._queues.pop(thread_id, None)
+                if batch:
+                    await self._insert(thread_id, batch)
+        finally:
+            self._lock_users[thread_id] -= 1
+            if self._lock_users[thread_id] == 0:
+                del self._lock_users[thread_id]
+                del self._locks[thread_id]
+
+    async def _insert(self, thread_id: str, batch: List[Dict[str, Any]]) -> None:
+        """Insert a batch of one thread; on failure it is requeued ahead of newer rows."""
+        try:
+            client = await self.db.client
+            # Ids are generated client-side, so a retried batch skips rows that already landed
+            await client.table('messages').upsert(
+                batch, returning='minimal', on_conflict='message_id', ignore_duplicates=True
+            ).execute()
+        except BaseException as e:
+            if not isinstance(e, Exception):
+                # Cancelled mid-insert; the rows may or may not have landed, the upsert makes a retry safe
+                self._queues[thread_id] = batch + self._queues.get(thread_id, [])
+                raise
+            attempts = self._attempts.get(thread_id, 0) + 1
+            if attempts >= self.MAX_BACKGROUND_ATTEMPTS:
+                self._attempts.pop(thread_id, None)
+                logger.error(f"Dropping {len(batch)} messages of thread {thread_id} after {attempts} failed "
+                             f"attempts: {[row['message_id'] for row in batch]}: {str(e)}", exc_info=True)
+                raise
+            self._attempts[thread_id] = attempts
+            # Rows queued while the insert was running are newer than the batch
+            self._queues[thread_id] = batch + self._queues.get(thread_id, [])
+            logger.error(f"Failed to flush {len(batch)} messages of thread {thread_id} "
+                         f"(attempt {attempts}): {str(e)}", exc_info=True)
+            self._schedule_flush(self.flush_interval * 2 ** attempts)
+            raise
+        self._attempts.pop(thread_id, None)
+        logger.debug(f"Flushed {len(batch)} messages of thread {thread_id}")
+
+    def _schedule_flush(self, delay: float) -> None:
+        """Start a background flush; at most one delayed flush is pending at a time."""
+        if delay > 0:
+            if self._delayed_flush and not self._delayed_flush.done():
+                return
+            self._delayed_flush = self._background.start(self._flush_later(delay))
+        else:
+            self._background.start(self._flush_later(0))
+
+    async def _flush_later(self, delay: float) -> None:
+        """Background flush of every thread; errors are logged and retried by _flush_thread()."""
+        if delay > 0:
+            await asyncio.sleep(delay)
+            # Let a failed flush schedule its retry
+            self._delayed_flush = None
+        try:
+            await self.flush()
+        except MessageWriteError:
+            pass
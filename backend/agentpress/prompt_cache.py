@@ -0,0 +1,183 @@
+"""
+Process-wide cache of rendered system prompts.
+
+The system prompt of a run is the base prompt plus the XML examples of every
+registered tool, and for Anthropic models it is wrapped in a cache_control
+text block. Rendering it once per (prompt, tool set, model family) and handing
+every ThreadManager a copy of the same rendering keeps the prompt prefix
+byte-identical across runs, which is what provider prompt caching keys on.
+
+The module also counts the prompt cache reads that providers report in their
+usage data, so the hit rate can be checked.
+"""
+
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from agentpress.message_cache import copy_llm_message
+from agentpress.tool_registry import ToolRegistry
+from utils.logger import logger
+
+# Maximum number of rendered prompts kept; each entry is one full system prompt
+MAX_RENDERED_PROMPTS = 32
+
+XML_EXAMPLES_HEADER = """
+--- XML TOOL CALLING ---
+
+In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
+Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
+String and scalar parameters should be specified as attributes, while content goes between tags.
+Note that spaces for string values are not stripped. The output is parsed with regular expressions.
+
+Here are the XML tools available with examples:
+"""
+
+_rendered_prompts: "OrderedDict[Tuple[str, Optional[str], str], Dict[str, Any]]" = OrderedDict()
+
+
+def model_family(model_name: str) -> str:
+    """Group models that render the system prompt the same way.
+
+    Args:
+        model_name: LiteLLM model name
+
+    Returns:
+        "anthropic" for models that use cache_control blocks, "default" otherwise
+    """
+    name = model_name.lower()
+    if "claude" in name or "anthropic" in name:
+        return "anthropic"
+    return "default"
+
+
+def render_system_prompt(
+    system_prompt: Dict[str, Any],
+    tool_registry: ToolRegistry,
+    model_name: str,
+    include_xml_examples: bool
+) -> Dict[str, Any]:
+    """Get the final system message for a run, rendering it only once per key.
+
+    Args:
+        system_prompt: Base system message
+        tool_registry: Registry whose XML examples are appended
+        model_name: LiteLLM model name, used to pick the model family
+        include_xml_examples: Whether to append the XML tool examples
+
+    Returns:
+        A copy of the rendered system message that the caller may modify
+    """
+    prompt_hash = hashlib.sha256(json.dumps(system_prompt, sort_keys=True).encode()).hexdigest()
+    fingerprint = tool_registry.get_xml_examples_fingerprint() if include_xml_examples else None
+    key = (prompt_hash, fingerprint, model_family(model_name))
+
+    rendered = _rendered_prompts.get(key)
+    if rendered is None:
+        examples = tool_registry.get_xml_examples() if include_xml_examples else {}
+        rendered = _render(system_prompt, examples, key[2])
+        _rendered_prompts[key] = rendered
+        while len(_rendered_prompts) > MAX_RENDERED_PROMPTS:
+            _rendered_prompts.popitem(last=False)
+        logger.debug(f"Rendered system prompt for {key[2]} models with {len(examples)} XML examples")
+    else:
+        _rendered_prompts.move_to_end(key)
+
+    return copy_llm_message(rendered)
+
+
+def _render(system_prompt: Dict[str, Any], examples: Dict[str, str], family: str) -> Dict[str, Any]:
+    """Append the XML examples and apply the family's prompt caching format."""
+    rendered = copy.deepcopy(system_prompt)
+
+    if examples:
+        examples_content = XML_EXAMPLES_HEADER + "".join(
+            f"<{tag_name}> Example: {example}\\n" for tag_name, example in examples.items()
+        )
+        system_content = rendered.get('content')
+        if isinstance(system_content, str):
+            rendered['content'] = system_content + examples_content
+            logger.debug("Appended XML examples to string system prompt content.")
+        elif isinstance(system_content, list):
+            for item in system_content:
+                if isinstance(item, dict) and item.get('type') == 'text' and 'text' in item:
+                    item['text'] += examples_content
+                    logger.debug("Appended XML examples to the first text block in list system prompt content.")
+                    break
+            else:
+                logger.warning("System prompt content is a list but no text block found to append XML examples.")
+        else:
+            logger.warning(f"System prompt content is of unexpected type ({type(system_content)}), cannot add XML examples.")
+
+    if family == "anthropic" and isinstance(rendered.get('content'), str):
+        # Same block prepare_params would build, so it leaves the message untouched
+        rendered['content'] = [{"type": "text", "text": rendered['content'], "cache_control": {"type": "ephemeral"}}]
+
+    return rendered
+
+
+def _usage_value(usage: Any, name: str) -> int:
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return value if isinstance(value, int) else 0
+
+
+class PromptCacheStats:
+    """Counts prompt cache usage reported by LLM providers.
+
+    Anthropic reports cache_read_input_tokens and cache_creation_input_tokens;
+    OpenAI-compatible providers report prompt_tokens_details.cached_tokens.
+
+    Attributes:
+        responses (int): Responses that carried usage data
+        cache_hits (int): Responses that read part of the prompt from the cache
+        cached_tokens (int): Prompt tokens read from the cache
+        cache_write_tokens (int): Prompt tokens written to the cache
+        prompt_tokens (int): Prompt tokens reported by the provider
+
+    Methods:
+        record: Add the usage of one response
+        snapshot: Get the counters as a dict
+    """
+
+    def __init__(self):
+        self.responses = 0
+        self.cache_hits = 0
+        self.cached_tokens = 0
+        self.cache_write_tokens = 0
+        self.prompt_tokens = 0
+
+    def record(self, usage: Any) -> None:
+        """Add the usage of one response.
+
+        Args:
+            usage: Usage object or dict from a LiteLLM response
+        """
+        if not usage:
+            return
+        cached = _usage_value(usage, 'cache_read_input_tokens')
+        details = usage.get('prompt_tokens_details') if isinstance(usage, dict) else getattr(usage, 'prompt_tokens_details', None)
+        if not cached and details:
+            cached = _usage_value(details, 'cached_tokens')
+
+        self.responses += 1
+        self.prompt_tokens += _usage_value(usage, 'prompt_tokens')
+        self.cache_write_tokens += _usage_value(usage, 'cache_creation_input_tokens')
+        if cached:
+            self.cache_hits += 1
+            self.cached_tokens += cached
+        logger.debug(f"Prompt cache: read {cached} tokens, hits {self.cache_hits}/{self.responses}")
+
+    def snapshot(self) -> Dict[str, int]:
+        """Get the counters as a dict."""
+        return {
+            "responses": self.responses,
+            "cache_hits": self.cache_hits,
+            "cached_tokens": self.cached_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "prompt_tokens": self.prompt_tokens,
+        }
+
+
+prompt_cache_stats = PromptCacheStats()
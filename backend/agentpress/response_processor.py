@@ -10,7 +10,6 @@ This module handles processing of LLM responses including:
 
 import json
 import asyncio
-import re
 import uuid
 from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator, Callable, Union, Literal
 from dataclasses import dataclass
@@ -18,8 +17,11 @@ from datetime import datetime, timezone
 
 from litellm import completion_cost, token_counter
 
+from agentpress.content_buffer import ContentBuffer
+from agentpress.prompt_cache import prompt_cache_stats
 from agentpress.tool import Tool, ToolResult
 from agentpress.tool_registry import ToolRegistry
+from agentpress.xml_tool_parser import StreamingXMLToolParser
 from utils.logger import logger
 
 # Type alias for XML result adding strategy
@@ -112,10 +114,11 @@ class ResponseProcessor:
         Yields:
             Complete message objects matching the DB schema, except for content chunks.
         """
-        accumulated_content = ""
+        accumulated_content = ContentBuffer()
         tool_calls_buffer = {}
-        current_xml_content = ""
+        xml_parser = StreamingXMLToolParser(self.tool_registry.tag_matcher)
         xml_chunks_buffer = []
+        last_xml_chunk_end = None # Offset in accumulated_content just past the last XML chunk
         pending_tool_executions = []
         yielded_tool_indices = set() # Stores indices of tools whose *status* has been yielded
         tool_index = 0
@@ -124,6 +127,7 @@ class ResponseProcessor:
         last_assistant_message_object = None # Store the final saved assistant message object
         tool_result_message_objects = {} # tool_index -> full saved message object
         has_printed_thinking_prefix = False # Flag for printing thinking prefix only once
+        stopped = False # Set when the run is cancelled or the generator closed; nothing may be yielded then
 
         logger.info(f"Streaming Config: XML={config.xml_tool_calling}, Native={config.native_tool_calling}, "
                    f"Execute on stream={config.execute_on_stream}, Strategy={config.tool_execution_strategy}")
@@ -148,6 +152,10 @@ class ResponseProcessor:
             # --- End Start Events ---
 
             async for chunk in llm_response:
+                # Usage (with prompt cache reads) arrives on the last chunk
+                if getattr(chunk, 'usage', None):
+                    prompt_cache_stats.record(chunk.usage)
+
                 if hasattr(chunk, 'choices') and chunk.choices and hasattr(chunk.choices[0], 'finish_reason') and chunk.choices[0].finish_reason:
                     finish_reason = chunk.choices[0].finish_reason
                     logger.debug(f"Detected finish_reason: {finish_reason}")
@@ -162,14 +170,13 @@ class ResponseProcessor:
                             has_printed_thinking_prefix = True
                         # print(delta.reasoning_content, end='', flush=True)
                         # Append reasoning to main content to be saved in the final message
-                        accumulated_content += delta.reasoning_content
+                        accumulated_content.append(delta.reasoning_content)
 
                     # Process content chunk
                     if delta and hasattr(delta, 'content') and delta.content:
                         chunk_content = delta.content
                         # print(chunk_content, end='', flush=True)
-                        accumulated_content += chunk_content
-                        current_xml_content += chunk_content
+                        chunk_start = accumulated_content.append(chunk_content)
 
                         if not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
                             # Yield ONLY content chunk (don't save)
@@ -186,10 +193,11 @@ class ResponseProcessor:
 
                         # --- Process XML Tool Calls (if enabled and limit not reached) ---
                         if config.xml_tool_calling and not (config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls):
-                            xml_chunks = self._extract_xml_chunks(current_xml_content)
-                            for xml_chunk in xml_chunks:
-                                current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+                            # Only the new delta is scanned; the parser keeps the state between chunks
+                            xml_chunks = xml_parser.feed(chunk_content)
+                            for xml_chunk, chunk_end in zip(xml_chunks, xml_parser.last_chunk_ends):
                                 xml_chunks_buffer.append(xml_chunk)
+                                last_xml_chunk_end = chunk_start + chunk_end
                                 result = self._parse_xml_tool_call(xml_chunk)
                                 if result:
                                     tool_call, parsing_details = result
@@ -354,11 +362,9 @@ class ResponseProcessor:
             # --- SAVE and YIELD Final Assistant Message ---
             if accumulated_content:
                 # ... (Truncate accumulated_content logic) ...
-                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and xml_chunks_buffer:
-                    last_xml_chunk = xml_chunks_buffer[-1]
-                    last_chunk_end_pos = accumulated_content.find(last_xml_chunk) + len(last_xml_chunk)
-                    if last_chunk_end_pos > 0:
-                        accumulated_content = accumulated_content[:last_chunk_end_pos]
+                if config.max_xml_tool_calls > 0 and xml_tool_call_count >= config.max_xml_tool_calls and last_xml_chunk_end is not None:
+                    # The parser reports where each chunk ended, so no search over the content is needed
+                    accumulated_content.truncate(last_xml_chunk_end)
 
                 # ... (Extract complete_native_tool_calls logic) ...
                 complete_native_tool_calls = []
@@ -374,7 +380,7 @@ class ResponseProcessor:
                             except json.JSONDecodeError: continue
 
                 message_data = { # Dict to be saved in 'content'
-                    "role": "assistant", "content": accumulated_content,
+                    "role": "assistant", "content": accumulated_content.getvalue(),
                     "tool_calls": complete_native_tool_calls or None
                 }
 
@@ -413,9 +419,7 @@ class ResponseProcessor:
                  # Gather XML tool calls from buffer (up to limit)
                 parsed_xml_data = []
                 if config.xml_tool_calling:
-                    # Reparse remaining content just in case (should be empty if processed correctly)
-                    xml_chunks = self._extract_xml_chunks(current_xml_content)
-                    xml_chunks_buffer.extend(xml_chunks)
+                    # Complete chunks were already collected by the streaming parser
                     # Process only chunks not already handled in the stream loop
                     remaining_limit = config.max_xml_tool_calls - xml_tool_call_count if config.max_xml_tool_calls > 0 else len(xml_chunks_buffer)
                     xml_chunks_to_process = xml_chunks_buffer[:remaining_limit] # Ensure limit is respected
@@ -524,7 +528,7 @@ class ResponseProcessor:
                     final_cost = completion_cost(
                         model=llm_model,
                         messages=prompt_messages, # Use the prompt messages provided
-                        completion=accumulated_content
+                        completion=accumulated_content.getvalue()
                     )
                     if final_cost is not None and final_cost > 0:
                         logger.info(f"Calculated final cost for stream: {final_cost}")
@@ -561,6 +565,12 @@ class ResponseProcessor:
             )
             if err_msg_obj: yield err_msg_obj # Yield the saved error message
 
+        except (asyncio.CancelledError, GeneratorExit):
+            # The run was stopped: stop the tools still running instead of leaving them detached
+            stopped = True
+            await self._cancel_tool_executions(pending_tool_executions)
+            raise
+
         finally:
             # Save and Yield the final thread_run_end status
             end_content = {"status_type": "thread_run_end"}
@@ -568,7 +578,7 @@ class ResponseProcessor:
                 thread_id=thread_id, type="status", content=end_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
-            if end_msg_obj: yield end_msg_obj
+            if end_msg_obj and not stopped: yield end_msg_obj
 
     async def process_non_streaming_response(
         self,
@@ -598,6 +608,7 @@ class ResponseProcessor:
         tool_result_message_objects = {}
         finish_reason = None
         native_tool_calls_for_message = []
+        stopped = False # Set when the run is cancelled or the generator closed; nothing may be yielded then
 
         try:
             # Save and Yield thread_run_start status message
@@ -608,6 +619,9 @@ class ResponseProcessor:
             )
             if start_msg_obj: yield start_msg_obj
 
+            if getattr(llm_response, 'usage', None):
+                prompt_cache_stats.record(llm_response.usage)
+
             # Extract finish_reason, content, tool calls
             if hasattr(llm_response, 'choices') and llm_response.choices:
                  if hasattr(llm_response.choices[0], 'finish_reason'):
@@ -764,6 +778,11 @@ class ResponseProcessor:
              )
              if err_msg_obj: yield err_msg_obj
 
+        except (asyncio.CancelledError, GeneratorExit):
+            # Nothing may be yielded once the run is stopped
+            stopped = True
+            raise
+
         finally:
              # Save and Yield the final thread_run_end status
             end_content = {"status_type": "thread_run_end"}
@@ -771,81 +790,9 @@ class ResponseProcessor:
                 thread_id=thread_id, type="status", content=end_content, 
                 is_llm_message=False, metadata={"thread_run_id": thread_run_id if 'thread_run_id' in locals() else None}
             )
-            if end_msg_obj: yield end_msg_obj
+            if end_msg_obj and not stopped: yield end_msg_obj
 
     # XML parsing methods
-    def _extract_tag_content(self, xml_chunk: str, tag_name: str) -> Tuple[Optional[str], Optional[str]]:
-        """Extract content between opening and closing tags, handling nested tags."""
-        start_tag = f'<{tag_name}'
-        end_tag = f'</{tag_name}>'
-        
-        try:
-            # Find start tag position
-            start_pos = xml_chunk.find(start_tag)
-            if start_pos == -1:
-                return None, xml_chunk
-                
-            # Find end of opening tag
-            tag_end = xml_chunk.find('>', start_pos)
-            if tag_end == -1:
-                return None, xml_chunk
-                
-            # Find matching closing tag
-            content_start = tag_end + 1
-            nesting_level = 1
-            pos = content_start
-            
-            while nesting_level > 0 and pos < len(xml_chunk):
-                next_start = xml_chunk.find(start_tag, pos)
-                next_end = xml_chunk.find(end_tag, pos)
-                
-                if next_end == -1:
-                    return None, xml_chunk
-                    
-                if next_start != -1 and next_start < next_end:
-                    nesting_level += 1
-                    pos = next_start + len(start_tag)
-                else:
-                    nesting_level -= 1
-                    if nesting_level == 0:
-                        content = xml_chunk[content_start:next_end]
-                        remaining = xml_chunk[next_end + len(end_tag):]
-                        return content, remaining
-                    else:
-                        pos = next_end + len(end_tag)
-            
-            return None, xml_chunk
-            
-        except Exception as e:
-            logger.error(f"Error extracting tag content: {e}")
-            return None, xml_chunk
-
-    def _extract_attribute(self, opening_tag: str, attr_name: str) -> Optional[str]:
-        """Extract attribute value from opening tag."""
-        try:
-            # Handle both single and double quotes with raw strings
-            patterns = [
-                fr'{attr_name}="([^"]*)"',  # Double quotes
-                fr"{attr_name}='([^']*)'",  # Single quotes
-                fr'{attr_name}=([^\s/>;]+)'  # No quotes - fixed escape sequence
-            ]
-            
-            for pattern in patterns:
-                match = re.search(pattern, opening_tag)
-                if match:
-                    value = match.group(1)
-                    # Unescape common XML entities
-                    value = value.replace('&quot;', '"').replace('&apos;', "'")
-                    value = value.replace('&lt;', '<').replace('&gt;', '>')
-                    value = value.replace('&amp;', '&')
-                    return value
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error extracting attribute: {e}")
-            return None
-
     def _extract_xml_chunks(self, content: str) -> List[str]:
         """Extract complete XML chunks using start and end pattern matching."""
         chunks = []
@@ -853,18 +800,8 @@ class ResponseProcessor:
         
         try:
             while pos < len(content):
-                # Find the next tool tag
-                next_tag_start = -1
-                current_tag = None
-                
-                # Find the earliest occurrence of any registered tag
-                for tag_name in self.tool_registry.xml_tools.keys():
-                    start_pattern = f'<{tag_name}'
-                    tag_pos = content.find(start_pattern, pos)
-                    
-                    if tag_pos != -1 and (next_tag_start == -1 or tag_pos < next_tag_start):
-                        next_tag_start = tag_pos
-                        current_tag = tag_name
+                # Find the earliest occurrence of any registered tag in a single pass
+                next_tag_start, current_tag = self.tool_registry.tag_matcher.find_opening(content, pos)
                 
                 if next_tag_start == -1 or not current_tag:
                     break
@@ -921,93 +858,25 @@ class ResponseProcessor:
         """
         try:
             # Extract tag name and validate
-            tag_match = re.match(r'<([^\s>]+)', xml_chunk)
-            if not tag_match:
-                logger.error(f"No tag found in XML chunk: {xml_chunk}")
-                return None
-            
             # This is the XML tag as it appears in the text (e.g., "create-file")
-            xml_tag_name = tag_match.group(1)
+            xml_tag_name = self.tool_registry.tag_matcher.match_opening(xml_chunk)
+            if not xml_tag_name:
+                logger.error(f"No registered tag found in XML chunk: {xml_chunk}")
+                return None
             logger.info(f"Found XML tag: {xml_tag_name}")
             
-            # Get tool info and schema from registry
-            tool_info = self.tool_registry.get_xml_tool(xml_tag_name)
-            if not tool_info or not tool_info['schema'].xml_schema:
+            # Get the extractor compiled for this tag at registration time
+            extractor = self.tool_registry.get_xml_extractor(xml_tag_name)
+            if not extractor:
                 logger.error(f"No tool or schema found for tag: {xml_tag_name}")
                 return None
             
-            # This is the actual function name to call (e.g., "create_file")
-            function_name = tool_info['method']
-            
-            schema = tool_info['schema'].xml_schema
-            params = {}
-            remaining_chunk = xml_chunk
-            
-            # --- Store detailed parsing info ---
-            parsing_details = {
-                "attributes": {},
-                "elements": {},
-                "text_content": None,
-                "root_content": None,
-                "raw_chunk": xml_chunk # Store the original chunk for reference
-            }
-            # ---
-            
-            # Process each mapping
-            for mapping in schema.mappings:
-                try:
-                    if mapping.node_type == "attribute":
-                        # Extract attribute from opening tag
-                        opening_tag = remaining_chunk.split('>', 1)[0]
-                        value = self._extract_attribute(opening_tag, mapping.param_name)
-                        if value is not None:
-                            params[mapping.param_name] = value
-                            parsing_details["attributes"][mapping.param_name] = value # Store raw attribute
-                            logger.info(f"Found attribute {mapping.param_name}: {value}")
-                
-                    elif mapping.node_type == "element":
-                        # Extract element content
-                        content, remaining_chunk = self._extract_tag_content(remaining_chunk, mapping.path)
-                        if content is not None:
-                            params[mapping.param_name] = content.strip()
-                            parsing_details["elements"][mapping.param_name] = content.strip() # Store raw element content
-                            logger.info(f"Found element {mapping.param_name}: {content.strip()}")
-                
-                    elif mapping.node_type == "text":
-                        # Extract text content
-                        content, _ = self._extract_tag_content(remaining_chunk, xml_tag_name)
-                        if content is not None:
-                            params[mapping.param_name] = content.strip()
-                            parsing_details["text_content"] = content.strip() # Store raw text content
-                            logger.info(f"Found text content for {mapping.param_name}: {content.strip()}")
-                
-                    elif mapping.node_type == "content":
-                        # Extract root content
-                        content, _ = self._extract_tag_content(remaining_chunk, xml_tag_name)
-                        if content is not None:
-                            params[mapping.param_name] = content.strip()
-                            parsing_details["root_content"] = content.strip() # Store raw root content
-                            logger.info(f"Found root content for {mapping.param_name}")
-                
-                except Exception as e:
-                    logger.error(f"Error processing mapping {mapping}: {e}")
-                    continue
-            
-            # Validate required parameters
-            missing = [mapping.param_name for mapping in schema.mappings if mapping.required and mapping.param_name not in params]
-            if missing:
-                logger.error(f"Missing required parameters: {missing}")
-                logger.error(f"Current params: {params}")
+            result = extractor.extract(xml_chunk)
+            if result is None:
                 logger.error(f"XML chunk: {xml_chunk}")
                 return None
             
-            # Create tool call with clear separation between function_name and xml_tag_name
-            tool_call = {
-                "function_name": function_name,  # The actual method to call (e.g., create_file)
-                "xml_tag_name": xml_tag_name,    # The original XML tag (e.g., create-file)
-                "arguments": params              # The extracted parameters
-            }
-            
+            tool_call, parsing_details = result
             logger.debug(f"Created tool call: {tool_call}")
             return tool_call, parsing_details # Return both dicts
             
@@ -1042,6 +911,15 @@ class ResponseProcessor:
         return parsed_data
 
     # Tool execution methods
+    async def _cancel_tool_executions(self, executions: List[Dict[str, Any]]) -> None:
+        """Cancel the streamed tool executions still running and wait for them to unwind."""
+        tasks = [execution["task"] for execution in executions if not execution["task"].done()]
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            logger.info(f"Cancelling {len(tasks)} running tool executions")
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     async def _execute_tool(self, tool_call: Dict[str, Any]) -> ToolResult:
         """Execute a single tool call and return the result."""
         try:
@@ -1056,11 +934,8 @@ class ResponseProcessor:
                 except json.JSONDecodeError:
                     arguments = {"text": arguments}
             
-            # Get available functions from tool registry
-            available_functions = self.tool_registry.get_available_functions()
-            
-            # Look up the function by name
-            tool_fn = available_functions.get(function_name)
+            # Look up the function in the registry's dispatch map
+            tool_fn = self.tool_registry.get_function(function_name)
             if not tool_fn:
                 logger.error(f"Tool function '{function_name}' not found in registry")
                 return ToolResult(success=False, output=f"Tool function '{function_name}' not found")
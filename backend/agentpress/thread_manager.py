@@ -10,12 +10,17 @@ This module provides comprehensive conversation management, including:
 - Context summarization to manage token limits
 """
 
+import copy
+from contextlib import aclosing
 import json
-from typing import List, Dict, Any, Optional, Type, Union, AsyncGenerator, Literal
+from typing import List, Dict, Any, Optional, Tuple, Type, Union, AsyncGenerator, Literal
 from services.llm import make_llm_api_call
 from agentpress.tool import Tool
 from agentpress.tool_registry import ToolRegistry
-from agentpress.context_manager import ContextManager
+from agentpress.context_manager import ContextManager, TOKEN_COUNT_MODEL, count_message_tokens, count_system_prompt_tokens
+from agentpress.message_cache import ThreadMessageCache
+from agentpress.message_writer import MessageWriter
+from agentpress.prompt_cache import render_system_prompt
 from agentpress.response_processor import (
     ResponseProcessor, 
     ProcessorConfig    
@@ -39,17 +44,45 @@ class ThreadManager:
     
         """
         self.db = DBConnection()
+        self.message_writer = MessageWriter(self.db)
+        self.message_cache = ThreadMessageCache(self.db)
+        self.context_manager = ContextManager(message_cache=self.message_cache)
+        self._init_tools()
+
+    def _init_tools(self):
+        """Create an empty tool registry and the response processor that uses it."""
         self.tool_registry = ToolRegistry()
         self.response_processor = ResponseProcessor(
             tool_registry=self.tool_registry,
             add_message_callback=self.add_message
         )
-        self.context_manager = ContextManager()
+
+    def for_run(self) -> "ThreadManager":
+        """Create a ThreadManager for a single agent run.
+
+        The new manager shares the database connection, message writer and
+        message and token caches with this one, but has its own tool registry,
+        so tools bound to one run's project never leak into another run.
+
+        Returns:
+            ThreadManager with no tools registered
+        """
+        run_manager = copy.copy(self)
+        run_manager._init_tools()
+        return run_manager
 
     def add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
         """Add a tool to the ThreadManager."""
         self.tool_registry.register_tool(tool_class, function_names, **kwargs)
 
+    def add_tools(self, tools: List[Tuple[Type[Tool], Dict[str, Any]]]):
+        """Add several tools to the ThreadManager in one registration.
+
+        Args:
+            tools: (tool class, initialization arguments) pairs
+        """
+        self.tool_registry.register_tools(tools)
+
     async def add_message(
         self, 
         thread_id: str, 
@@ -60,6 +93,12 @@ class ThreadManager:
     ):
         """Add a message to the thread in the database.
 
+        The row (including message_id and created_at) is built client-side and
+        returned right away; the insert happens in a batch in the background.
+        Messages sent to the LLM (is_llm_message=True) are a durability barrier:
+        this call returns only once they and every message of the thread queued
+        before them are stored, and raises if they could not be.
+
         Args:
             thread_id: The ID of the thread to add the message to.
             type: The type of the message (e.g., 'text', 'image_url', 'tool_call', 'tool', 'user', 'assistant').
@@ -69,38 +108,57 @@ class ThreadManager:
                             Defaults to False (user message).
             metadata: Optional dictionary for additional message metadata.
                       Defaults to None, stored as an empty JSONB object if None.
+
+        Returns:
+            The message row as stored in the database.
         """
         logger.debug(f"Adding message of type '{type}' to thread {thread_id}")
-        client = await self.db.client
-        
-        # Prepare data for insertion
-        data_to_insert = {
-            'thread_id': thread_id,
-            'type': type,
-            'content': json.dumps(content) if isinstance(content, (dict, list)) else content,
-            'is_llm_message': is_llm_message,
-            'metadata': json.dumps(metadata or {}), # Ensure metadata is always a JSON object
-        }
-        
-        try:
-            # Add returning='representation' to get the inserted row data including the id
-            result = await client.table('messages').insert(data_to_insert, returning='representation').execute()
-            logger.info(f"Successfully added message to thread {thread_id}")
-            
-            if result.data and len(result.data) > 0 and isinstance(result.data[0], dict) and 'message_id' in result.data[0]:
-                return result.data[0]
-            else:
-                logger.error(f"Insert operation failed or did not return expected data structure for thread {thread_id}. Result data: {result.data}")
-                return None
-        except Exception as e:
-            logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
-            raise
+
+        if is_llm_message:
+            # Count once on write so thread totals never need a full recount
+            metadata = {
+                **(metadata or {}),
+                'message_token_count': count_message_tokens(content),
+                'message_token_model': TOKEN_COUNT_MODEL,
+            }
+
+        # Prepare the full row, including the id and timestamps
+        row = self.message_writer.new_row(
+            thread_id=thread_id,
+            type=type,
+            content=json.dumps(content) if isinstance(content, (dict, list)) else content,
+            is_llm_message=is_llm_message,
+            metadata=json.dumps(metadata or {}), # Ensure metadata is always a JSON object
+        )
+        self.message_writer.enqueue(row)
+        self.message_cache.note_write(thread_id)
+
+        if is_llm_message:
+            try:
+                await self.message_writer.flush(thread_id)
+                logger.info(f"Successfully added message to thread {thread_id}")
+            except Exception as e:
+                logger.error(f"Failed to add message to thread {thread_id}: {str(e)}", exc_info=True)
+                raise
+
+        return row
+
+    async def flush_messages(self, thread_id: Optional[str] = None):
+        """Wait until every message added so far is stored in the database.
+
+        Call this before reading the messages table directly.
+
+        Args:
+            thread_id: Only wait for the messages of this thread; all threads if None
+        """
+        await self.message_writer.flush(thread_id)
 
     async def get_llm_messages(self, thread_id: str) -> List[Dict[str, Any]]:
         """Get all messages for a thread.
         
-        This method uses the SQL function which handles context truncation
-        by considering summary messages.
+        Returns the latest summary message and everything after it, like the
+        get_llm_formatted_messages SQL function. The parsed history is cached
+        per thread, so only messages added since the previous call are fetched.
         
         Args:
             thread_id: The ID of the thread to get messages for.
@@ -109,40 +167,15 @@ class ThreadManager:
             List of message objects.
         """
         logger.debug(f"Getting messages for thread {thread_id}")
-        client = await self.db.client
+
+        # Messages of the thread still queued for insertion would be missing from the history
+        await self.flush_messages(thread_id)
         
         try:
-            result = await client.rpc('get_llm_formatted_messages', {'p_thread_id': thread_id}).execute()
-            
-            # Parse the returned data which might be stringified JSON
-            if not result.data:
-                return []
-                
-            # Return properly parsed JSON objects
-            messages = []
-            for item in result.data:
-                if isinstance(item, str):
-                    try:
-                        parsed_item = json.loads(item)
-                        messages.append(parsed_item)
-                    except json.JSONDecodeError:
-                        logger.error(f"Failed to parse message: {item}")
-                else:
-                    messages.append(item)
-
-            # Ensure tool_calls have properly formatted function arguments
-            for message in messages:
-                if message.get('tool_calls'):
-                    for tool_call in message['tool_calls']:
-                        if isinstance(tool_call, dict) and 'function' in tool_call:
-                            # Ensure function.arguments is a string
-                            if 'arguments' in tool_call['function'] and not isinstance(tool_call['function']['arguments'], str):
-                                tool_call['function']['arguments'] = json.dumps(tool_call['function']['arguments'])
-
-            return messages
-            
+            return await self.message_cache.get_messages(thread_id)
         except Exception as e:
             logger.error(f"Failed to get messages for thread {thread_id}: {str(e)}", exc_info=True)
+            self.message_cache.invalidate(thread_id)
             return []
 
     async def run_thread(
@@ -199,43 +232,17 @@ class ThreadManager:
         if max_xml_tool_calls > 0 and not processor_config.max_xml_tool_calls:
             processor_config.max_xml_tool_calls = max_xml_tool_calls
             
-        # Create a working copy of the system prompt to potentially modify
-        working_system_prompt = system_prompt.copy()
-
-        # Add XML examples to system prompt if requested, do this only ONCE before the loop
-        if include_xml_examples and processor_config.xml_tool_calling:
-            xml_examples = self.tool_registry.get_xml_examples()
-            if xml_examples:
-                examples_content = """
---- XML TOOL CALLING ---
-
-In this environment you have access to a set of tools you can use to answer the user's question. The tools are specified in XML format.
-Format your tool calls using the specified XML tags. Place parameters marked as 'attribute' within the opening tag (e.g., `<tag attribute='value'>`). Place parameters marked as 'content' between the opening and closing tags. Place parameters marked as 'element' within their own child tags (e.g., `<tag><element>value</element></tag>`). Refer to the examples provided below for the exact structure of each tool.
-String and scalar parameters should be specified as attributes, while content goes between tags.
-Note that spaces for string values are not stripped. The output is parsed with regular expressions.
-
-Here are the XML tools available with examples:
-"""
-                for tag_name, example in xml_examples.items():
-                    examples_content += f"<{tag_name}> Example: {example}\\n"
-
-                system_content = working_system_prompt.get('content')
-
-                if isinstance(system_content, str):
-                    working_system_prompt['content'] += examples_content
-                    logger.debug("Appended XML examples to string system prompt content.")
-                elif isinstance(system_content, list):
-                    appended = False
-                    for item in working_system_prompt['content']: # Modify the copy
-                        if isinstance(item, dict) and item.get('type') == 'text' and 'text' in item:
-                            item['text'] += examples_content
-                            logger.debug("Appended XML examples to the first text block in list system prompt content.")
-                            appended = True
-                            break
-                    if not appended:
-                        logger.warning("System prompt content is a list but no text block found to append XML examples.")
-                else:
-                    logger.warning(f"System prompt content is of unexpected type ({type(system_content)}), cannot add XML examples.")
+        # Final system message (XML examples, prompt caching format), rendered once per
+        # prompt, tool set and model family and shared by every run in the process
+        working_system_prompt = render_system_prompt(
+            system_prompt,
+            self.tool_registry,
+            llm_model,
+            include_xml_examples and processor_config.xml_tool_calling
+        )
+
+        # Count the system prompt once; the count is cached by prompt text and model
+        system_prompt_tokens = count_system_prompt_tokens(working_system_prompt, llm_model)
         
         # Control whether we need to auto-continue due to tool_calls finish reason
         auto_continue = True
@@ -254,9 +261,9 @@ Here are the XML tools available with examples:
                 # 2. Check token count before proceeding
                 token_count = 0
                 try:
-                    from litellm import token_counter
-                    # Use the potentially modified working_system_prompt for token counting
-                    token_count = token_counter(model=llm_model, messages=[working_system_prompt] + messages) 
+                    # Running total with the run model's tokenizer plus the cached system prompt count;
+                    # only messages not yet counted for this model are tokenized
+                    token_count = system_prompt_tokens + await self.message_cache.get_token_count(thread_id, refresh=False, model=llm_model)
                     token_threshold = self.context_manager.token_threshold
                     logger.info(f"Thread {thread_id} token count: {token_count}/{token_threshold} ({(token_count/token_threshold)*100:.1f}%)")
                     
@@ -384,25 +391,26 @@ Here are the XML tools available with examples:
                     return
                 
                 # Process each chunk
-                async for chunk in response_gen:
-                    # Check if this is a finish reason chunk with tool_calls or xml_tool_limit_reached
-                    if chunk.get('type') == 'finish':
-                        if chunk.get('finish_reason') == 'tool_calls':
-                            # Only auto-continue if enabled (max > 0)
-                            if native_max_auto_continues > 0:
-                                logger.info(f"Detected finish_reason='tool_calls', auto-continuing ({auto_continue_count + 1}/{native_max_auto_continues})")
-                                auto_continue = True
-                                auto_continue_count += 1
-                                # Don't yield the finish chunk to avoid confusing the client
-                                continue
-                        elif chunk.get('finish_reason') == 'xml_tool_limit_reached':
-                            # Don't auto-continue if XML tool limit was reached
-                            logger.info(f"Detected finish_reason='xml_tool_limit_reached', stopping auto-continue")
-                            auto_continue = False
-                            # Still yield the chunk to inform the client
+                async with aclosing(response_gen):
+                    async for chunk in response_gen:
+                        # Check if this is a finish reason chunk with tool_calls or xml_tool_limit_reached
+                        if chunk.get('type') == 'finish':
+                            if chunk.get('finish_reason') == 'tool_calls':
+                                # Only auto-continue if enabled (max > 0)
+                                if native_max_auto_continues > 0:
+                                    logger.info(f"Detected finish_reason='tool_calls', auto-continuing ({auto_continue_count + 1}/{native_max_auto_continues})")
+                                    auto_continue = True
+                                    auto_continue_count += 1
+                                    # Don't yield the finish chunk to avoid confusing the client
+                                    continue
+                            elif chunk.get('finish_reason') == 'xml_tool_limit_reached':
+                                # Don't auto-continue if XML tool limit was reached
+                                logger.info(f"Detected finish_reason='xml_tool_limit_reached', stopping auto-continue")
+                                auto_continue = False
+                                # Still yield the chunk to inform the client
                     
-                    # Otherwise just yield the chunk normally
-                    yield chunk
+                        # Otherwise just yield the chunk normally
+                        yield chunk
                 
                 # If not auto-continuing, we're done
                 if not auto_continue:
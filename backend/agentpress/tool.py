@@ -7,7 +7,8 @@ This module defines the base classes and decorators for creating tools in AgentP
 - Result containers for standardized tool outputs
 """
 
-from typing import Dict, Any, Union, Optional, List, Type
+from types import MappingProxyType
+from typing import Dict, Any, Union, Optional, List, Mapping, Tuple, Type
 from dataclasses import dataclass, field
 from abc import ABC
 import json
@@ -100,32 +101,52 @@ class Tool(ABC):
     and result handling capabilities.
     
     Attributes:
-        _schemas (Dict[str, List[ToolSchema]]): Registered schemas for tool methods
+        stateless (bool): Class flag for tools that keep no per-run state, so one
+            instance can be shared by every run in the process
+        _schemas (Mapping[str, Tuple[ToolSchema, ...]]): Registered schemas for tool methods, read-only
         
     Methods:
         get_schemas: Get all registered tool schemas
         success_response: Create a successful result
         fail_response: Create a failed result
     """
+
+    stateless: bool = False
     
     def __init__(self):
-        """Initialize tool with empty schema registry."""
-        self._schemas: Dict[str, List[ToolSchema]] = {}
+        """Initialize tool with the schemas of its class."""
         logger.debug(f"Initializing tool class: {self.__class__.__name__}")
         self._register_schemas()
 
     def _register_schemas(self):
         """Register schemas from all decorated methods."""
-        for name, method in inspect.getmembers(self, predicate=inspect.ismethod):
-            if hasattr(method, 'tool_schemas'):
-                self._schemas[name] = method.tool_schemas
-                logger.debug(f"Registered schemas for method '{name}' in {self.__class__.__name__}")
+        self._schemas: Mapping[str, Tuple[ToolSchema, ...]] = self._get_class_schemas()
+
+    @classmethod
+    def _get_class_schemas(cls) -> Mapping[str, Tuple[ToolSchema, ...]]:
+        """Collect the schemas of the decorated methods once per class.
+
+        The schemas are attached to the functions by the decorators, so they are
+        the same for every instance; the result is stored on the class itself,
+        read-only so that no instance can change it for the others.
+        """
+        schemas = cls.__dict__.get('_class_schemas')
+        if schemas is None:
+            collected = {}
+            for name, function in inspect.getmembers(cls, predicate=inspect.isfunction):
+                if hasattr(function, 'tool_schemas'):
+                    collected[name] = tuple(function.tool_schemas)
+                    logger.debug(f"Registered schemas for method '{name}' in {cls.__name__}")
+            schemas = MappingProxyType(collected)
+            cls._class_schemas = schemas
+        return schemas
 
-    def get_schemas(self) -> Dict[str, List[ToolSchema]]:
+    def get_schemas(self) -> Mapping[str, Tuple[ToolSchema, ...]]:
         """Get all registered tool schemas.
         
         Returns:
-            Dict mapping method names to their schema definitions
+            Read-only mapping of method names to their schema definitions, shared
+            by all instances of the class
         """
         return self._schemas
 
@@ -1,7 +1,51 @@
-from typing import Dict, Type, Any, List, Optional, Callable
+import hashlib
+import json
+from types import MappingProxyType
+from typing import Dict, Type, Any, List, Optional, Callable, Tuple, Mapping
 from agentpress.tool import Tool, SchemaType, ToolSchema
+from agentpress.xml_tool_parser import XMLTagMatcher, XMLToolExtractor
 from utils.logger import logger
 
+# Process-wide instances of stateless tools, keyed by class and init arguments
+_shared_tools: Dict[Tuple[Type[Tool], Tuple], Tool] = {}
+# Compiled extractors, keyed by the id of the schema they were built from
+_xml_extractors: Dict[Tuple[int, str], Tuple[ToolSchema, XMLToolExtractor]] = {}
+
+
+def get_shared_tool(tool_class: Type[Tool], **kwargs) -> Tool:
+    """Get the process-wide instance of a stateless tool, creating it on first use.
+
+    Args:
+        tool_class: Tool class with stateless set
+        **kwargs: Arguments passed to tool initialization
+
+    Returns:
+        The instance shared by every registry that registers the same tool, or a new
+        instance if the arguments are not hashable
+    """
+    key = (tool_class, tuple(sorted(kwargs.items())))
+    try:
+        tool_instance = _shared_tools.get(key)
+    except TypeError:
+        # Unhashable arguments, e.g. a list, cannot key the cache; such a tool is not shared
+        logger.debug(f"Not sharing {tool_class.__name__}, its arguments are not hashable")
+        return tool_class(**kwargs)
+    if tool_instance is None:
+        tool_instance = tool_class(**kwargs)
+        _shared_tools[key] = tool_instance
+        logger.debug(f"Created shared instance of {tool_class.__name__}")
+    return tool_instance
+
+
+def _get_xml_extractor(schema: ToolSchema, function_name: str) -> XMLToolExtractor:
+    """Get the compiled extractor of an XML schema, compiling it only once."""
+    key = (id(schema), function_name)
+    cached = _xml_extractors.get(key)
+    if cached is None or cached[0] is not schema:
+        cached = (schema, XMLToolExtractor(schema.xml_schema, function_name))
+        _xml_extractors[key] = cached
+    return cached[1]
+
 
 class ToolRegistry:
     """Registry for managing and accessing tools.
@@ -12,19 +56,30 @@ class ToolRegistry:
     Attributes:
         tools (Dict[str, Dict[str, Any]]): OpenAPI-style tools and schemas
         xml_tools (Dict[str, Dict[str, Any]]): XML-style tools and schemas
+        tag_matcher (XMLTagMatcher): Matcher for all registered XML tags, rebuilt on registration
         
     Methods:
         register_tool: Register a tool with optional function filtering
+        register_tools: Register several tools, rebuilding lookup tables once
+        get_function: Get the bound tool function for a function name
+        get_available_functions: Get the read-only function dispatch map
         get_tool: Get a specific tool by name
         get_xml_tool: Get a tool by XML tag name
+        get_xml_extractor: Get the compiled argument extractor for an XML tag
         get_openapi_schemas: Get OpenAPI schemas for function calling
         get_xml_examples: Get examples of XML tool usage
+        get_xml_examples_fingerprint: Get a hash identifying the XML examples
     """
     
     def __init__(self):
         """Initialize a new ToolRegistry instance."""
         self.tools = {}
         self.xml_tools = {}
+        self.tag_matcher = XMLTagMatcher([])
+        self._xml_examples_fingerprint: Optional[str] = None
+        # Dispatch maps, rebuilt only when tools are registered
+        self._functions: Mapping[str, Callable] = MappingProxyType({})
+        self._xml_extractors: Mapping[str, XMLToolExtractor] = MappingProxyType({})
         logger.debug("Initialized new ToolRegistry instance")
     
     def register_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]] = None, **kwargs):
@@ -38,9 +93,32 @@ class ToolRegistry:
         Notes:
             - If function_names is None, all functions are registered
             - Handles both OpenAPI and XML schema registration
+            - Stateless tools are taken from the process-wide pool instead of
+              being instantiated per registry
+        """
+        self._add_tool(tool_class, function_names, kwargs)
+        self._rebuild_lookups()
+
+    def register_tools(self, tools: List[Tuple[Type[Tool], Dict[str, Any]]]):
+        """Register several tools with all their functions.
+
+        The tag matcher and dispatch maps are rebuilt once for the whole set
+        instead of once per tool.
+
+        Args:
+            tools: (tool class, initialization arguments) pairs, in registration order
         """
+        for tool_class, kwargs in tools:
+            self._add_tool(tool_class, None, kwargs)
+        self._rebuild_lookups()
+
+    def _add_tool(self, tool_class: Type[Tool], function_names: Optional[List[str]], kwargs: Dict[str, Any]):
+        """Instantiate a tool and add its schemas without rebuilding the lookup tables."""
         logger.debug(f"Registering tool class: {tool_class.__name__}")
-        tool_instance = tool_class(**kwargs)
+        if tool_class.stateless:
+            tool_instance = get_shared_tool(tool_class, **kwargs)
+        else:
+            tool_instance = tool_class(**kwargs)
         schemas = tool_instance.get_schemas()
         
         logger.debug(f"Available schemas for {tool_class.__name__}: {list(schemas.keys())}")
@@ -63,37 +141,50 @@ class ToolRegistry:
                         self.xml_tools[schema.xml_schema.tag_name] = {
                             "instance": tool_instance,
                             "method": func_name,
-                            "schema": schema
+                            "schema": schema,
+                            "extractor": _get_xml_extractor(schema, func_name)
                         }
                         registered_xml += 1
                         logger.debug(f"Registered XML tag {schema.xml_schema.tag_name} -> {func_name} from {tool_class.__name__}")
-        
+
         logger.debug(f"Tool registration complete for {tool_class.__name__}: {registered_openapi} OpenAPI functions, {registered_xml} XML tags")
 
-    def get_available_functions(self) -> Dict[str, Callable]:
+    def _rebuild_lookups(self):
+        """Rebuild the tag matcher and dispatch maps after registration."""
+        functions = {}
+        for function_name, tool_info in self.tools.items():
+            functions[function_name] = getattr(tool_info['instance'], function_name)
+        for tool_info in self.xml_tools.values():
+            functions[tool_info['method']] = getattr(tool_info['instance'], tool_info['method'])
+        self._functions = MappingProxyType(functions)
+        self._xml_extractors = MappingProxyType({
+            tag_name: tool_info['extractor'] for tag_name, tool_info in self.xml_tools.items()
+        })
+
+        # Recompile once per registration so every scan is a single pass over the text
+        self.tag_matcher = XMLTagMatcher(self.xml_tools.keys())
+        self._xml_examples_fingerprint = None
+        logger.debug(f"Rebuilt tool lookups: {len(functions)} functions, {len(self.xml_tools)} XML tags")
+
+    def get_function(self, function_name: str) -> Optional[Callable]:
+        """Get the bound tool function for a function name.
+
+        Args:
+            function_name: Name of the tool function
+
+        Returns:
+            The bound method, or None if no tool provides it
+        """
+        return self._functions.get(function_name)
+
+    def get_available_functions(self) -> Mapping[str, Callable]:
         """Get all available tool functions.
         
         Returns:
-            Dict mapping function names to their implementations
+            Read-only mapping of function names to their implementations,
+            shared between calls until the next registration
         """
-        available_functions = {}
-        
-        # Get OpenAPI tool functions
-        for tool_name, tool_info in self.tools.items():
-            tool_instance = tool_info['instance']
-            function_name = tool_name
-            function = getattr(tool_instance, function_name)
-            available_functions[function_name] = function
-            
-        # Get XML tool functions
-        for tag_name, tool_info in self.xml_tools.items():
-            tool_instance = tool_info['instance']
-            method_name = tool_info['method']
-            function = getattr(tool_instance, method_name)
-            available_functions[method_name] = function
-            
-        logger.debug(f"Retrieved {len(available_functions)} available functions")
-        return available_functions
+        return self._functions
 
     def get_tool(self, tool_name: str) -> Dict[str, Any]:
         """Get a specific tool by name.
@@ -106,7 +197,7 @@ class ToolRegistry:
         """
         tool = self.tools.get(tool_name, {})
         if not tool:
-            logger.warning(f"Tool not found: {tool_name}")
+            logger.debug(f"Tool not found: {tool_name}")
         return tool
 
     def get_xml_tool(self, tag_name: str) -> Dict[str, Any]:
@@ -116,13 +207,24 @@ class ToolRegistry:
             tag_name: XML tag name for the tool
             
         Returns:
-            Dict containing tool instance, method name, and schema
+            Dict containing tool instance, method name, schema, and compiled extractor
         """
         tool = self.xml_tools.get(tag_name, {})
         if not tool:
-            logger.warning(f"XML tool not found for tag: {tag_name}")
+            logger.debug(f"XML tool not found for tag: {tag_name}")
         return tool
 
+    def get_xml_extractor(self, tag_name: str) -> Optional[XMLToolExtractor]:
+        """Get the compiled argument extractor for an XML tag.
+
+        Args:
+            tag_name: XML tag name for the tool
+
+        Returns:
+            The extractor, or None if the tag is not registered
+        """
+        return self._xml_extractors.get(tag_name)
+
     def get_openapi_schemas(self) -> List[Dict[str, Any]]:
         """Get OpenAPI schemas for function calling.
         
@@ -150,3 +252,19 @@ class ToolRegistry:
                 examples[schema.xml_schema.tag_name] = schema.xml_schema.example
         logger.debug(f"Retrieved {len(examples)} XML examples")
         return examples
+
+    def get_xml_examples_fingerprint(self) -> str:
+        """Get a hash identifying the registered XML tags and their examples.
+
+        Registries with the same tools produce the same fingerprint, so it can
+        key anything rendered from the examples, like the system prompt.
+
+        Returns:
+            Hex digest of the XML examples, computed once per registration
+        """
+        if self._xml_examples_fingerprint is None:
+            examples = self.get_xml_examples()
+            self._xml_examples_fingerprint = hashlib.sha256(
+                json.dumps(list(examples.items())).encode() # Order matters, it is the rendering order
+            ).hexdigest()
+        return self._xml_examples_fingerprint
@@ -0,0 +1,421 @@
+"""
+XML tool call parsing for AgentPress.
+
+This module provides:
+- XMLToolExtractor, compiled once per XML tool schema at registration time,
+  which turns a complete tool call chunk into arguments in a single pass
+- XMLTagMatcher, a multi-pattern matcher compiled once per tool registry that
+  finds any registered tool tag in a single pass over the text
+- StreamingXMLToolParser, a stateful tokenizer that consumes a streamed LLM
+  response delta by delta and emits complete XML tool call chunks as soon as
+  their closing tag arrives, so parsing cost is linear in the response length
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Pattern, Set, Tuple
+
+from agentpress.content_buffer import ContentBuffer
+from agentpress.tool import XMLTagSchema
+from utils.logger import logger
+
+
+def _unescape_xml(value: str) -> str:
+    """Unescape the common XML entities in an attribute value."""
+    value = value.replace('&quot;', '"').replace('&apos;', "'")
+    value = value.replace('&lt;', '<').replace('&gt;', '>')
+    return value.replace('&amp;', '&')
+
+
+def _find_element(xml_chunk: str, tag_name: str, pos: int = 0) -> Optional[Tuple[int, int, int]]:
+    """Locate the content of an element, handling nested tags of the same name.
+
+    Args:
+        xml_chunk: Text to search
+        tag_name: Name of the element
+        pos: Position to start searching from
+
+    Returns:
+        Tuple of (content_start, content_end, end_of_closing_tag), or None if the
+        element is missing or not closed
+    """
+    start_tag = f'<{tag_name}'
+    end_tag = f'</{tag_name}>'
+
+    start_pos = xml_chunk.find(start_tag, pos)
+    if start_pos == -1:
+        return None
+    tag_end = xml_chunk.find('>', start_pos)
+    if tag_end == -1:
+        return None
+
+    content_start = tag_end + 1
+    nesting_level = 1
+    pos = content_start
+    while pos < len(xml_chunk):
+        next_start = xml_chunk.find(start_tag, pos)
+        next_end = xml_chunk.find(end_tag, pos)
+        if next_end == -1:
+            return None
+        if next_start != -1 and next_start < next_end:
+            nesting_level += 1
+            pos = next_start + len(start_tag)
+        else:
+            nesting_level -= 1
+            if nesting_level == 0:
+                return content_start, next_end, next_end + len(end_tag)
+            pos = next_end + len(end_tag)
+    return None
+
+
+class XMLToolExtractor:
+    """Argument extractor compiled from the XMLTagSchema of one tool method.
+
+    Attribute regexes, element paths and the set of required parameters are
+    prepared once when the tool is registered. Extracting a tool call then walks
+    the chunk once with position offsets instead of re-slicing it per mapping,
+    so large payloads such as file contents are copied only into their argument.
+
+    Attributes:
+        tag_name (str): XML tag of the tool
+        function_name (str): Name of the tool method to call
+        required_params (FrozenSet[str]): Parameters that must be present
+
+    Methods:
+        extract: Parse a complete XML chunk into a tool call and parsing details
+    """
+
+    def __init__(self, xml_schema: XMLTagSchema, function_name: str):
+        """Compile the extractor for a schema.
+
+        Args:
+            xml_schema: XML schema of the tool method
+            function_name: Name of the tool method the tag maps to
+        """
+        self.tag_name = xml_schema.tag_name
+        self.function_name = function_name
+        self.required_params: FrozenSet[str] = frozenset(
+            mapping.param_name for mapping in xml_schema.mappings if mapping.required
+        )
+        # (node_type, param_name, attribute patterns or element path) in schema order
+        self._steps: List[Tuple[str, str, Any]] = []
+        for mapping in xml_schema.mappings:
+            if mapping.node_type == "attribute":
+                name = re.escape(mapping.param_name)
+                patterns: List[Pattern] = [
+                    re.compile(f'{name}="([^"]*)"'),  # Double quotes
+                    re.compile(f"{name}='([^']*)'"),  # Single quotes
+                    re.compile(fr'{name}=([^\s/>;]+)'),  # No quotes
+                ]
+                self._steps.append(("attribute", mapping.param_name, patterns))
+            elif mapping.node_type in ("element", "text", "content"):
+                self._steps.append((mapping.node_type, mapping.param_name, mapping.path))
+            else:
+                logger.warning(f"Unsupported XML node type '{mapping.node_type}' for {self.tag_name}.{mapping.param_name}")
+
+    def extract(self, xml_chunk: str) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+        """Parse a complete XML chunk into tool call format.
+
+        Args:
+            xml_chunk: Complete XML chunk starting with the tool tag
+
+        Returns:
+            Tuple of (tool_call, parsing_details) or None if required parameters are missing.
+            - tool_call: Dict with 'function_name', 'xml_tag_name', 'arguments'
+            - parsing_details: Dict with 'attributes', 'elements', 'text_content', 'root_content'
+        """
+        params = {}
+        parsing_details = {
+            "attributes": {},
+            "elements": {},
+            "text_content": None,
+            "root_content": None,
+            "raw_chunk": xml_chunk # Store the original chunk for reference
+        }
+
+        opening_end = xml_chunk.find('>')
+        opening_tag = xml_chunk[:opening_end] if opening_end != -1 else xml_chunk
+        root_content = None
+        element_pos = 0
+
+        for node_type, param_name, spec in self._steps:
+            if node_type == "attribute":
+                for pattern in spec:
+                    match = pattern.search(opening_tag)
+                    if match:
+                        value = _unescape_xml(match.group(1))
+                        params[param_name] = value
+                        parsing_details["attributes"][param_name] = value
+                        break
+
+            elif node_type == "element":
+                # Elements are read in schema order, each after the previous one
+                found = _find_element(xml_chunk, spec, element_pos)
+                if found:
+                    content_start, content_end, element_pos = found
+                    value = xml_chunk[content_start:content_end].strip()
+                    params[param_name] = value
+                    parsing_details["elements"][param_name] = value
+
+            else:
+                if root_content is None:
+                    found = _find_element(xml_chunk, self.tag_name)
+                    if not found:
+                        continue
+                    root_content = xml_chunk[found[0]:found[1]].strip()
+                params[param_name] = root_content
+                parsing_details["text_content" if node_type == "text" else "root_content"] = root_content
+
+        missing = [name for name in self.required_params if name not in params]
+        if missing:
+            logger.error(f"Missing required parameters for <{self.tag_name}>: {missing}")
+            logger.error(f"Found parameters: {list(params.keys())}")
+            return None
+
+        logger.debug(f"Extracted <{self.tag_name}> parameters: {list(params.keys())}")
+        tool_call = {
+            "function_name": self.function_name,  # The actual method to call (e.g., create_file)
+            "xml_tag_name": self.tag_name,        # The original XML tag (e.g., create-file)
+            "arguments": params                   # The extracted parameters
+        }
+        return tool_call, parsing_details
+
+
+class XMLTagMatcher:
+    """Multi-pattern matcher for the XML tool tags of a ToolRegistry.
+
+    All registered tag names are compiled into single alternation regexes, so
+    finding the next tool tag is one pass over the text regardless of how many
+    tags are registered. The registry rebuilds its matcher whenever the tag set
+    changes; every consumer shares that instance.
+
+    Attributes:
+        tag_names (List[str]): Registered tag names, longest first
+        opening_pattern (Pattern): Matches `<tag_name` for any registered tag
+        closing_pattern (Pattern): Matches `</tag_name>` for any registered tag
+        event_pattern (Pattern): Matches either, closing tag in group 1 and
+            opening tag in group 2
+        ambiguous_tags (Set[str]): Tags that are a strict prefix of another tag
+        max_event_len (int): Length of the longest opening or closing tag
+
+    Methods:
+        find_opening: Find the earliest opening tag at or after a position
+        match_opening: Get the registered tag a chunk starts with
+        closed_tags: List the registered tags closed in a text
+        is_partial_event: Check whether text may be the start of a tag
+        may_extend: Check whether a matched tag may still grow into a longer one
+    """
+
+    def __init__(self, tag_names: Iterable[str]):
+        """Compile the patterns for a set of tag names.
+
+        Args:
+            tag_names: Names of the registered XML tags
+        """
+        # Longest names first so a tag that prefixes another never shadows it
+        self.tag_names = sorted(set(tag_names), key=len, reverse=True)
+        alternation = '|'.join(re.escape(name) for name in self.tag_names) or '(?!)'
+        self.opening_pattern = re.compile(f'<({alternation})')
+        self.closing_pattern = re.compile(f'</({alternation})>')
+        self.event_pattern = re.compile(f'</({alternation})>|<({alternation})')
+        self.ambiguous_tags: Set[str] = {
+            name for name in self.tag_names
+            if any(other != name and other.startswith(name) for other in self.tag_names)
+        }
+        self._event_strings = [f'</{name}>' for name in self.tag_names] + [f'<{name}' for name in self.tag_names]
+        self.max_event_len = max((len(event) for event in self._event_strings), default=0)
+
+    def find_opening(self, text: str, pos: int = 0) -> Tuple[int, Optional[str]]:
+        """Find the earliest opening tag of any registered tool.
+
+        Args:
+            text: Text to search
+            pos: Position to start searching from
+
+        Returns:
+            Tuple of (position, tag_name), or (-1, None) if no tag was found
+        """
+        match = self.opening_pattern.search(text, pos)
+        if not match:
+            return -1, None
+        return match.start(), match.group(1)
+
+    def match_opening(self, xml_chunk: str) -> Optional[str]:
+        """Return the registered tag name a chunk starts with, or None."""
+        match = self.opening_pattern.match(xml_chunk)
+        return match.group(1) if match else None
+
+    def closed_tags(self, text: str) -> List[str]:
+        """Return the registered tags closed in a text, in order of appearance."""
+        return [match.group(1) for match in self.closing_pattern.finditer(text)]
+
+    def is_partial_event(self, text: str) -> bool:
+        """Check whether text is the beginning of an opening or closing tag."""
+        return any(event.startswith(text) for event in self._event_strings)
+
+    def may_extend(self, tag_name: str, following: str) -> bool:
+        """Check whether a matched opening tag may still grow into a longer tag name.
+
+        Args:
+            tag_name: Tag name matched at the end of the text received so far
+            following: All the text received after the tag name
+
+        Returns:
+            True if tag_name followed by more text could be a longer registered tag
+        """
+        if tag_name not in self.ambiguous_tags:
+            return False
+        prefix = tag_name + following
+        return any(len(other) > len(prefix) and other.startswith(prefix) for other in self.tag_names)
+
+
+@dataclass
+class _OpenTag:
+    """A tool tag that has been opened but not yet balanced by its closing tag.
+
+    Attributes:
+        tag_name (str): Name of the XML tag
+        start (int): Offset of the opening `<` within the retained text
+        depth (int): Nesting level of the tag
+        nested (List[Tuple[int, int]]): Offsets and depth changes of nested
+            occurrences of the same tag, used to undo them when a chunk is cut out
+    """
+    tag_name: str
+    start: int
+    depth: int = 1
+    nested: List[Tuple[int, int]] = field(default_factory=list)
+
+
+class StreamingXMLToolParser:
+    """Stateful parser that extracts complete XML tool call chunks from a stream.
+
+    One parser is created per streamed response. Feeding it a delta returns the
+    tool call chunks completed by that delta, in order. The matching rules mirror
+    ResponseProcessor._extract_xml_chunks:
+
+    - A tool call starts at `<tag_name` for any registered tag
+    - It ends at the `</tag_name>` that balances nested occurrences of the same tag
+    - A tag that is still open does not block tool calls that complete after it;
+      a completed inner call is cut out of the text of the enclosing one
+
+    Only text belonging to an open tag is retained, and every character is
+    matched once, so memory and CPU stay proportional to the stream length.
+
+    Attributes:
+        tag_matcher (XMLTagMatcher): Matcher for the registered XML tool tags
+        last_chunk_ends (List[int]): End offset of each chunk returned by the
+            last feed() call, relative to the start of the delta it was fed
+
+    Methods:
+        feed: Consume a content delta and return the completed chunks
+        pending: Text retained for tags that are open but not yet closed
+    """
+
+    def __init__(self, tag_matcher: XMLTagMatcher):
+        """Initialize the parser for the tags known to a matcher.
+
+        Args:
+            tag_matcher: Compiled matcher for the registered XML tool tags
+        """
+        self.tag_matcher = tag_matcher
+
+        # Unscanned text that may hold the beginning of a tag split across deltas
+        self._tail = ""
+        # Open tags ordered by start, plus the text retained from the first one
+        self._open: List[_OpenTag] = []
+        self._open_by_tag: Dict[str, _OpenTag] = {}
+        self._retained = ContentBuffer()
+        self.last_chunk_ends: List[int] = []
+
+    def feed(self, delta: str) -> List[str]:
+        """Consume a content delta and return the tool call chunks it completed.
+
+        Args:
+            delta: New text received from the LLM
+
+        Returns:
+            List of complete XML chunks, in the order their closing tags appear
+        """
+        chunks = []
+        self.last_chunk_ends = []
+        if not delta or not self.tag_matcher.tag_names:
+            return chunks
+
+        # A closing tag always ends inside the delta, past the held-back tail
+        delta_start = len(self._tail)
+        window = self._tail + delta
+        self._tail = ""
+        # Position in the window from which text has not yet been retained
+        keep_from = 0 if self._open else None
+        scanned_to = 0
+
+        for match in self.tag_matcher.event_pattern.finditer(window):
+            closing_tag, opening_tag = match.group(1), match.group(2)
+
+            if opening_tag:
+                following = window[match.end():]
+                if len(following) < self.tag_matcher.max_event_len and self.tag_matcher.may_extend(opening_tag, following):
+                    # The rest of a longer tag name may still be arriving - decide on the next delta
+                    break
+                scanned_to = match.end()
+                if keep_from is None:
+                    keep_from = match.start()
+                start = len(self._retained) + (match.start() - keep_from)
+                open_tag = self._open_by_tag.get(opening_tag)
+                if open_tag:
+                    open_tag.depth += 1
+                    open_tag.nested.append((start, 1))
+                    continue
+                open_tag = _OpenTag(tag_name=opening_tag, start=start)
+                self._open.append(open_tag)
+                self._open_by_tag[opening_tag] = open_tag
+                logger.debug(f"Streaming parser found opening tag <{opening_tag}>")
+                continue
+
+            scanned_to = match.end()
+            open_tag = self._open_by_tag.get(closing_tag)
+            if not open_tag:
+                continue
+            open_tag.depth -= 1
+            if open_tag.depth > 0:
+                open_tag.nested.append((len(self._retained) + (match.start() - keep_from), -1))
+                continue
+
+            # Balanced - cut the chunk out of the retained text
+            self._retained.append(window[keep_from:match.end()])
+            chunks.append(self._retained.slice(open_tag.start))
+            self.last_chunk_ends.append(match.end() - delta_start)
+
+            # Tags opened inside the completed chunk belong to it
+            self._open = [tag for tag in self._open if tag.start < open_tag.start]
+            self._open_by_tag = {tag.tag_name: tag for tag in self._open}
+            for tag in self._open:
+                if tag.nested and tag.nested[-1][0] >= open_tag.start:
+                    tag.nested = [event for event in tag.nested if event[0] < open_tag.start]
+                    tag.depth = 1 + sum(change for _, change in tag.nested)
+            if self._open:
+                self._retained.truncate(open_tag.start)
+                keep_from = match.end()
+            else:
+                self._retained.consume(len(self._retained))
+                keep_from = None
+
+        split_at = self._find_partial_event(window, scanned_to)
+        if keep_from is not None and split_at > keep_from:
+            self._retained.append(window[keep_from:split_at])
+        self._tail = window[split_at:]
+        return chunks
+
+    def pending(self) -> str:
+        """Return the text retained for tags that are open but not yet closed."""
+        if not self._open:
+            return ""
+        return self._retained.slice(self._open[0].start) + self._tail
+
+    def _find_partial_event(self, window: str, scanned_to: int) -> int:
+        """Return where a tag split across deltas may begin, or len(window) if none."""
+        search_from = max(scanned_to, len(window) - self.tag_matcher.max_event_len + 1)
+        last_open = window.rfind('<', search_from)
+        if last_open != -1 and self.tag_matcher.is_partial_event(window[last_open:]):
+            return last_open
+        return len(window)
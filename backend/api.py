@@ -3,6 +3,8 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from contextlib import asynccontextmanager
 from agentpress.thread_manager import ThreadManager
+from agentpress.prompt_cache import prompt_cache_stats
+from utils.event_loop_lag import event_loop_lag_monitor
 from services.supabase import DBConnection
 from datetime import datetime, timezone
 from dotenv import load_dotenv
@@ -62,9 +64,12 @@ async def lifespan(app: FastAPI):
         
         # Start background tasks
         asyncio.create_task(agent_api.restore_running_agent_runs())
+        event_loop_lag_monitor.start()
         
         yield
         
+        await event_loop_lag_monitor.stop()
+
         # Clean up agent resources
         logger.info("Cleaning up agent resources")
         await agent_api.cleanup()
@@ -143,7 +148,9 @@ async def health_check():
     return {
         "status": "ok", 
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "instance_id": instance_id
+        "instance_id": instance_id,
+        "prompt_cache": prompt_cache_stats.snapshot(),
+        "event_loop_lag": event_loop_lag_monitor.snapshot()
     }
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@ from pydantic import BaseModel
 from utils.logger import logger
 from utils.auth_utils import get_current_user_id_from_jwt, get_user_id_from_stream_auth, get_optional_user_id
 from sandbox.sandbox import get_or_start_sandbox
+from sandbox.sandbox_io import sandbox_call
 from services.supabase import DBConnection
 from agent.api import get_or_create_project_sandbox
 
@@ -133,7 +134,7 @@ async def create_file(
         content = await file.read()
         
         # Create file using raw binary content
-        sandbox.fs.upload_file(path, content)
+        await sandbox_call(sandbox_id, sandbox.fs.upload_file, path, content)
         logger.info(f"File created at {path} in sandbox {sandbox_id}")
         
         return {"status": "success", "created": True, "path": path}
@@ -173,7 +174,7 @@ async def create_file_json(
             content = content.encode('utf-8')
         
         # Create file
-        sandbox.fs.upload_file(path, content)
+        await sandbox_call(sandbox_id, sandbox.fs.upload_file, path, content)
         logger.info(f"File created at {path} in sandbox {sandbox_id}")
         
         return {"status": "success", "created": True, "path": path}
@@ -200,7 +201,7 @@ async def list_files(
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
         # List files
-        files = sandbox.fs.list_files(path)
+        files = await sandbox_call(sandbox_id, sandbox.fs.list_files, path)
         result = []
         
         for file in files:
@@ -242,7 +243,7 @@ async def read_file(
         sandbox = await get_sandbox_by_id_safely(client, sandbox_id)
         
         # Read file
-        content = sandbox.fs.download_file(path)
+        content = await sandbox_call(sandbox_id, sandbox.fs.download_file, path)
         
         # Return a Response object with the content directly
         filename = os.path.basename(path)
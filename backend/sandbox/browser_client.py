@@ -0,0 +1,172 @@
+"""
+Pooled HTTP client for the browser automation API of the sandboxes.
+
+The browser API listens on port 8002 inside each sandbox. Calling it with curl
+through process.exec spawns a process in the sandbox per action, and the
+response, base64 screenshot included, comes back as the stdout string of a
+blocking SDK call. Instead, requests go straight to the port's Daytona preview
+link over one shared httpx client, whose connections are kept alive between
+actions. Response bodies are streamed into a buffer and parsed once, with
+orjson when it is installed.
+
+Preview links are resolved once per sandbox and cached; a link that stops
+working is forgotten so that the next request resolves it again.
+
+Browser actions are not idempotent, so callers may only retry an action
+another way when it provably never reached the sandbox, i.e. on
+BrowserAPIUnreachable. Any other failure is reported as is.
+"""
+
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from sandbox.sandbox import Sandbox
+from sandbox.sandbox_io import sandbox_call
+from utils.logger import logger
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Port of the browser automation API inside the sandbox
+BROWSER_API_PORT = 8002
+# Seconds a browser action may take, like the curl command it replaces
+BROWSER_API_TIMEOUT = 30.0
+# Connections kept open across all sandboxes
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+# Sandboxes whose preview link is cached
+PREVIEW_LINK_CACHE_SIZE = 1000
+# Header carrying the preview token of non-public sandboxes
+PREVIEW_TOKEN_HEADER = "X-Daytona-Preview-Token"
+
+
+class BrowserAPIUnreachable(Exception):
+    """The browser API could not be connected to; the request was never sent."""
+
+
+class BrowserAPIError(Exception):
+    """The browser API answered with something other than a JSON document."""
+
+    def __init__(self, status_code: int, body: bytes):
+        self.status_code = status_code
+        self.body = body
+        snippet = body[:500].decode("utf-8", errors="replace")
+        super().__init__(f"Browser API returned status {status_code} with a non-JSON body: {snippet}")
+
+
+def _parse_preview_link(preview_link: Any) -> Tuple[str, Optional[str]]:
+    """Get the URL and token of a preview link, whatever form the SDK returns it in."""
+    url = preview_link.url if hasattr(preview_link, 'url') else str(preview_link).split("url='")[1].split("'")[0]
+    token = None
+    if hasattr(preview_link, 'token'):
+        token = preview_link.token
+    elif "token='" in str(preview_link):
+        token = str(preview_link).split("token='")[1].split("'")[0]
+    return url.rstrip('/'), token
+
+
+def _loads(body: bytes) -> Any:
+    """Parse a JSON response body."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class SandboxBrowserClient:
+    """Shared keep-alive HTTP client for the browser API of every sandbox.
+
+    Methods:
+        request: Call a browser automation endpoint of a sandbox
+        close: Close the pooled connections
+    """
+
+    def __init__(self):
+        """Initialize the client; connections are opened on first use."""
+        self._client: Optional[httpx.AsyncClient] = None
+        self._preview_links: "OrderedDict[str, Tuple[str, Optional[str]]]" = OrderedDict()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Get the shared httpx client, creating it if needed."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(BROWSER_API_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS
+                )
+            )
+        return self._client
+
+    async def _get_preview_link(self, sandbox: Sandbox) -> Tuple[str, Optional[str]]:
+        """Get the base URL and token of a sandbox's browser API."""
+        cached = self._preview_links.get(sandbox.id)
+        if cached is not None:
+            self._preview_links.move_to_end(sandbox.id)
+            return cached
+
+        preview_link = await sandbox_call(sandbox.id, sandbox.get_preview_link, BROWSER_API_PORT)
+        link = _parse_preview_link(preview_link)
+        self._preview_links[sandbox.id] = link
+        while len(self._preview_links) > PREVIEW_LINK_CACHE_SIZE:
+            self._preview_links.popitem(last=False)
+        return link
+
+    async def request(self, sandbox: Sandbox, endpoint: str, params: Optional[Dict[str, Any]] = None, method: str = "POST") -> Dict[str, Any]:
+        """Call a browser automation endpoint of a sandbox.
+
+        Args:
+            sandbox: The sandbox running the browser
+            endpoint: Endpoint under /api/automation, e.g. "navigate_to"
+            params: JSON body, or query parameters for GET requests
+            method: HTTP method to use
+
+        Returns:
+            The parsed JSON response, whatever its status code, as with the curl command
+
+        Raises:
+            BrowserAPIUnreachable: If no connection could be made, so the action did not run
+            BrowserAPIError: If the response is not valid JSON
+            httpx.TransportError: If the connection failed after the request was sent, e.g. a
+                read timeout; the action may have run
+        """
+        base_url, token = await self._get_preview_link(sandbox)
+        headers = {"Content-Type": "application/json"}
+        if token:
+            headers[PREVIEW_TOKEN_HEADER] = token
+
+        url = f"{base_url}/api/automation/{endpoint}"
+        request_kwargs = {"headers": headers}
+        if method == "GET":
+            request_kwargs["params"] = params
+        elif params:
+            request_kwargs["json"] = params
+
+        try:
+            async with self._get_client().stream(method, url, **request_kwargs) as response:
+                body = bytearray()
+                async for chunk in response.aiter_bytes():
+                    body += chunk
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            # The link may have changed, e.g. after the sandbox was restarted
+            self._preview_links.pop(sandbox.id, None)
+            raise BrowserAPIUnreachable(str(e)) from e
+
+        logger.debug(f"Browser API {method} {endpoint} returned {response.status_code} ({len(body)} bytes)")
+        try:
+            return _loads(bytes(body))
+        except ValueError:
+            raise BrowserAPIError(response.status_code, bytes(body)) from None
+
+    async def close(self) -> None:
+        """Close the pooled connections."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+sandbox_browser_client = SandboxBrowserClient()
@@ -6,6 +6,7 @@ from daytona_api_client.models.workspace_state import WorkspaceState
 from dotenv import load_dotenv
 
 from agentpress.tool import Tool
+from sandbox.sandbox_io import sandbox_call, SANDBOX_LIFECYCLE_TIMEOUT
 from utils.logger import logger
 from utils.config import config
 from utils.files_utils import clean_path
@@ -44,20 +45,20 @@ async def get_or_start_sandbox(sandbox_id: str):
     logger.info(f"Getting or starting sandbox with ID: {sandbox_id}")
     
     try:
-        sandbox = daytona.get_current_sandbox(sandbox_id)
+        sandbox = await sandbox_call(sandbox_id, daytona.get_current_sandbox, sandbox_id)
         
         # Check if sandbox needs to be started
         if sandbox.instance.state == WorkspaceState.ARCHIVED or sandbox.instance.state == WorkspaceState.STOPPED:
             logger.info(f"Sandbox is in {sandbox.instance.state} state. Starting...")
             try:
-                daytona.start(sandbox)
+                await sandbox_call(sandbox_id, daytona.start, sandbox, call_timeout=SANDBOX_LIFECYCLE_TIMEOUT)
                 # Wait a moment for the sandbox to initialize
                 # sleep(5)
                 # Refresh sandbox state after starting
-                sandbox = daytona.get_current_sandbox(sandbox_id)
+                sandbox = await sandbox_call(sandbox_id, daytona.get_current_sandbox, sandbox_id)
                 
                 # Start supervisord in a session when restarting
-                start_supervisord_session(sandbox)
+                await sandbox_call(sandbox_id, start_supervisord_session, sandbox)
             except Exception as e:
                 logger.error(f"Error starting sandbox: {e}")
                 raise e
@@ -87,7 +88,10 @@ def start_supervisord_session(sandbox: Sandbox):
         raise e
 
 def create_sandbox(password: str, project_id: str = None):
-    """Create a new sandbox with all required services configured and running."""
+    """Create a new sandbox with all required services configured and running.
+
+    This blocks for the whole creation; call it through sandbox_call from async code.
+    """
     
     logger.debug("Creating new Daytona sandbox environment")
     logger.debug("Configuring sandbox with browser-use image and environment variables")
@@ -199,6 +203,10 @@ class SandboxToolsBase(Tool):
             raise RuntimeError("Sandbox not initialized. Call _ensure_sandbox() first.")
         return self._sandbox
 
+    async def _sandbox_call(self, func, *args, **kwargs):
+        """Call a blocking Daytona SDK method of the sandbox on the sandbox I/O pool."""
+        return await sandbox_call(self._sandbox_id, func, *args, **kwargs)
+
     @property
     def sandbox_id(self) -> str:
         """Get the sandbox ID, ensuring it exists."""
@@ -0,0 +1,133 @@
+"""
+Non-blocking access to the Daytona SDK.
+
+The Daytona SDK is synchronous: file transfers, command execution and sandbox
+lifecycle calls block for the whole round trip to the sandbox, up to minutes
+for a long shell command. Called from async code they freeze the event loop,
+and with it every other request and SSE stream of the worker. Every SDK call
+therefore goes through sandbox_call, which runs it on bounded thread pools.
+
+On top of that:
+- Calls that may run for minutes (a call_timeout above SANDBOX_CALL_TIMEOUT,
+  or none), such as shell commands, deployments and starting a sandbox, run on
+  a pool of their own, so they can never take the threads that file transfers
+  and other quick calls need.
+- Each sandbox gets at most SANDBOX_MAX_CONCURRENT_CALLS quick and
+  SANDBOX_MAX_LONG_CALLS long calls at once, so one busy agent cannot take a
+  whole pool.
+- Each call has a timeout. A thread cannot be interrupted, so a call that
+  times out keeps running in the background; the caller gets a TimeoutError
+  right away and the call's sandbox slot is released, while the thread stays
+  on its pool until the SDK returns.
+"""
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from utils.logger import logger
+
+# Threads making quick Daytona SDK calls; bounds the concurrent quick calls per process
+SANDBOX_IO_MAX_WORKERS = 32
+# Threads making long Daytona SDK calls; bounds the concurrent long calls per process
+SANDBOX_LONG_IO_MAX_WORKERS = 16
+# Quick calls running at once against the same sandbox
+SANDBOX_MAX_CONCURRENT_CALLS = 4
+# Long calls running at once against the same sandbox
+SANDBOX_MAX_LONG_CALLS = 2
+# Seconds a call may take unless the caller gives its own timeout; calls allowed longer are long calls
+SANDBOX_CALL_TIMEOUT = 60.0
+# Seconds creating or starting a sandbox may take
+SANDBOX_LIFECYCLE_TIMEOUT = 300.0
+# Seconds added to the timeout of SDK calls that take their own, so the SDK reports it first
+SDK_TIMEOUT_MARGIN = 30.0
+# Calls slower than this are logged
+SLOW_CALL_THRESHOLD = 10.0
+
+_executor = ThreadPoolExecutor(max_workers=SANDBOX_IO_MAX_WORKERS, thread_name_prefix="sandbox-io")
+_long_executor = ThreadPoolExecutor(max_workers=SANDBOX_LONG_IO_MAX_WORKERS, thread_name_prefix="sandbox-io-long")
+# Per-sandbox limits of quick and long calls, dropped when no such call of the sandbox is waited for
+_semaphores: Dict[Tuple[str, bool], asyncio.Semaphore] = {}
+_users: Dict[Tuple[str, bool], int] = {}
+
+
+def _acquire_user(key: Tuple[str, bool]) -> asyncio.Semaphore:
+    """Get the semaphore of a sandbox and call kind, and count one more call using it."""
+    semaphore = _semaphores.get(key)
+    if semaphore is None:
+        _, long_call = key
+        semaphore = asyncio.Semaphore(SANDBOX_MAX_LONG_CALLS if long_call else SANDBOX_MAX_CONCURRENT_CALLS)
+        _semaphores[key] = semaphore
+    _users[key] = _users.get(key, 0) + 1
+    return semaphore
+
+
+def _release_user(key: Tuple[str, bool]) -> None:
+    """Count one call less for a sandbox and call kind, dropping its semaphore when unused."""
+    _users[key] -= 1
+    if _users[key] == 0:
+        del _users[key]
+        del _semaphores[key]
+
+
+async def sandbox_call(sandbox_id: Optional[str], func: Callable, *args, call_timeout: Optional[float] = SANDBOX_CALL_TIMEOUT, **kwargs) -> Any:
+    """Call a Daytona SDK function on the sandbox thread pools.
+
+    Args:
+        sandbox_id: The sandbox the call is for, counted against its limit; None for calls
+            not bound to a sandbox yet, e.g. creating one
+        func: SDK function, e.g. sandbox.fs.download_file
+        *args: Positional arguments of the call
+        call_timeout: Seconds to wait for the call; None to wait as long as it takes. Calls
+            allowed more than SANDBOX_CALL_TIMEOUT run on the long call pool. Named so as not
+            to clash with the timeout argument of SDK methods
+        **kwargs: Keyword arguments of the call
+
+    Returns:
+        The result of the call; exceptions from the SDK are raised as they are
+
+    Raises:
+        TimeoutError: If the call did not return within the timeout
+    """
+    name = getattr(func, "__qualname__", repr(func))
+    long_call = call_timeout is None or call_timeout > SANDBOX_CALL_TIMEOUT
+    key = (sandbox_id, long_call)
+    semaphore = None
+    if sandbox_id is not None:
+        semaphore = _acquire_user(key)
+        try:
+            await semaphore.acquire()
+        except BaseException:
+            _release_user(key)
+            raise
+
+    try:
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        future = loop.run_in_executor(
+            _long_executor if long_call else _executor,
+            functools.partial(func, *args, **kwargs)
+        )
+
+        def _on_done(done: asyncio.Future) -> None:
+            # Retrieve the outcome so that calls nobody waits for anymore are not reported as unhandled
+            if not done.cancelled():
+                done.exception()
+            elapsed = time.monotonic() - started
+            if elapsed > SLOW_CALL_THRESHOLD:
+                logger.warning(f"Sandbox call {name} on {sandbox_id} took {elapsed:.1f}s")
+
+        future.add_done_callback(_on_done)
+
+        try:
+            # Shielded so that a waiter that is cancelled or times out leaves the thread's future alone
+            return await asyncio.wait_for(asyncio.shield(future), call_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Sandbox call {name} on {sandbox_id} did not return within {call_timeout}s") from None
+    finally:
+        # The slot is released as soon as nobody waits for the call, even if its thread still runs
+        if semaphore is not None:
+            semaphore.release()
+            _release_user(key)
@@ -11,6 +11,9 @@ from datetime import datetime, timezone
 from utils.logger import logger
 from utils.config import config, EnvMode
 from services.supabase import DBConnection
+from services.billing_cache import billing_status_cache
+from services import usage_ledger
+from services.stripe_client import call_stripe, list_active_subscriptions, retrieve_price
 from utils.auth_utils import get_current_user_id_from_jwt
 from pydantic import BaseModel, Field
 
@@ -70,7 +73,7 @@ async def get_stripe_customer_id(client, user_id: str) -> Optional[str]:
 async def create_stripe_customer(client, user_id: str, email: str) -> str:
     """Create a new Stripe customer for a user."""
     # Create customer in Stripe
-    customer = stripe.Customer.create(
+    customer = await call_stripe(stripe.Customer.create,
         email=email,
         metadata={"user_id": user_id}
     )
@@ -97,10 +100,7 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
             return None
             
         # Get all active subscriptions for the customer
-        subscriptions = stripe.Subscription.list(
-            customer=customer_id,
-            status='active'
-        )
+        subscriptions = await list_active_subscriptions(customer_id)
         # print("Found subscriptions:", subscriptions)
         
         # Check if we have any subscriptions
@@ -139,7 +139,7 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
             for sub in our_subscriptions:
                 if sub['id'] != most_recent['id']:
                     try:
-                        stripe.Subscription.modify(
+                        await call_stripe(stripe.Subscription.modify,
                             sub['id'],
                             cancel_at_period_end=True
                         )
@@ -156,51 +156,19 @@ async def get_user_subscription(user_id: str) -> Optional[Dict]:
         return None
 
 async def calculate_monthly_usage(client, user_id: str) -> float:
-    """Calculate total agent run minutes for the current month for a user."""
-    # Get start of current month in UTC
-    now = datetime.now(timezone.utc)
-    start_of_month = datetime(now.year, now.month, 1, tzinfo=timezone.utc)
-    
-    # First get all threads for this user
-    threads_result = await client.table('threads') \
-        .select('thread_id') \
-        .eq('account_id', user_id) \
-        .execute()
-    
-    if not threads_result.data:
-        return 0.0
-    
-    thread_ids = [t['thread_id'] for t in threads_result.data]
-    
-    # Then get all agent runs for these threads in current month
-    runs_result = await client.table('agent_runs') \
-        .select('started_at, completed_at') \
-        .in_('thread_id', thread_ids) \
-        .gte('started_at', start_of_month.isoformat()) \
-        .execute()
-    
-    if not runs_result.data:
-        return 0.0
-    
-    # Calculate total minutes
-    total_seconds = 0
-    now_ts = now.timestamp()
-    
-    for run in runs_result.data:
-        start_time = datetime.fromisoformat(run['started_at'].replace('Z', '+00:00')).timestamp()
-        if run['completed_at']:
-            end_time = datetime.fromisoformat(run['completed_at'].replace('Z', '+00:00')).timestamp()
-        else:
-            # For running jobs, use current time
-            end_time = now_ts
-        
-        total_seconds += (end_time - start_time)
-    
-    return total_seconds / 60  # Convert to minutes
+    """Calculate total agent run minutes for the current month for a user.
+
+    Reads the account's usage ledger row and the elapsed time of its running
+    runs instead of scanning its threads and runs.
+    """
+    return await usage_ledger.get_monthly_usage_seconds(client, user_id) / 60  # Convert to minutes
 
 async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optional[Dict]]:
     """
     Check if a user can run agents based on their subscription and usage.
+
+    Results are cached per account for a short time and invalidated when the
+    subscription changes or an agent run starts or ends.
     
     Returns:
         Tuple[bool, str, Optional[Dict]]: (can_run, message, subscription_info)
@@ -213,6 +181,10 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
             "minutes_limit": "no limit"
         }
     
+    cached = await billing_status_cache.get(user_id)
+    if cached is not None:
+        return cached
+
     # Get current subscription
     subscription = await get_user_subscription(user_id)
     # print("Current subscription:", subscription)
@@ -242,9 +214,12 @@ async def check_billing_status(client, user_id: str) -> Tuple[bool, str, Optiona
     
     # Check if within limits
     if current_usage >= tier_info['minutes']:
-        return False, f"Monthly limit of {tier_info['minutes']} minutes reached. Please upgrade your plan or wait until next month.", subscription
-    
-    return True, "OK", subscription
+        result = (False, f"Monthly limit of {tier_info['minutes']} minutes reached. Please upgrade your plan or wait until next month.", subscription)
+    else:
+        result = (True, "OK", subscription)
+
+    await billing_status_cache.set(user_id, result)
+    return result
 
 # API endpoints
 @router.post("/create-checkout-session")
@@ -269,7 +244,7 @@ async def create_checkout_session(
         
         # Get the target price and product ID
         try:
-            price = stripe.Price.retrieve(request.price_id, expand=['product'])
+            price = await retrieve_price(request.price_id, expand_product=True)
             product_id = price['product']['id']
         except stripe.error.InvalidRequestError:
             raise HTTPException(status_code=400, detail=f"Invalid price ID: {request.price_id}")
@@ -304,13 +279,13 @@ async def create_checkout_session(
                     }
                 
                 # Get current and new price details
-                current_price = stripe.Price.retrieve(current_price_id)
+                current_price = await retrieve_price(current_price_id)
                 new_price = price # Already retrieved
                 is_upgrade = new_price['unit_amount'] > current_price['unit_amount']
 
                 if is_upgrade:
                     # --- Handle Upgrade --- Immediate modification
-                    updated_subscription = stripe.Subscription.modify(
+                    updated_subscription = await call_stripe(stripe.Subscription.modify,
                         subscription_id,
                         items=[{
                             'id': subscription_item['id'],
@@ -328,7 +303,7 @@ async def create_checkout_session(
                     
                     latest_invoice = None
                     if updated_subscription.get('latest_invoice'):
-                       latest_invoice = stripe.Invoice.retrieve(updated_subscription['latest_invoice']) 
+                       latest_invoice = await call_stripe(stripe.Invoice.retrieve, updated_subscription['latest_invoice']) 
                     
                     return {
                         "subscription_id": updated_subscription['id'],
@@ -354,12 +329,12 @@ async def create_checkout_session(
                         
                         # Retrieve the subscription again to get the schedule ID if it exists
                         # This ensures we have the latest state before creating/modifying schedule
-                        sub_with_schedule = stripe.Subscription.retrieve(subscription_id)
+                        sub_with_schedule = await call_stripe(stripe.Subscription.retrieve, subscription_id)
                         schedule_id = sub_with_schedule.get('schedule')
 
                         # Get the current phase configuration from the schedule or subscription
                         if schedule_id:
-                            schedule = stripe.SubscriptionSchedule.retrieve(schedule_id)
+                            schedule = await call_stripe(stripe.SubscriptionSchedule.retrieve, schedule_id)
                             # Find the current phase in the schedule
                             # This logic assumes simple schedules; might need refinement for complex ones
                             current_phase = None
@@ -424,7 +399,7 @@ async def create_checkout_session(
                             logger.info(f"Updating existing schedule {schedule_id} for subscription {subscription_id}")
                             logger.debug(f"Current phase data: {current_phase_update_data}")
                             logger.debug(f"New phase data: {new_downgrade_phase_data}")
-                            updated_schedule = stripe.SubscriptionSchedule.modify(
+                            updated_schedule = await call_stripe(stripe.SubscriptionSchedule.modify,
                                 schedule_id,
                                 phases=[current_phase_update_data, new_downgrade_phase_data],
                                 end_behavior='release' 
@@ -439,7 +414,7 @@ async def create_checkout_session(
                             logger.debug(f"Current price: {current_price_id}, New price: {request.price_id}")
                             
                             try:
-                                updated_schedule = stripe.SubscriptionSchedule.create(
+                                updated_schedule = await call_stripe(stripe.SubscriptionSchedule.create,
                                     from_subscription=subscription_id,
                                     phases=[
                                         {
@@ -471,7 +446,7 @@ async def create_checkout_session(
                                 # print(f"Created new schedule {updated_schedule['id']} from subscription {subscription_id}")
                                 
                                 # Verify the schedule was created correctly
-                                fetched_schedule = stripe.SubscriptionSchedule.retrieve(updated_schedule['id'])
+                                fetched_schedule = await call_stripe(stripe.SubscriptionSchedule.retrieve, updated_schedule['id'])
                                 logger.info(f"Schedule verification - Status: {fetched_schedule.get('status')}, Phase Count: {len(fetched_schedule.get('phases', []))}")
                                 logger.debug(f"Schedule details: {fetched_schedule}")
                             except Exception as schedule_error:
@@ -499,7 +474,7 @@ async def create_checkout_session(
                 raise HTTPException(status_code=500, detail=f"Error updating subscription: {str(e)}")
         else:
             # --- Create New Subscription via Checkout Session ---
-            session = stripe.checkout.Session.create(
+            session = await call_stripe(stripe.checkout.Session.create,
                 customer=customer_id,
                 payment_method_types=['card'],
                     line_items=[{'price': request.price_id, 'quantity': 1}],
@@ -549,7 +524,7 @@ async def create_portal_session(
         # Ensure the portal configuration has subscription_update enabled
         try:
             # First, check if we have a configuration that already enables subscription update
-            configurations = stripe.billing_portal.Configuration.list(limit=100)
+            configurations = await call_stripe(stripe.billing_portal.Configuration.list, limit=100)
             active_config = None
             
             # Look for a configuration with subscription_update enabled
@@ -568,7 +543,7 @@ async def create_portal_session(
                     default_config = configurations['data'][0]
                     logger.info(f"Updating default portal configuration: {default_config['id']} to enable subscription_update")
                     
-                    active_config = stripe.billing_portal.Configuration.update(
+                    active_config = await call_stripe(stripe.billing_portal.Configuration.update,
                         default_config['id'],
                         features={
                             'subscription_update': {
@@ -585,7 +560,7 @@ async def create_portal_session(
                 else:
                     # Create a new configuration with subscription_update enabled
                     logger.info("Creating new portal configuration with subscription_update enabled")
-                    active_config = stripe.billing_portal.Configuration.create(
+                    active_config = await call_stripe(stripe.billing_portal.Configuration.create,
                         business_profile={
                             'headline': 'Subscription Management',
                             'privacy_policy_url': config.FRONTEND_URL + '/privacy',
@@ -623,7 +598,7 @@ async def create_portal_session(
             portal_params["configuration"] = active_config['id']
         
         # Create the session
-        session = stripe.billing_portal.Session.create(**portal_params)
+        session = await call_stripe(stripe.billing_portal.Session.create, **portal_params)
         
         return {"url": session.url}
         
@@ -682,7 +657,7 @@ async def get_subscription(
         schedule_id = subscription.get('schedule')
         if schedule_id:
             try:
-                schedule = stripe.SubscriptionSchedule.retrieve(schedule_id)
+                schedule = await call_stripe(stripe.SubscriptionSchedule.retrieve, schedule_id)
                 # Find the *next* phase after the current one
                 next_phase = None
                 current_phase_end = current_item['current_period_end']
@@ -770,6 +745,14 @@ async def stripe_webhook(request: Request):
             # Get database connection
             db = DBConnection()
             client = await db.client
+
+            # Drop the cached billing status of the customer's account
+            customer_result = await client.schema('basejump').from_('billing_customers') \
+                .select('account_id') \
+                .eq('id', customer_id) \
+                .execute()
+            for customer in customer_result.data or []:
+                await billing_status_cache.invalidate(customer['account_id'])
             
             if event.type == 'customer.subscription.created' or event.type == 'customer.subscription.updated':
                 # Check if subscription is active
@@ -782,11 +765,7 @@ async def stripe_webhook(request: Request):
                 else:
                     # Subscription is not active (e.g., past_due, canceled, etc.)
                     # Check if customer has any other active subscriptions before updating status
-                    has_active = len(stripe.Subscription.list(
-                        customer=customer_id,
-                        status='active',
-                        limit=1
-                    ).get('data', [])) > 0
+                    has_active = len((await list_active_subscriptions(customer_id, limit=1)).get('data', [])) > 0
                     
                     if not has_active:
                         await client.schema('basejump').from_('billing_customers').update(
@@ -796,11 +775,7 @@ async def stripe_webhook(request: Request):
             
             elif event.type == 'customer.subscription.deleted':
                 # Check if customer has any other active subscriptions
-                has_active = len(stripe.Subscription.list(
-                    customer=customer_id,
-                    status='active',
-                    limit=1
-                ).get('data', [])) > 0
+                has_active = len((await list_active_subscriptions(customer_id, limit=1)).get('data', [])) > 0
                 
                 if not has_active:
                     # If no active subscriptions left, set active to false
@@ -0,0 +1,169 @@
+"""
+Short-lived cache of billing status per account.
+
+check_billing_status runs before every agent start and on every iteration of
+a run. Computing it means a Stripe subscription lookup and a usage query over
+all of the account's runs of the month, so results are cached for a short TTL
+at two levels: an in-process LRU in front of a Redis key shared by all API
+instances.
+
+Entries are dropped as soon as something they depend on changes: Stripe
+subscription webhooks and the start and end of agent runs call invalidate(),
+which deletes the Redis key and tells every instance, through a pub/sub
+channel, to drop its local copy.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from services import redis
+from services.redis_pubsub import pubsub_multiplexer
+from utils.logger import logger
+
+# Seconds a billing status stays cached without being invalidated
+BILLING_STATUS_TTL = 60
+# Accounts kept in the in-process cache
+LOCAL_CACHE_SIZE = 10000
+# Channel on which invalidations are broadcast to every instance
+INVALIDATION_CHANNEL = "billing_status:invalidate"
+
+BillingStatus = Tuple[bool, str, Optional[Dict[str, Any]]]
+
+
+def _cache_key(account_id: str) -> str:
+    """Get the Redis key of an account's cached billing status."""
+    return f"billing_status:{account_id}"
+
+
+class BillingStatusCache:
+    """Two-level cache of check_billing_status results keyed by account.
+
+    Attributes:
+        ttl (int): Seconds an entry stays valid
+        max_size (int): Number of accounts kept in the in-process LRU
+
+    Methods:
+        get: Get the cached billing status of an account
+        set: Cache the billing status of an account
+        invalidate: Drop an account's billing status everywhere
+        close: Stop listening for invalidations
+    """
+
+    def __init__(self, ttl: int = BILLING_STATUS_TTL, max_size: int = LOCAL_CACHE_SIZE):
+        """Initialize an empty cache.
+
+        Args:
+            ttl: Seconds an entry stays valid
+            max_size: Number of accounts kept in the in-process LRU
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._local: "OrderedDict[str, Tuple[float, BillingStatus]]" = OrderedDict()
+        self._invalidations: Optional[asyncio.Queue] = None
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get(self, account_id: str) -> Optional[BillingStatus]:
+        """Get the cached billing status of an account.
+
+        Args:
+            account_id: The ID of the account
+
+        Returns:
+            (can_run, message, subscription) or None if nothing valid is cached
+        """
+        await self._listen()
+        cached = self._local.get(account_id)
+        if cached is not None:
+            expires_at, status = cached
+            if expires_at > time.monotonic():
+                self._local.move_to_end(account_id)
+                return status
+            del self._local[account_id]
+
+        try:
+            value = await redis.get(_cache_key(account_id))
+        except Exception as e:
+            logger.warning(f"Failed to read cached billing status for {account_id}: {str(e)}")
+            return None
+        if value is None:
+            return None
+        data = json.loads(value)
+        status = (data['can_run'], data['message'], data['subscription'])
+        self._store_local(account_id, status)
+        return status
+
+    async def set(self, account_id: str, status: BillingStatus) -> None:
+        """Cache the billing status of an account.
+
+        Args:
+            account_id: The ID of the account
+            status: (can_run, message, subscription) as returned by check_billing_status
+        """
+        can_run, message, subscription = status
+        self._store_local(account_id, status)
+        try:
+            value = json.dumps({"can_run": can_run, "message": message, "subscription": subscription}, default=str)
+            await redis.set(_cache_key(account_id), value, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Failed to cache billing status for {account_id}: {str(e)}")
+
+    async def invalidate(self, account_id: str) -> None:
+        """Drop an account's billing status from this and every other instance.
+
+        Args:
+            account_id: The ID of the account
+        """
+        self._local.pop(account_id, None)
+        try:
+            await redis.delete(_cache_key(account_id))
+            await redis.publish(INVALIDATION_CHANNEL, account_id)
+            logger.debug(f"Invalidated billing status for {account_id}")
+        except Exception as e:
+            logger.warning(f"Failed to invalidate billing status for {account_id}: {str(e)}")
+
+    async def close(self) -> None:
+        """Stop listening for invalidations and clear the local cache."""
+        if self._listener and not self._listener.done():
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        if self._invalidations is not None:
+            await pubsub_multiplexer.unsubscribe(self._invalidations, INVALIDATION_CHANNEL)
+        self._invalidations = None
+        self._listener = None
+        self._local.clear()
+
+    def _store_local(self, account_id: str, status: BillingStatus) -> None:
+        """Put an entry in the LRU, evicting the least recently used account if full."""
+        self._local[account_id] = (time.monotonic() + self.ttl, status)
+        self._local.move_to_end(account_id)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def _listen(self) -> None:
+        """Subscribe to invalidations from other instances on first use."""
+        if self._invalidations is not None:
+            return
+        self._invalidations = asyncio.Queue()
+        try:
+            await pubsub_multiplexer.subscribe(self._invalidations, INVALIDATION_CHANNEL)
+        except Exception as e:
+            # Retried on the next lookup; local entries still expire after the TTL
+            logger.warning(f"Failed to subscribe to billing status invalidations: {str(e)}")
+            self._invalidations = None
+            return
+        self._listener = asyncio.create_task(self._drop_invalidated())
+
+    async def _drop_invalidated(self) -> None:
+        """Drop local entries invalidated by any instance."""
+        while True:
+            _, account_id = await self._invalidations.get()
+            self._local.pop(account_id, None)
+
+
+billing_status_cache = BillingStatusCache()
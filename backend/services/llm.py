@@ -163,6 +163,10 @@ def prepare_params(
     if "claude" in effective_model_name.lower() or "anthropic" in effective_model_name.lower():
         messages = params["messages"] # Direct reference, modification affects params
 
+        # Report usage on the last stream chunk so prompt cache reads can be counted
+        if stream:
+            params["stream_options"] = {"include_usage": True}
+
         # Ensure messages is a list
         if not isinstance(messages, list):
             return params # Return early if messages format is unexpected
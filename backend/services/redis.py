@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 import asyncio
 from utils.logger import logger
-from typing import List, Any
+from typing import List, Any, Dict, Optional, Tuple
 
 # Redis client
 client = None
@@ -138,6 +138,78 @@ async def llen(key: str) -> int:
     return await redis_client.llen(key)
 
 
+# Hash operations
+async def hset(key: str, field: str, value: str):
+    """Set a field of a hash."""
+    redis_client = await get_client()
+    return await redis_client.hset(key, field, value)
+
+
+async def hdel(key: str, *fields: str):
+    """Delete one or more fields of a hash."""
+    redis_client = await get_client()
+    return await redis_client.hdel(key, *fields)
+
+
+async def hgetall(key: str) -> Dict[str, str]:
+    """Get every field of a hash."""
+    redis_client = await get_client()
+    return await redis_client.hgetall(key)
+
+
+async def hset_and_expire(key: str, field: str, value: str, time: int):
+    """Set a field of a hash and the hash's time to live in one transaction."""
+    redis_client = await get_client()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(key, field, value)
+    pipe.expire(key, time)
+    return await pipe.execute()
+
+
+async def hgetall_and_delete(key: str) -> Dict[str, str]:
+    """Get every field of a hash and delete it in one transaction."""
+    redis_client = await get_client()
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hgetall(key)
+    pipe.delete(key)
+    fields, _ = await pipe.execute()
+    return fields
+
+
+# Stream operations
+async def xadd(key: str, fields: Dict[str, Any], maxlen: Optional[int] = None) -> str:
+    """Append an entry to a stream, trimming it to about maxlen entries."""
+    redis_client = await get_client()
+    return await redis_client.xadd(key, fields, maxlen=maxlen, approximate=True)
+
+
+async def xadd_many(key: str, entries: List[Dict[str, Any]], maxlen: Optional[int] = None) -> List[str]:
+    """Append several entries to a stream in one pipelined round trip."""
+    redis_client = await get_client()
+    pipe = redis_client.pipeline(transaction=False)
+    for fields in entries:
+        pipe.xadd(key, fields, maxlen=maxlen, approximate=True)
+    return await pipe.execute()
+
+
+async def xread(key: str, last_id: str, count: Optional[int] = None, block: Optional[int] = None) -> List[Tuple[str, Dict[str, str]]]:
+    """Read the entries of one stream after last_id, blocking up to block ms if there are none."""
+    for _, entries in await xread_streams({key: last_id}, count=count, block=block):
+        return entries
+    return []
+
+
+async def xread_streams(streams: Dict[str, str], count: Optional[int] = None, block: Optional[int] = None) -> List[Tuple[str, List[Tuple[str, Dict[str, str]]]]]:
+    """Read several streams at once; returns (key, entries) for each stream with new entries."""
+    redis_client = await get_client()
+    result = await redis_client.xread(streams, count=count, block=block)
+    if not result:
+        return []
+    if isinstance(result, dict):  # RESP3 replies are keyed by stream name
+        return [(key, value[0]) for key, value in result.items()]
+    return [(key, entries) for key, entries in result]
+
+
 # Key management
 async def expire(key: str, time: int):
     """Set a key's time to live in seconds."""
@@ -0,0 +1,131 @@
+"""
+Per-process multiplexer for Redis pub/sub.
+
+Every agent run listens on its control channels for a STOP signal. Giving each
+run its own pubsub object costs a Redis connection per run plus a polling loop.
+The multiplexer instead keeps one pubsub connection for the whole process,
+subscribes to channels as they are needed and hands each message to the
+asyncio queues registered for its channel. Subscriptions are reference
+counted: Redis is unsubscribed from a channel when its last queue leaves.
+"""
+
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from services import redis
+from utils.logger import logger
+
+# Seconds a read waits for a message before checking for subscription changes
+READ_TIMEOUT = 1.0
+
+PubSubMessage = Tuple[str, str]
+
+
+class PubSubMultiplexer:
+    """Shares one pubsub connection between all subscribers of the process.
+
+    Queues receive (channel, data) tuples for every message published to the
+    channels they are subscribed to.
+
+    Methods:
+        subscribe: Register a queue for one or more channels
+        unsubscribe: Remove a queue from one or more channels
+        close: Drop every subscription and the pubsub connection
+    """
+
+    def __init__(self):
+        """Initialize a multiplexer without a connection; it connects on first use."""
+        self._pubsub = None
+        self._queues: Dict[str, Set[asyncio.Queue]] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    async def subscribe(self, queue: asyncio.Queue, *channels: str) -> None:
+        """Register a queue for one or more channels.
+
+        Args:
+            queue: Queue that receives (channel, data) tuples
+            *channels: Channels to listen on
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._pubsub is None:
+                self._pubsub = await redis.create_pubsub()
+            new_channels = [channel for channel in channels if channel not in self._queues]
+            if new_channels:
+                await self._pubsub.subscribe(*new_channels)
+                logger.debug(f"Subscribed to channels: {new_channels}")
+            for channel in channels:
+                self._queues.setdefault(channel, set()).add(queue)
+
+            if self._reader is None or self._reader.done():
+                self._reader = asyncio.create_task(self._read())
+
+    async def unsubscribe(self, queue: asyncio.Queue, *channels: str) -> None:
+        """Remove a queue from one or more channels.
+
+        Args:
+            queue: Queue passed to subscribe()
+            *channels: Channels to stop listening on
+        """
+        if self._lock is None:
+            return
+        async with self._lock:
+            unused_channels = []
+            for channel in channels:
+                queues = self._queues.get(channel)
+                if queues is None:
+                    continue
+                queues.discard(queue)
+                if not queues:
+                    del self._queues[channel]
+                    unused_channels.append(channel)
+            if unused_channels and self._pubsub is not None:
+                try:
+                    await self._pubsub.unsubscribe(*unused_channels)
+                    logger.debug(f"Unsubscribed from channels: {unused_channels}")
+                except Exception as e:
+                    logger.warning(f"Failed to unsubscribe from {unused_channels}: {str(e)}")
+
+    async def close(self) -> None:
+        """Drop every subscription and the pubsub connection."""
+        if self._reader and not self._reader.done():
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        self._reader = None
+        self._queues.clear()
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.aclose()
+            except Exception as e:
+                logger.warning(f"Error closing multiplexed pubsub: {str(e)}")
+            self._pubsub = None
+
+    async def _read(self) -> None:
+        """Dispatch messages to the subscribed queues until no channel is left."""
+        while self._queues:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=READ_TIMEOUT)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The pubsub object reconnects and resubscribes on its next read
+                logger.error(f"Error reading multiplexed pubsub: {str(e)}")
+                await asyncio.sleep(READ_TIMEOUT)
+                continue
+
+            if not message or message.get("type") != "message":
+                continue
+            channel = message.get("channel")
+            data = message.get("data")
+            if isinstance(channel, bytes): channel = channel.decode('utf-8')
+            if isinstance(data, bytes): data = data.decode('utf-8')
+            for queue in list(self._queues.get(channel, ())):
+                queue.put_nowait((channel, data))
+
+
+pubsub_multiplexer = PubSubMultiplexer()
@@ -0,0 +1,223 @@
+"""
+Content-addressed store of browser screenshots.
+
+Every browser action returns a JPEG screenshot, and consecutive actions often
+return the very same image (a wait, a scroll at the end of the page, a click
+that changed nothing). Screenshots are stored once in a Supabase storage
+bucket under the SHA-256 of their bytes, and the rest of the pipeline passes
+that hash around instead of megabytes of base64. The base64 is only rebuilt
+when the LLM payload is.
+
+Recently stored screenshots are also kept in an in-process LRU, bounded in
+bytes: the run that takes a screenshot is almost always the one that sends it
+to the LLM on its next iteration, so it rarely has to be downloaded again.
+
+Screenshots are kept for SCREENSHOT_RETENTION_DAYS after they were last
+stored. Uploads overwrite the object, so storing a screenshot again renews it,
+and cleanup() deletes the expired ones; it is run periodically by
+utils/scripts/cleanup_browser_screenshots.py.
+"""
+
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from services.supabase import DBConnection
+from utils.logger import logger
+
+# Storage bucket holding the screenshots
+SCREENSHOT_BUCKET = "browser_screenshots"
+# Bytes of screenshots kept in the in-process cache
+LOCAL_CACHE_BYTES = 64 * 1024 * 1024
+# Hashes remembered as stored, so duplicates skip the upload entirely
+KNOWN_HASHES_SIZE = 10000
+# Seconds a hash is remembered as stored; uploading it again after that renews its retention
+KNOWN_HASH_TTL = 24 * 3600
+# Days a screenshot is kept after it was last stored
+SCREENSHOT_RETENTION_DAYS = 30
+# Objects listed or removed per storage request
+CLEANUP_PAGE_SIZE = 1000
+
+
+def _object_path(screenshot_hash: str) -> str:
+    """Get the storage path of a screenshot; the prefix spreads objects over folders."""
+    return f"{screenshot_hash[:2]}/{screenshot_hash}.jpg"
+
+
+class ScreenshotStore:
+    """Deduplicating store of screenshots keyed by the SHA-256 of their bytes.
+
+    Attributes:
+        bucket (str): Storage bucket holding the screenshots
+        cache_bytes (int): Bytes of screenshots kept in the in-process cache
+
+    Methods:
+        put: Store a screenshot, unless it is already stored
+        put_base64: Store a base64 encoded screenshot
+        get: Get the bytes of a screenshot
+        get_base64: Get a screenshot as base64
+        cleanup: Delete the screenshots not stored again within the retention period
+    """
+
+    def __init__(self, bucket: str = SCREENSHOT_BUCKET, cache_bytes: int = LOCAL_CACHE_BYTES):
+        """Initialize the store with empty caches.
+
+        Args:
+            bucket: Storage bucket holding the screenshots
+            cache_bytes: Bytes of screenshots kept in the in-process cache
+        """
+        self.bucket = bucket
+        self.cache_bytes = cache_bytes
+        self._cache: "OrderedDict[str, bytes]" = OrderedDict()
+        self._cached_bytes = 0
+        self._known: "OrderedDict[str, float]" = OrderedDict()  # Hash to time it was stored
+        self._db = DBConnection()
+
+    async def put(self, image: bytes) -> str:
+        """Store a screenshot, unless it is already stored.
+
+        Args:
+            image: The JPEG bytes
+
+        Returns:
+            The hash of the screenshot
+
+        Raises:
+            Exception: If the upload fails
+        """
+        screenshot_hash = hashlib.sha256(image).hexdigest()
+        self._cache_put(screenshot_hash, image)
+        stored_at = self._known.get(screenshot_hash)
+        if stored_at is not None and time.monotonic() - stored_at < KNOWN_HASH_TTL:
+            self._known.move_to_end(screenshot_hash)
+            logger.debug(f"Screenshot {screenshot_hash} already stored, skipping upload")
+            return screenshot_hash
+
+        client = await self._db.client
+        # Overwriting is harmless since the path is the hash of the bytes; it also means
+        # another run storing the same screenshot first is not an error, and renews it
+        await client.storage.from_(self.bucket).upload(
+            _object_path(screenshot_hash),
+            image,
+            {"content-type": "image/jpeg", "upsert": "true"}
+        )
+        logger.debug(f"Stored screenshot {screenshot_hash} ({len(image)} bytes)")
+        self._remember(screenshot_hash)
+        return screenshot_hash
+
+    async def put_base64(self, image_base64: str) -> str:
+        """Store a base64 encoded screenshot, unless it is already stored.
+
+        Args:
+            image_base64: The JPEG bytes, base64 encoded
+
+        Returns:
+            The hash of the screenshot
+        """
+        return await self.put(base64.b64decode(image_base64))
+
+    async def get(self, screenshot_hash: str) -> Optional[bytes]:
+        """Get the bytes of a screenshot.
+
+        Args:
+            screenshot_hash: The hash returned by put
+
+        Returns:
+            The JPEG bytes, or None if the screenshot cannot be read
+        """
+        image = self._cache.get(screenshot_hash)
+        if image is not None:
+            self._cache.move_to_end(screenshot_hash)
+            return image
+
+        try:
+            client = await self._db.client
+            image = await client.storage.from_(self.bucket).download(_object_path(screenshot_hash))
+        except Exception as e:
+            logger.error(f"Failed to download screenshot {screenshot_hash}: {str(e)}")
+            return None
+        self._cache_put(screenshot_hash, image)
+        return image
+
+    async def get_base64(self, screenshot_hash: str) -> Optional[str]:
+        """Get a screenshot as base64, e.g. to build a data URL.
+
+        Args:
+            screenshot_hash: The hash returned by put
+
+        Returns:
+            The base64 encoded JPEG, or None if the screenshot cannot be read
+        """
+        image = await self.get(screenshot_hash)
+        if image is None:
+            return None
+        return base64.b64encode(image).decode("ascii")
+
+    async def cleanup(self, retention_days: int = SCREENSHOT_RETENTION_DAYS) -> int:
+        """Delete the screenshots not stored again within the retention period.
+
+        Args:
+            retention_days: Days a screenshot is kept after it was last stored
+
+        Returns:
+            Number of screenshots deleted
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+        client = await self._db.client
+        bucket = client.storage.from_(self.bucket)
+        deleted = 0
+        for prefix in (f"{i:02x}" for i in range(256)):
+            expired = []
+            offset = 0
+            while True:
+                # Oldest first, so a folder is only listed up to its first screenshot to keep
+                objects = await bucket.list(prefix, {
+                    "limit": CLEANUP_PAGE_SIZE,
+                    "offset": offset,
+                    "sortBy": {"column": "updated_at", "order": "asc"},
+                })
+                reached_fresh = False
+                for obj in objects:
+                    updated_at = obj.get("updated_at")
+                    if not updated_at or datetime.fromisoformat(updated_at.replace("Z", "+00:00")) >= cutoff:
+                        reached_fresh = True
+                        break
+                    expired.append(f"{prefix}/{obj['name']}")
+                if reached_fresh or len(objects) < CLEANUP_PAGE_SIZE:
+                    break
+                offset += CLEANUP_PAGE_SIZE
+
+            for start in range(0, len(expired), CLEANUP_PAGE_SIZE):
+                await bucket.remove(expired[start:start + CLEANUP_PAGE_SIZE])
+            deleted += len(expired)
+
+        # Hashes remembered as stored may just have been deleted
+        self._known.clear()
+        logger.info(f"Deleted {deleted} screenshots not stored since {cutoff.isoformat()}")
+        return deleted
+
+    def _remember(self, screenshot_hash: str) -> None:
+        """Record a hash as stored, forgetting the least recently used ones."""
+        self._known[screenshot_hash] = time.monotonic()
+        self._known.move_to_end(screenshot_hash)
+        while len(self._known) > KNOWN_HASHES_SIZE:
+            self._known.popitem(last=False)
+
+    def _cache_put(self, screenshot_hash: str, image: bytes) -> None:
+        """Keep a screenshot in the in-process cache, evicting the least recently used ones."""
+        if screenshot_hash in self._cache:
+            self._cache.move_to_end(screenshot_hash)
+            return
+        if len(image) > self.cache_bytes:
+            return
+        self._cache[screenshot_hash] = image
+        self._cached_bytes += len(image)
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= len(evicted)
+
+
+screenshot_store = ScreenshotStore()
@@ -0,0 +1,106 @@
+"""
+Async access to the Stripe API.
+
+The stripe SDK is synchronous. Calling it from a request handler blocks the
+event loop for the whole HTTP round trip, so every call goes through
+call_stripe, which runs it on a small dedicated thread pool. The SDK's
+requests-based HTTP client keeps a session per thread, so the pool's
+long-lived threads reuse their connections to Stripe.
+
+On top of that:
+- Concurrent listings of the same customer's subscriptions share one request
+  (single-flight), e.g. a billing check and a webhook arriving together.
+- Prices, including their expanded product, hardly ever change, so they are
+  cached for an hour.
+"""
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import stripe
+
+from utils.logger import logger
+
+# Threads making Stripe requests; bounds the concurrent requests per process
+STRIPE_MAX_WORKERS = 8
+# Seconds prices stay cached
+CATALOG_CACHE_TTL = 3600
+
+_executor = ThreadPoolExecutor(max_workers=STRIPE_MAX_WORKERS, thread_name_prefix="stripe")
+# Requests in flight, keyed by what they fetch
+_inflight: Dict[Hashable, asyncio.Future] = {}
+# Cached prices: key -> (expiry, object)
+_catalog_cache: Dict[Tuple, Tuple[float, Any]] = {}
+
+
+async def call_stripe(func: Callable, *args, **kwargs) -> Any:
+    """Call a Stripe SDK function on the Stripe thread pool.
+
+    Args:
+        func: SDK function, e.g. stripe.Customer.create
+        *args: Positional arguments of the call
+        **kwargs: Keyword arguments of the call
+
+    Returns:
+        The result of the call; exceptions from the SDK are raised as they are
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def _single_flight(key: Hashable, func: Callable, *args, **kwargs) -> Any:
+    """Call a Stripe SDK function, sharing the result with identical calls in flight."""
+    future = _inflight.get(key)
+    if future is None:
+        future = asyncio.ensure_future(call_stripe(func, *args, **kwargs))
+        _inflight[key] = future
+        future.add_done_callback(lambda _: _inflight.pop(key, None))
+    else:
+        logger.debug(f"Joining Stripe request in flight: {key}")
+    # A waiter that is cancelled must not cancel the request for the others
+    return await asyncio.shield(future)
+
+
+async def list_active_subscriptions(customer_id: str, limit: Optional[int] = None) -> Any:
+    """List a customer's active subscriptions, coalescing concurrent identical listings.
+
+    Args:
+        customer_id: Stripe customer ID
+        limit: Maximum number of subscriptions to return; Stripe's default if None
+
+    Returns:
+        The Stripe list object; it is shared between the coalesced callers and must not be modified
+    """
+    params = {"customer": customer_id, "status": "active"}
+    if limit is not None:
+        params["limit"] = limit
+    return await _single_flight(("subscriptions", customer_id, limit), stripe.Subscription.list, **params)
+
+
+async def _cached(key: Tuple, func: Callable, *args, **kwargs) -> Any:
+    """Fetch a price through the cache."""
+    cached = _catalog_cache.get(key)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    result = await _single_flight(key, func, *args, **kwargs)
+    _catalog_cache[key] = (time.monotonic() + CATALOG_CACHE_TTL, result)
+    return result
+
+
+async def retrieve_price(price_id: str, expand_product: bool = False) -> Any:
+    """Retrieve a price, from the cache when possible.
+
+    Args:
+        price_id: Stripe price ID
+        expand_product: Include the full product object under "product"
+
+    Returns:
+        The Stripe price object; it is shared and must not be modified
+    """
+    if expand_product:
+        return await _cached(("price", price_id, True), stripe.Price.retrieve, price_id, expand=['product'])
+    return await _cached(("price", price_id, False), stripe.Price.retrieve, price_id)
+
@@ -0,0 +1,105 @@
+"""
+Monthly agent run usage per account, read in constant time.
+
+Completed runs are summed by the database: a trigger on agent_runs adds each
+run's duration to the account_monthly_usage row of the account and the month
+the run started in. Runs still going are tracked in a Redis hash per account
+(run ID -> start timestamp) from the moment they start until they end, so
+their elapsed time can be added without querying agent_runs.
+
+utils/scripts/reconcile_monthly_usage.py backfills the ledger and corrects
+any drift from agent_runs.
+"""
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from services import redis
+from utils.logger import logger
+
+
+def month_start(moment: Optional[datetime] = None) -> datetime:
+    """Get the start of the UTC month of a moment, now by default."""
+    moment = moment or datetime.now(timezone.utc)
+    return datetime(moment.year, moment.month, 1, tzinfo=timezone.utc)
+
+
+def _live_runs_key(account_id: str) -> str:
+    """Get the Redis key of an account's running agent runs."""
+    return f"account_live_runs:{account_id}"
+
+
+async def track_live_run(account_id: str, agent_run_id: str, started_at: datetime) -> None:
+    """Count a run's elapsed time towards its account's usage until it ends.
+
+    Args:
+        account_id: The ID of the account the run belongs to
+        agent_run_id: The ID of the agent run
+        started_at: When the run started
+    """
+    key = _live_runs_key(account_id)
+    try:
+        await redis.hset(key, agent_run_id, str(started_at.timestamp()))
+        # Safety net for runs whose instance died before untracking them
+        await redis.expire(key, redis.REDIS_KEY_TTL)
+    except Exception as e:
+        logger.warning(f"Failed to track live run {agent_run_id} for usage: {str(e)}")
+
+
+async def untrack_live_run(account_id: str, agent_run_id: str) -> None:
+    """Stop counting a run that ended; its duration is in the ledger from now on.
+
+    Args:
+        account_id: The ID of the account the run belongs to
+        agent_run_id: The ID of the agent run
+    """
+    try:
+        await redis.hdel(_live_runs_key(account_id), agent_run_id)
+    except Exception as e:
+        logger.warning(f"Failed to untrack live run {agent_run_id} for usage: {str(e)}")
+
+
+async def get_live_run_seconds(account_id: str, since: datetime) -> float:
+    """Get the elapsed seconds of an account's running agent runs that started after since.
+
+    Args:
+        account_id: The ID of the account
+        since: Start of the period, usually the start of the month
+
+    Returns:
+        Sum of the elapsed seconds, 0 if Redis cannot be read
+    """
+    try:
+        live_runs = await redis.hgetall(_live_runs_key(account_id))
+    except Exception as e:
+        logger.warning(f"Failed to read live runs of {account_id}: {str(e)}")
+        return 0.0
+
+    now_ts = datetime.now(timezone.utc).timestamp()
+    since_ts = since.timestamp()
+    total_seconds = 0.0
+    for started_at in live_runs.values():
+        start_ts = float(started_at)
+        if start_ts >= since_ts:
+            total_seconds += max(0.0, now_ts - start_ts)
+    return total_seconds
+
+
+async def get_monthly_usage_seconds(client, account_id: str) -> float:
+    """Get the agent run seconds of an account in the current month.
+
+    Args:
+        client: Supabase client
+        account_id: The ID of the account
+
+    Returns:
+        Seconds of the completed runs from the ledger plus the elapsed time of running ones
+    """
+    start_of_month = month_start()
+    result = await client.table('account_monthly_usage') \
+        .select('seconds') \
+        .eq('account_id', account_id) \
+        .eq('month', start_of_month.date().isoformat()) \
+        .execute()
+    completed_seconds = result.data[0]['seconds'] if result.data else 0.0
+    return completed_seconds + await get_live_run_seconds(account_id, start_of_month)
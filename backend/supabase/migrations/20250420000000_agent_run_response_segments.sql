@@ -0,0 +1,77 @@
+-- Responses of agent runs, stored as one row per segment the run appends.
+-- Each append only writes its own segment; get_agent_run_responses
+-- concatenates the segments of a run in order on read
+CREATE TABLE agent_run_response_segments (
+    id BIGSERIAL PRIMARY KEY,
+    agent_run_id UUID NOT NULL REFERENCES agent_runs(id) ON DELETE CASCADE,
+    responses JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL
+);
+
+-- Segments are read per run in insertion order
+CREATE INDEX idx_agent_run_response_segments_agent_run_id ON agent_run_response_segments(agent_run_id, id);
+
+-- Enable Row Level Security
+ALTER TABLE agent_run_response_segments ENABLE ROW LEVEL SECURITY;
+
+-- Create policies for segments based on the agent run's thread ownership
+CREATE POLICY agent_run_response_segment_select_policy ON agent_run_response_segments
+    FOR SELECT
+    USING (
+        EXISTS (
+            SELECT 1 FROM agent_runs
+            JOIN threads ON threads.thread_id = agent_runs.thread_id
+            LEFT JOIN projects ON threads.project_id = projects.project_id
+            WHERE agent_runs.id = agent_run_response_segments.agent_run_id
+            AND (
+                projects.is_public = TRUE OR
+                basejump.has_role_on_account(threads.account_id) = true OR
+                basejump.has_role_on_account(projects.account_id) = true
+            )
+        )
+    );
+
+CREATE POLICY agent_run_response_segment_insert_policy ON agent_run_response_segments
+    FOR INSERT
+    WITH CHECK (
+        EXISTS (
+            SELECT 1 FROM agent_runs
+            JOIN threads ON threads.thread_id = agent_runs.thread_id
+            LEFT JOIN projects ON threads.project_id = projects.project_id
+            WHERE agent_runs.id = agent_run_response_segments.agent_run_id
+            AND (
+                basejump.has_role_on_account(threads.account_id) = true OR
+                basejump.has_role_on_account(projects.account_id) = true
+            )
+        )
+    );
+
+GRANT ALL PRIVILEGES ON TABLE agent_run_response_segments TO authenticated, service_role;
+GRANT USAGE, SELECT ON SEQUENCE agent_run_response_segments_id_seq TO authenticated, service_role;
+
+-- Append a segment of responses to an agent run
+-- Runs with the caller's privileges, so the segment policies still apply
+CREATE OR REPLACE FUNCTION append_agent_run_responses(p_agent_run_id UUID, p_responses JSONB)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    INSERT INTO agent_run_response_segments (agent_run_id, responses)
+    VALUES (p_agent_run_id, p_responses);
+$$;
+
+-- The responses of the given agent runs, with their segments concatenated in order
+CREATE OR REPLACE FUNCTION get_agent_run_responses(p_agent_run_ids UUID[])
+RETURNS TABLE (agent_run_id UUID, responses JSONB)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT s.agent_run_id, JSONB_AGG(r.value ORDER BY s.id, r.ordinality)
+    FROM agent_run_response_segments s
+    CROSS JOIN LATERAL JSONB_ARRAY_ELEMENTS(s.responses) WITH ORDINALITY AS r(value, ordinality)
+    WHERE s.agent_run_id = ANY(p_agent_run_ids)
+    GROUP BY s.agent_run_id;
+$$;
+
+-- Grant execute permissions
+GRANT EXECUTE ON FUNCTION append_agent_run_responses TO authenticated, anon, service_role;
+GRANT EXECUTE ON FUNCTION get_agent_run_responses TO authenticated, anon, service_role;
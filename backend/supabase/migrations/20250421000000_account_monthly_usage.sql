@@ -0,0 +1,98 @@
+-- Agent run seconds per account and month, kept up to date as runs complete
+-- A run counts towards the month it started in, for its whole duration
+CREATE TABLE account_monthly_usage (
+    account_id UUID NOT NULL REFERENCES basejump.accounts(id) ON DELETE CASCADE,
+    month DATE NOT NULL, -- First day of the month, UTC
+    seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT TIMEZONE('utc'::text, NOW()) NOT NULL,
+    PRIMARY KEY (account_id, month)
+);
+
+CREATE TRIGGER update_account_monthly_usage_updated_at
+    BEFORE UPDATE ON account_monthly_usage
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+ALTER TABLE account_monthly_usage ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY account_monthly_usage_select_policy ON account_monthly_usage
+    FOR SELECT
+    USING (basejump.has_role_on_account(account_id) = true);
+
+-- Add the change in a run's completed duration to its account's month
+CREATE OR REPLACE FUNCTION record_agent_run_usage()
+RETURNS TRIGGER
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    run_account_id UUID;
+    old_seconds DOUBLE PRECISION := 0;
+    new_seconds DOUBLE PRECISION := 0;
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.completed_at IS NOT NULL THEN
+        old_seconds := EXTRACT(EPOCH FROM (OLD.completed_at - OLD.started_at));
+    END IF;
+    IF NEW.completed_at IS NOT NULL THEN
+        new_seconds := EXTRACT(EPOCH FROM (NEW.completed_at - NEW.started_at));
+    END IF;
+    IF new_seconds = old_seconds THEN
+        RETURN NEW;
+    END IF;
+
+    SELECT account_id INTO run_account_id FROM threads WHERE thread_id = NEW.thread_id;
+    IF run_account_id IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    INSERT INTO account_monthly_usage (account_id, month, seconds)
+    VALUES (run_account_id, DATE_TRUNC('month', NEW.started_at AT TIME ZONE 'UTC')::DATE, new_seconds - old_seconds)
+    ON CONFLICT (account_id, month)
+    DO UPDATE SET seconds = account_monthly_usage.seconds + EXCLUDED.seconds;
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER record_agent_run_usage
+    AFTER INSERT OR UPDATE OF started_at, completed_at ON agent_runs
+    FOR EACH ROW
+    EXECUTE FUNCTION record_agent_run_usage();
+
+-- Recompute an account's month from agent_runs and store it; used for backfill and reconciliation
+-- Returns the seconds stored before and after
+CREATE OR REPLACE FUNCTION reconcile_account_monthly_usage(p_account_id UUID, p_month DATE)
+RETURNS TABLE (previous_seconds DOUBLE PRECISION, seconds DOUBLE PRECISION)
+SECURITY DEFINER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    month_start TIMESTAMP WITH TIME ZONE := DATE_TRUNC('month', p_month::TIMESTAMP) AT TIME ZONE 'UTC';
+    stored_seconds DOUBLE PRECISION;
+    actual_seconds DOUBLE PRECISION;
+BEGIN
+    -- Serialize with the trigger's updates of the same row
+    INSERT INTO account_monthly_usage (account_id, month, seconds)
+    VALUES (p_account_id, month_start::DATE, 0)
+    ON CONFLICT (account_id, month) DO NOTHING;
+    SELECT u.seconds INTO stored_seconds FROM account_monthly_usage u
+    WHERE u.account_id = p_account_id AND u.month = month_start::DATE
+    FOR UPDATE;
+
+    SELECT COALESCE(SUM(EXTRACT(EPOCH FROM (r.completed_at - r.started_at))), 0) INTO actual_seconds
+    FROM agent_runs r
+    JOIN threads t ON t.thread_id = r.thread_id
+    WHERE t.account_id = p_account_id
+      AND r.completed_at IS NOT NULL
+      AND r.started_at >= month_start
+      AND r.started_at < month_start + INTERVAL '1 month';
+
+    UPDATE account_monthly_usage u SET seconds = actual_seconds
+    WHERE u.account_id = p_account_id AND u.month = month_start::DATE;
+
+    RETURN QUERY SELECT stored_seconds, actual_seconds;
+END;
+$$;
+
+-- Only the backend reconciles usage
+REVOKE EXECUTE ON FUNCTION reconcile_account_monthly_usage FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION reconcile_account_monthly_usage TO service_role;
@@ -0,0 +1,7 @@
+-- Server-assigned insertion order of messages. Readers that only fetch the
+-- rows added since their last read use it as their high-water mark: unlike
+-- created_at, which the writing client sets, it does not depend on the clock
+-- of whoever wrote the row. Existing rows are numbered when the column is added
+ALTER TABLE messages ADD COLUMN seq BIGINT GENERATED ALWAYS AS IDENTITY;
+
+CREATE INDEX idx_messages_thread_id_seq ON messages(thread_id, seq);
@@ -0,0 +1,46 @@
+-- Everything run_agent needs before an iteration, in one round trip: the type
+-- of the last conversation message and, if p_after_seq is given, the LLM
+-- message rows with a higher seq. Read-only; browser state and image context
+-- reach run_agent through Redis
+CREATE OR REPLACE FUNCTION get_agent_iteration_state(p_thread_id UUID, p_after_seq BIGINT DEFAULT NULL)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+    last_message_type TEXT;
+    new_messages JSONB;
+BEGIN
+    SELECT m.type INTO last_message_type
+    FROM messages m
+    WHERE m.thread_id = p_thread_id
+      AND m.type IN ('assistant', 'tool', 'user')
+    ORDER BY m.seq DESC
+    LIMIT 1;
+
+    IF p_after_seq IS NOT NULL THEN
+        SELECT COALESCE(JSONB_AGG(
+            JSONB_BUILD_OBJECT(
+                'seq', m.seq,
+                'message_id', m.message_id,
+                'type', m.type,
+                'content', m.content,
+                'metadata', m.metadata,
+                'created_at', m.created_at
+            ) ORDER BY m.seq
+        ), '[]'::JSONB) INTO new_messages
+        FROM messages m
+        WHERE m.thread_id = p_thread_id
+          AND m.is_llm_message = TRUE
+          AND m.seq > p_after_seq;
+    END IF;
+
+    RETURN JSONB_BUILD_OBJECT(
+        'last_message_type', last_message_type,
+        'messages', new_messages
+    );
+END;
+$$;
+
+-- Grant execute permissions
+GRANT EXECUTE ON FUNCTION get_agent_iteration_state TO authenticated, service_role;
@@ -0,0 +1,7 @@
+-- Content-addressed browser screenshots, stored once per distinct image under
+-- <first two hex digits>/<sha256>.jpg; only the backend's service role reads
+-- and writes them. Screenshots not stored again for 30 days are deleted by
+-- utils/scripts/cleanup_browser_screenshots.py
+INSERT INTO storage.buckets (id, name, public, file_size_limit, allowed_mime_types)
+VALUES ('browser_screenshots', 'browser_screenshots', false, null, ARRAY['image/jpeg'])
+ON CONFLICT (id) DO NOTHING; -- Avoid error if bucket already exists
@@ -0,0 +1,212 @@
+"""
+Tests for the per-thread LLM message cache.
+
+The database is replaced by an in-memory messages table that supports the
+query builder calls the cache makes and counts the queries it receives.
+"""
+
+import json
+
+import pytest
+
+from agentpress.message_cache import ThreadMessageCache
+
+
+class FakeQuery:
+    def __init__(self, table):
+        self.table = table
+        self.filters = []
+        self.order_desc = False
+        self.bounds = None
+        self.max_rows = None
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row[column] == value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row[column] > value)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_desc = desc
+        return self
+
+    def limit(self, count):
+        self.max_rows = count
+        return self
+
+    def range(self, start, end):
+        self.bounds = (start, end + 1)
+        return self
+
+    async def execute(self):
+        self.table.queries += 1
+        rows = [row for row in self.table.rows if all(check(row) for check in self.filters)]
+        rows.sort(key=lambda row: row['seq'], reverse=self.order_desc)
+        if self.bounds:
+            rows = rows[self.bounds[0]:self.bounds[1]]
+        if self.max_rows is not None:
+            rows = rows[:self.max_rows]
+        return type('Result', (), {'data': [dict(row) for row in rows]})()
+
+
+class FakeTable:
+    def __init__(self):
+        self.rows = []
+        self.queries = 0
+
+    def select(self, columns):
+        return FakeQuery(self).select(columns)
+
+
+class FakeDB:
+    def __init__(self):
+        self.table = FakeTable()
+
+    @property
+    async def client(self):
+        return type('Client', (), {'table': lambda _, name: self.table})()
+
+
+def add_row(db, thread_id, text, type='user', content=None, seq=None):
+    seq = seq if seq is not None else len(db.table.rows) + 1
+    row = {
+        'seq': seq,
+        'message_id': f'm{seq}',
+        'thread_id': thread_id,
+        'type': type,
+        'is_llm_message': True,
+        'content': content if content is not None else json.dumps({'role': 'user', 'content': text}),
+        'metadata': json.dumps({'message_token_count': 1}),
+    }
+    db.table.rows.append(row)
+    return row
+
+
+def texts(messages):
+    return [message['content'] for message in messages]
+
+
+@pytest.mark.asyncio
+async def test_only_new_rows_are_fetched_after_load():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', 'a')
+    add_row(db, 't1', 'b')
+
+    assert texts(await cache.get_messages('t1')) == ['a', 'b']
+    add_row(db, 't1', 'c')
+    add_row(db, 't2', 'other thread')
+    queries = db.table.queries
+
+    assert texts(await cache.get_messages('t1')) == ['a', 'b', 'c']
+    assert db.table.queries == queries + 1
+    assert await cache.get_token_count('t1', refresh=False) == 3
+
+
+@pytest.mark.asyncio
+async def test_history_starts_at_latest_summary():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', 'old')
+    add_row(db, 't1', 'summary', type='summary')
+    add_row(db, 't1', 'new')
+
+    assert texts(await cache.get_messages('t1')) == ['summary', 'new']
+
+
+@pytest.mark.asyncio
+async def test_new_summary_drops_older_cached_messages():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', 'a')
+    await cache.get_messages('t1')
+    add_row(db, 't1', 'b')
+    add_row(db, 't1', 'summary', type='summary')
+    add_row(db, 't1', 'c')
+
+    assert texts(await cache.get_messages('t1')) == ['summary', 'c']
+    assert await cache.get_token_count('t1', refresh=False) == 2
+
+
+@pytest.mark.asyncio
+async def test_rows_with_an_earlier_created_at_are_still_fetched():
+    # A row from a worker with a slow clock: its seq is still higher
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', 'a')
+    await cache.get_messages('t1')
+    row = add_row(db, 't1', 'late')
+    row['created_at'] = '2000-01-01T00:00:00+00:00'
+
+    assert texts(await cache.get_messages('t1')) == ['a', 'late']
+
+
+@pytest.mark.asyncio
+async def test_unparseable_rows_do_not_force_a_reload():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', None, content='not json')
+    assert await cache.get_messages('t1') == []
+    queries = db.table.queries
+
+    assert await cache.get_messages('t1') == []
+    # One incremental fetch, not the summary lookup and history load again
+    assert db.table.queries == queries + 1
+
+
+@pytest.mark.asyncio
+async def test_empty_thread_is_not_reloaded():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    assert await cache.get_messages('t1') == []
+    queries = db.table.queries
+
+    add_row(db, 't1', 'a')
+    assert texts(await cache.get_messages('t1')) == ['a']
+    assert db.table.queries == queries + 1
+
+
+@pytest.mark.asyncio
+async def test_applied_rows_are_used_without_a_fetch():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', 'a')
+    await cache.get_messages('t1')
+    after_seq = cache.refresh_after('t1')
+    new_rows = [row for row in [add_row(db, 't1', 'b')] if row['seq'] > after_seq]
+    await cache.apply_rows('t1', new_rows)
+    queries = db.table.queries
+
+    assert texts(await cache.get_messages('t1')) == ['a', 'b']
+    assert db.table.queries == queries
+
+
+@pytest.mark.asyncio
+async def test_note_write_makes_the_next_read_fetch():
+    db = FakeDB()
+    cache = ThreadMessageCache(db)
+    add_row(db, 't1', 'a')
+    await cache.get_messages('t1')
+    await cache.apply_rows('t1', [])
+    add_row(db, 't1', 'b')
+    cache.note_write('t1')
+
+    assert texts(await cache.get_messages('t1')) == ['a', 'b']
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_thread_is_dropped():
+    db = FakeDB()
+    cache = ThreadMessageCache(db, max_threads=1)
+    add_row(db, 't1', 'a')
+    add_row(db, 't2', 'b')
+    await cache.get_messages('t1')
+    await cache.get_messages('t2')
+
+    assert cache.refresh_after('t1') is None
+    assert cache.refresh_after('t2') == 2
@@ -0,0 +1,180 @@
+"""
+Tests for the write-behind message writer.
+
+The database is replaced by an in-memory client that records every upsert and
+can be told to fail or stall the inserts of a thread.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from agentpress.message_writer import MessageWriteError, MessageWriter
+
+
+class FakeQuery:
+    def __init__(self, client, rows):
+        self.client = client
+        self.rows = rows
+
+    async def execute(self):
+        thread_id = self.rows[0]['thread_id']
+        gate = self.client.gates.get(thread_id)
+        if gate is not None:
+            await gate.wait()
+        if self.client.failures.get(thread_id, 0) > 0:
+            self.client.failures[thread_id] -= 1
+            raise RuntimeError(f"insert failed for {thread_id}")
+        for row in self.rows:
+            self.client.stored.setdefault(row['message_id'], row)
+        self.client.inserts.append([row['message_id'] for row in self.rows])
+
+
+class FakeTable:
+    def __init__(self, client):
+        self.client = client
+
+    def upsert(self, rows, **kwargs):
+        return FakeQuery(self.client, rows)
+
+
+class FakeClient:
+    def __init__(self):
+        self.stored = {}
+        self.inserts = []
+        self.failures = {}
+        self.gates = {}
+
+    def table(self, name):
+        assert name == 'messages'
+        return FakeTable(self)
+
+
+class FakeDB:
+    def __init__(self):
+        self.fake_client = FakeClient()
+
+    @property
+    async def client(self):
+        return self.fake_client
+
+
+def make_writer(**kwargs):
+    db = FakeDB()
+    return MessageWriter(db, flush_interval=kwargs.pop('flush_interval', 60), **kwargs), db.fake_client
+
+
+def queue(writer, thread_id, text):
+    row = writer.new_row(thread_id, 'assistant', json.dumps({'content': text}), True, '{}')
+    writer.enqueue(row)
+    return row
+
+
+def stored_order(client, thread_id):
+    rows = [row for row in client.stored.values() if row['thread_id'] == thread_id]
+    return [json.loads(row['content'])['content'] for row in sorted(rows, key=lambda row: row['created_at'])]
+
+
+@pytest.mark.asyncio
+async def test_rows_of_a_thread_are_stored_in_queue_order():
+    writer, client = make_writer()
+    for i in range(10):
+        queue(writer, 't1', str(i))
+
+    await writer.flush('t1')
+
+    assert stored_order(client, 't1') == [str(i) for i in range(10)]
+    assert len(client.inserts) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_ahead_of_newer_rows():
+    writer, client = make_writer()
+    client.failures['t1'] = 1
+    queue(writer, 't1', 'a')
+
+    with pytest.raises(MessageWriteError) as error:
+        await writer.flush('t1')
+    assert list(error.value.errors) == ['t1']
+
+    queue(writer, 't1', 'b')
+    await writer.flush('t1')
+
+    assert stored_order(client, 't1') == ['a', 'b']
+    assert client.inserts == [[row['message_id'] for row in client.stored.values()]]
+
+
+@pytest.mark.asyncio
+async def test_failure_is_only_reported_to_its_own_thread():
+    writer, client = make_writer()
+    client.failures['t1'] = 1
+    queue(writer, 't1', 'a')
+    queue(writer, 't2', 'b')
+
+    await writer.flush('t2')
+    with pytest.raises(MessageWriteError):
+        await writer.flush('t1')
+
+    assert stored_order(client, 't2') == ['b']
+
+
+@pytest.mark.asyncio
+async def test_rows_are_dropped_after_max_attempts():
+    writer, client = make_writer()
+    client.failures['t1'] = MessageWriter.MAX_BACKGROUND_ATTEMPTS
+    queue(writer, 't1', 'a')
+
+    for _ in range(MessageWriter.MAX_BACKGROUND_ATTEMPTS):
+        with pytest.raises(MessageWriteError):
+            await writer.flush('t1')
+
+    assert not writer._queues.get('t1')
+    await writer.flush('t1')
+    assert stored_order(client, 't1') == []
+
+
+@pytest.mark.asyncio
+async def test_flush_waits_for_a_flush_of_the_same_thread_in_progress():
+    writer, client = make_writer()
+    client.gates['t1'] = asyncio.Event()
+    queue(writer, 't1', 'a')
+    first = asyncio.create_task(writer.flush('t1'))
+    await asyncio.sleep(0)
+
+    # Nothing is queued anymore, but the barrier must still wait for 'a'
+    second = asyncio.create_task(writer.flush('t1'))
+    await asyncio.sleep(0.01)
+    assert not second.done()
+
+    client.gates['t1'].set()
+    await asyncio.gather(first, second)
+    assert stored_order(client, 't1') == ['a']
+
+
+@pytest.mark.asyncio
+async def test_stalled_thread_does_not_block_other_threads():
+    writer, client = make_writer()
+    client.gates['t1'] = asyncio.Event()
+    queue(writer, 't1', 'a')
+    queue(writer, 't2', 'b')
+    stalled = asyncio.create_task(writer.flush('t1'))
+    await asyncio.sleep(0)
+
+    await asyncio.wait_for(writer.flush('t2'), 1)
+    assert stored_order(client, 't2') == ['b']
+
+    client.gates['t1'].set()
+    await stalled
+
+
+@pytest.mark.asyncio
+async def test_flush_all_waits_for_every_thread():
+    writer, client = make_writer()
+    for thread_id in ('t1', 't2', 't3'):
+        queue(writer, thread_id, thread_id)
+
+    await writer.flush()
+
+    assert sorted(row['thread_id'] for row in client.stored.values()) == ['t1', 't2', 't3']
+    assert writer._locks == {}
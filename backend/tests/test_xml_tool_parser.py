@@ -0,0 +1,75 @@
+"""
+Tests for the streaming XML tool call parser.
+
+Feeding a response in chunks must yield the same tool calls as feeding it in
+one piece, however the chunks are cut.
+"""
+
+import random
+
+import pytest
+
+from agentpress.xml_tool_parser import StreamingXMLToolParser, XMLTagMatcher
+
+# Tags where one name is a prefix of another, as with the browser tools
+TAGS = ["browser-click", "browser-click-element", "ask", "ask-user", "create-file"]
+
+
+def parse_whole(text: str) -> list:
+    return StreamingXMLToolParser(XMLTagMatcher(TAGS)).feed(text)
+
+
+def parse_chunked(text: str, cuts: list) -> list:
+    parser = StreamingXMLToolParser(XMLTagMatcher(TAGS))
+    chunks = []
+    bounds = [0] + sorted(cuts) + [len(text)]
+    for start, end in zip(bounds, bounds[1:]):
+        chunks.extend(parser.feed(text[start:end]))
+    return chunks
+
+
+def random_response(rng: random.Random) -> str:
+    parts = []
+    for _ in range(rng.randint(1, 6)):
+        parts.append(rng.choice(["Let me do that. ", "ok\n", "<b>bold</b> ", "a < b ", ""]))
+        tag = rng.choice(TAGS)
+        body = rng.choice(["", "text", "<ask>inner</ask>", f"<{tag}>nested</{tag}>"])
+        parts.append(f'<{tag} attr="1">{body}</{tag}>')
+    return "".join(parts)
+
+
+def test_prefix_tag_split_inside_longer_name():
+    text = '<browser-click-element index="2"></browser-click-element>'
+    cut = text.index("nt index")
+
+    assert parse_chunked(text, [cut]) == [text]
+
+
+@pytest.mark.parametrize("cut", range(1, 45))
+def test_every_single_cut_matches_whole_text(cut):
+    text = 'Go <browser-click-element index="2"></browser-click-element> and <browser-click x="1"></browser-click>'
+
+    assert parse_chunked(text, [cut]) == parse_whole(text)
+
+
+def test_shorter_tag_is_emitted_once_it_cannot_grow():
+    text = '<browser-click x="1"></browser-click>'
+
+    assert parse_chunked(text, [len("<browser-click")]) == [text]
+
+
+def test_random_chunking_matches_whole_text():
+    rng = random.Random(1234)
+    for _ in range(500):
+        text = random_response(rng)
+        cuts = rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(1, 20)))
+
+        assert parse_chunked(text, cuts) == parse_whole(text), (text, sorted(cuts))
+
+
+def test_character_by_character_matches_whole_text():
+    rng = random.Random(99)
+    for _ in range(50):
+        text = random_response(rng)
+
+        assert parse_chunked(text, list(range(1, len(text)))) == parse_whole(text), text
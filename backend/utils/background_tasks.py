@@ -0,0 +1,40 @@
+"""
+Fire-and-forget asyncio tasks that are kept alive until they finish.
+
+The event loop only holds weak references to tasks, so a task created with
+asyncio.create_task and stored nowhere can be garbage collected mid-run. The
+writers that flush in the background start their flushes through this class.
+"""
+
+import asyncio
+from typing import Any, Coroutine, Set
+
+
+class BackgroundTasks:
+    """Running background tasks, each released once it is done.
+
+    Methods:
+        start: Run a coroutine as a task and hold it until it finishes
+    """
+
+    def __init__(self):
+        """Initialize with no running tasks."""
+        self._tasks: Set[asyncio.Task] = set()
+
+    def start(self, coro: Coroutine[Any, Any, Any]) -> asyncio.Task:
+        """Run a coroutine as a task and hold a reference to it until it finishes.
+
+        Args:
+            coro: Coroutine to run; it should handle its own errors
+
+        Returns:
+            The started task
+        """
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def __len__(self) -> int:
+        """Number of tasks still running."""
+        return len(self._tasks)
@@ -0,0 +1,94 @@
+"""
+Event loop lag measurement.
+
+A task sleeps for a fixed interval and measures how much later than asked it
+wakes up. The difference is how long the loop was busy with something else,
+typically a blocking call made from async code. The latest samples are kept
+for the health endpoint, and long stalls are logged as they happen.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from utils.logger import logger
+
+# Seconds between samples
+SAMPLE_INTERVAL = 0.5
+# Samples kept for the statistics, one minute at the default interval
+WINDOW_SIZE = 120
+# Lag in seconds above which a stall is logged
+STALL_THRESHOLD = 0.25
+
+
+class EventLoopLagMonitor:
+    """Samples the lag of the running event loop.
+
+    Attributes:
+        interval (float): Seconds between samples
+        stall_threshold (float): Lag in seconds above which a stall is logged and counted
+        stalls (int): Samples above the threshold since start
+
+    Methods:
+        start: Start sampling on the running loop
+        stop: Stop sampling
+        snapshot: Get the lag statistics of the recent samples
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, window_size: int = WINDOW_SIZE, stall_threshold: float = STALL_THRESHOLD):
+        """Initialize a stopped monitor.
+
+        Args:
+            interval: Seconds between samples
+            window_size: Samples kept for the statistics
+            stall_threshold: Lag in seconds above which a stall is logged and counted
+        """
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.stalls = 0
+        self._samples: deque = deque(maxlen=window_size)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start sampling on the running loop; does nothing if already started."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> None:
+        """Stop sampling."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sample(self) -> None:
+        """Measure the lag of every sleep until stopped."""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - expected)
+            self._samples.append(lag)
+            if lag > self.stall_threshold:
+                self.stalls += 1
+                logger.warning(f"Event loop stalled for {lag * 1000:.0f}ms")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the lag statistics of the recent samples, in milliseconds."""
+        samples = sorted(self._samples)
+        if not samples:
+            return {"samples": 0, "stalls": self.stalls}
+        return {
+            "samples": len(samples),
+            "stalls": self.stalls,
+            "current_ms": round(self._samples[-1] * 1000, 1),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 1),
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+            "max_ms": round(samples[-1] * 1000, 1),
+        }
+
+
+event_loop_lag_monitor = EventLoopLagMonitor()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Benchmark of browser action latency: curl through process.exec vs the pooled HTTP client.
+
+Usage:
+    python -m utils.scripts.benchmark_browser_transport --sandbox-id <id> [--actions 20] [--endpoint wait] [--params '{"seconds": 0}']
+
+This script:
+1. Gets (and starts if needed) the given sandbox
+2. Calls the same browser automation endpoint the given number of times with
+   curl run inside the sandbox through process.exec, as the browser tool used to
+3. Calls it as many times through sandbox.browser_client, over the sandbox's
+   preview link with pooled keep-alive connections
+4. Prints the mean, median, p95 and max latency and the response size of each
+   transport
+
+Every action of the browser API returns the page state with a screenshot, so
+any endpoint measures the full response path. The default, a wait of 0
+seconds, does not change the page.
+
+Make sure your environment variables are properly set:
+- DAYTONA_API_KEY
+- DAYTONA_SERVER_URL
+- DAYTONA_TARGET
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+
+from dotenv import load_dotenv
+
+# Load script-specific environment variables
+load_dotenv(".env")
+
+from sandbox.sandbox import get_or_start_sandbox
+from sandbox.browser_client import sandbox_browser_client
+
+
+def exec_request(sandbox, endpoint: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """Call the browser API with curl inside the sandbox, as the browser tool used to."""
+    url = f"http://localhost:8002/api/automation/{endpoint}"
+    curl_cmd = f"curl -s -X POST '{url}' -H 'Content-Type: application/json' -d '{json.dumps(params)}'"
+    response = sandbox.process.exec(curl_cmd, timeout=30)
+    if response.exit_code != 0:
+        raise RuntimeError(f"curl failed: {response}")
+    return json.loads(response.result)
+
+
+async def measure(name: str, call: Callable[[], Awaitable[Dict[str, Any]]], actions: int) -> List[float]:
+    """Time sequential calls and print their latency distribution."""
+    latencies = []
+    size = 0
+    for _ in range(actions):
+        start = time.perf_counter()
+        result = await call()
+        latencies.append((time.perf_counter() - start) * 1000)
+        size = len(json.dumps(result))
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"  {name:<6} mean {statistics.mean(latencies):7.1f} ms  median {statistics.median(latencies):7.1f} ms  "
+          f"p95 {p95:7.1f} ms  max {latencies[-1]:7.1f} ms  ({size / 1024:.0f} KiB per response)")
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark browser action latency per transport")
+    parser.add_argument("--sandbox-id", required=True, help="Sandbox running the browser API")
+    parser.add_argument("--actions", type=int, default=20, help="Actions per transport")
+    parser.add_argument("--endpoint", default="wait", help="Endpoint under /api/automation")
+    parser.add_argument("--params", default='{"seconds": 0}', help="JSON body of the requests")
+    args = parser.parse_args()
+
+    params = json.loads(args.params)
+    sandbox = await get_or_start_sandbox(args.sandbox_id)
+
+    # Warm up both paths: preview link resolution, TLS handshake, page state
+    await asyncio.to_thread(exec_request, sandbox, args.endpoint, params)
+    await sandbox_browser_client.request(sandbox, args.endpoint, params)
+
+    print(f"{args.actions} x {args.endpoint} on sandbox {args.sandbox_id}")
+    exec_latencies = await measure(
+        "exec", lambda: asyncio.to_thread(exec_request, sandbox, args.endpoint, params), args.actions)
+    direct_latencies = await measure(
+        "direct", lambda: sandbox_browser_client.request(sandbox, args.endpoint, params), args.actions)
+    print(f"  median speedup {statistics.median(exec_latencies) / statistics.median(direct_latencies):.1f}x")
+
+    await sandbox_browser_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
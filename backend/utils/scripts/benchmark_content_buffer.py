@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+Benchmark peak memory and CPU of accumulating a streamed assistant response.
+
+Usage:
+    python -m utils.scripts.benchmark_content_buffer [--recording FILE] [--size-mb 8] [--delta-size 16]
+
+This script:
+1. Loads a recorded stream (or synthesizes one of the requested size)
+2. Replays it in a fresh subprocess per variant, so peak RSS is not shared:
+   - concat: str += on every delta, then a find() to truncate after the last tool call
+   - buffer: ContentBuffer appends, truncation at the offset reported by the parser
+3. Both variants feed the deltas to StreamingXMLToolParser, as ResponseProcessor does
+4. Prints CPU time, peak RSS and the peak traced allocation of the replay
+   itself (measured in a second, traced pass so tracing does not skew CPU time)
+
+The recording format is the same as for benchmark_xml_stream_parser.
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import List
+
+from agentpress.content_buffer import ContentBuffer
+from agentpress.xml_tool_parser import StreamingXMLToolParser
+from utils.scripts.benchmark_xml_stream_parser import DEFAULT_TAGS, build_registry, load_recording, synthesize_stream
+
+VARIANTS = ["concat", "buffer"]
+
+
+def run_concat(tag_matcher, deltas: List[str]) -> str:
+    """Accumulate with string concatenation, as before."""
+    parser = StreamingXMLToolParser(tag_matcher)
+    accumulated_content = ""
+    last_xml_chunk = None
+    for delta in deltas:
+        accumulated_content += delta
+        for xml_chunk in parser.feed(delta):
+            last_xml_chunk = xml_chunk
+    if last_xml_chunk:
+        end = accumulated_content.find(last_xml_chunk) + len(last_xml_chunk)
+        accumulated_content = accumulated_content[:end]
+    return accumulated_content
+
+
+def run_buffer(tag_matcher, deltas: List[str]) -> str:
+    """Accumulate into a ContentBuffer and truncate at the tracked offset."""
+    parser = StreamingXMLToolParser(tag_matcher)
+    accumulated_content = ContentBuffer()
+    last_xml_chunk_end = None
+    for delta in deltas:
+        chunk_start = accumulated_content.append(delta)
+        for _, chunk_end in zip(parser.feed(delta), parser.last_chunk_ends):
+            last_xml_chunk_end = chunk_start + chunk_end
+    if last_xml_chunk_end is not None:
+        accumulated_content.truncate(last_xml_chunk_end)
+    return accumulated_content.getvalue()
+
+
+def load_deltas(args) -> List[str]:
+    """Load the recorded stream or synthesize one from the command line options."""
+    if args.recording:
+        return load_recording(args.recording)
+    return synthesize_stream(args.size_mb, args.delta_size)
+
+
+def run_variant(args):
+    """Run one variant in this process and print its measurements as JSON."""
+    deltas = load_deltas(args)
+    registry = build_registry(DEFAULT_TAGS)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    run = run_concat if args.variant == "concat" else run_buffer
+    start = time.process_time()
+    content = run(registry.tag_matcher, deltas)
+    cpu = time.process_time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    del content
+
+    tracemalloc.start()
+    content = run(registry.tag_matcher, deltas)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(json.dumps({
+        "variant": args.variant,
+        "cpu_s": cpu,
+        "peak_rss_kb": peak_rss,
+        "baseline_rss_kb": baseline_rss,
+        "traced_peak_bytes": traced_peak,
+        "content_len": len(content),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark accumulation of streamed assistant content")
+    parser.add_argument("--recording", help="JSON-lines file with recorded stream deltas")
+    parser.add_argument("--size-mb", type=float, default=8, help="Size of the synthetic stream")
+    parser.add_argument("--delta-size", type=int, default=16, help="Characters per synthetic delta")
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args)
+        return
+
+    forwarded = sys.argv[1:]
+    results = {}
+    for variant in VARIANTS:
+        output = subprocess.run(
+            [sys.executable, "-m", "utils.scripts.benchmark_content_buffer", *forwarded, "--variant", variant],
+            check=True, capture_output=True, text=True
+        ).stdout
+        results[variant] = json.loads(output.strip().splitlines()[-1])
+
+    for variant, result in results.items():
+        print(f"{variant:>7}: cpu {result['cpu_s']:.3f}s, "
+              f"peak RSS {result['peak_rss_kb'] / 1024:.1f} MB "
+              f"(+{(result['peak_rss_kb'] - result['baseline_rss_kb']) / 1024:.1f} MB during replay), "
+              f"peak traced {result['traced_peak_bytes'] / (1024 * 1024):.1f} MB, "
+              f"{result['content_len']} chars")
+    if results["concat"]["content_len"] != results["buffer"]["content_len"]:
+        print("WARNING: final content differs between variants")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""
+Benchmark of event loop lag caused by blocking sandbox calls.
+
+Usage:
+    python -m utils.scripts.benchmark_event_loop_lag [--agents 8] [--calls 5] [--duration 0.5]
+
+This script:
+1. Simulates agents making blocking Daytona SDK calls concurrently; each call
+   is a time.sleep of the given duration, standing in for a file transfer or
+   a shell command
+2. Runs them calling the SDK directly from async code, as the sandbox tools
+   used to, while utils.event_loop_lag samples the lag of the loop
+3. Runs them again through sandbox.sandbox_io.sandbox_call
+4. Prints the lag statistics and the wall time of each variant
+
+No sandbox is needed. The lag is what every other request and SSE stream of
+the worker waits on top of its own work.
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict
+
+from sandbox.sandbox_io import sandbox_call
+from utils.event_loop_lag import EventLoopLagMonitor
+
+
+async def run_agents(agents: int, calls: int, duration: float, pooled: bool) -> Dict[str, Any]:
+    """Run the simulated agents and return the lag statistics and wall time."""
+    monitor = EventLoopLagMonitor(interval=0.01, window_size=100000, stall_threshold=float("inf"))
+    monitor.start()
+    # Let the monitor take a baseline sample
+    await asyncio.sleep(0.05)
+
+    async def agent(index: int):
+        for _ in range(calls):
+            if pooled:
+                await sandbox_call(f"sandbox-{index}", time.sleep, duration)
+            else:
+                time.sleep(duration)
+            # The agent's own async work between calls
+            await asyncio.sleep(0)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(agent(index) for index in range(agents)))
+    wall_time = time.perf_counter() - start
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    return {"wall_time": wall_time, **monitor.snapshot()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark event loop lag caused by blocking sandbox calls")
+    parser.add_argument("--agents", type=int, default=8, help="Concurrent agents")
+    parser.add_argument("--calls", type=int, default=5, help="Blocking calls per agent")
+    parser.add_argument("--duration", type=float, default=0.5, help="Seconds per blocking call")
+    args = parser.parse_args()
+
+    print(f"{args.agents} agents x {args.calls} calls of {args.duration}s")
+    for name, pooled in (("direct", False), ("pooled", True)):
+        stats = await run_agents(args.agents, args.calls, args.duration, pooled)
+        print(f"  {name:<6} lag mean {stats['mean_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  "
+              f"max {stats['max_ms']:8.1f} ms  wall {stats['wall_time']:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark of SSE frame building for agent run streams, on one core.
+
+Usage:
+    python -m utils.scripts.benchmark_sse_frames [--responses 20000] [--size 40] [--rounds 5]
+
+This script:
+1. Builds a run's worth of responses like the ones the agent streams (content
+   chunks, tool results and status messages)
+2. Times the write side: encoding each response into its stream entry, with
+   json.dumps as before and with response_stream.response_fields
+3. Times the read side: turning stream entries into SSE frames and detecting
+   the end of the run, with the previous json.loads + json.dumps round trip and
+   with run_broadcast.encode_frame on the pre-encoded payload
+4. Prints the best rate of each variant in frames per second
+
+No Redis is needed; only the CPU work done per frame is measured. Whether
+orjson is used depends on whether it is installed.
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Callable, Dict, List
+
+from agent import response_stream, run_broadcast
+
+
+def make_responses(count: int, size: int) -> List[Dict[str, Any]]:
+    """Build responses in the proportions of a typical run."""
+    responses = []
+    for sequence in range(count):
+        if sequence % 20 == 19:
+            responses.append({
+                "type": "tool", "role": "assistant", "sequence": sequence,
+                "content": json.dumps({"role": "user", "content": "ToolResult(success=True, output='" + "y" * size * 4 + "')"}),
+                "metadata": json.dumps({"thread_run_id": "run"}),
+            })
+        elif sequence % 50 == 49:
+            responses.append({"type": "status", "status": "tool_started", "function_name": "execute_command", "sequence": sequence})
+        else:
+            responses.append({"type": "content", "content": "x" * size, "sequence": sequence})
+    responses.append({"type": "status", "status": "completed", "message": "Agent run completed successfully"})
+    return responses
+
+
+def legacy_frame(fields: Dict[str, str]):
+    """Stream loop before pre-encoded frames: parse the payload and encode it again."""
+    response = json.loads(fields["data"])
+    frame = f"data: {json.dumps(response)}\n\n"
+    terminal = response.get('type') == 'status' and response.get('status') in response_stream.TERMINAL_STATUSES
+    return frame, terminal
+
+
+def best_rate(function: Callable[[Any], Any], items: List[Any], rounds: int) -> float:
+    """Best calls per second of function over items across rounds."""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        best = min(best, time.perf_counter() - start)
+    return len(items) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SSE frame building for agent run streams")
+    parser.add_argument("--responses", type=int, default=20000, help="Responses in the run")
+    parser.add_argument("--size", type=int, default=40, help="Characters of content per chunk")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per variant; the best is reported")
+    args = parser.parse_args()
+
+    responses = make_responses(args.responses, args.size)
+    legacy_entries = [{"data": json.dumps(response)} for response in responses]
+    entries = [response_stream.response_fields(response) for response in responses]
+
+    print(f"{len(responses)} responses, orjson {'enabled' if response_stream.orjson is not None else 'not installed'}")
+    encode_before = best_rate(lambda response: {"data": json.dumps(response)}, responses, args.rounds)
+    encode_after = best_rate(response_stream.response_fields, responses, args.rounds)
+    print(f"  write: json.dumps {encode_before:,.0f}/s, response_fields {encode_after:,.0f}/s ({encode_after / encode_before:.1f}x)")
+    frame_before = best_rate(legacy_frame, legacy_entries, args.rounds)
+    frame_after = best_rate(run_broadcast.encode_frame, entries, args.rounds)
+    print(f"  read:  loads+dumps {frame_before:,.0f} frames/s, encode_frame {frame_after:,.0f} frames/s ({frame_after / frame_before:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
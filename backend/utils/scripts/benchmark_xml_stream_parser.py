@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for XML tool call extraction on streamed LLM responses.
+
+Usage:
+    python -m utils.scripts.benchmark_xml_stream_parser [--recording FILE] [--size-mb 0.25]
+
+This script:
+1. Loads a recorded stream (or synthesizes one of the requested size)
+2. Replays it delta by delta through the legacy full-buffer re-scan
+   (ResponseProcessor._extract_xml_chunks + str.replace on every delta)
+3. Replays it through StreamingXMLToolParser
+4. Prints timings and checks that both produce the same tool call chunks
+
+A recording is a JSON-lines file with one entry per delta. Each line is either
+a JSON string holding the delta text, or a response object as stored in the
+agent run response stream (assistant chunks are replayed, everything
+else is skipped).
+"""
+
+import argparse
+import json
+import time
+from typing import List
+
+from agentpress.response_processor import ResponseProcessor
+from agentpress.tool import Tool, ToolResult, xml_schema
+from agentpress.tool_registry import ToolRegistry
+from agentpress.xml_tool_parser import StreamingXMLToolParser, XMLTagMatcher
+
+# XML tags registered by the agent in agent/run.py
+DEFAULT_TAGS = [
+    "ask", "web-browser-takeover", "inform", "complete", "browser-navigate-to",
+    "browser-search-google", "browser-go-back", "browser-wait", "browser-click-element",
+    "browser-input-text", "browser-send-keys", "browser-switch-tab", "browser-open-tab",
+    "browser-close-tab", "browser-extract-content", "browser-scroll-down", "browser-scroll-up",
+    "browser-scroll-to-text", "browser-get-dropdown-options", "browser-select-dropdown-option",
+    "browser-drag-drop", "browser-click-coordinates", "see-image", "expose-port", "deploy",
+    "get-data-provider-endpoints", "execute-data-provider-call", "execute-command",
+    "create-file", "str-replace", "full-file-rewrite", "delete-file", "web-search",
+    "scrape-webpage",
+]
+
+
+def build_registry(tags: List[str]) -> ToolRegistry:
+    """Register a stub tool exposing one XML method per tag."""
+    methods = {}
+    for tag in tags:
+        async def method(self, **kwargs) -> ToolResult:
+            return self.success_response(kwargs)
+        methods[tag.replace("-", "_")] = xml_schema(tag_name=tag)(method)
+
+    registry = ToolRegistry()
+    registry.register_tool(type("BenchmarkTool", (Tool,), methods))
+    return registry
+
+
+def load_recording(path: str) -> List[str]:
+    """Load the deltas of a recorded stream."""
+    deltas = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, str):
+                deltas.append(entry)
+                continue
+            if entry.get("type") != "assistant":
+                continue
+            metadata = entry.get("metadata") or "{}"
+            if isinstance(metadata, str):
+                metadata = json.loads(metadata)
+            if metadata.get("stream_status") != "chunk":
+                continue
+            content = entry.get("content") or "{}"
+            if isinstance(content, str):
+                content = json.loads(content)
+            if content.get("content"):
+                deltas.append(content["content"])
+    return deltas
+
+
+def synthesize_stream(size_mb: float, delta_size: int) -> List[str]:
+    """Build a long assistant turn with a large create-file call and a few short calls."""
+    target = int(size_mb * 1024 * 1024)
+    lines = []
+    length = 0
+    i = 0
+    while length < target:
+        line = f"    <div class=\"row-{i}\">Row {i} of generated content</div>\n"
+        lines.append(line)
+        length += len(line)
+        i += 1
+    text = (
+        "Let me create the page for you.\n\n"
+        "<create-file file_path=\"index.html\">\n" + "".join(lines) + "</create-file>\n\n"
+        "<execute-command>ls -la</execute-command>\n\n"
+        "<ask attachments=\"index.html\">Does this look right?</ask>"
+    )
+    return [text[i:i + delta_size] for i in range(0, len(text), delta_size)]
+
+
+def run_legacy(processor: ResponseProcessor, deltas: List[str]) -> List[str]:
+    """Re-scan the whole unprocessed buffer on every delta, as before."""
+    chunks = []
+    current_xml_content = ""
+    for delta in deltas:
+        current_xml_content += delta
+        for xml_chunk in processor._extract_xml_chunks(current_xml_content):
+            current_xml_content = current_xml_content.replace(xml_chunk, "", 1)
+            chunks.append(xml_chunk)
+    return chunks
+
+
+def run_streaming(tag_matcher: XMLTagMatcher, deltas: List[str]) -> List[str]:
+    """Feed each delta once to the incremental parser."""
+    parser = StreamingXMLToolParser(tag_matcher)
+    chunks = []
+    for delta in deltas:
+        chunks.extend(parser.feed(delta))
+    return chunks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark streamed XML tool call extraction")
+    parser.add_argument("--recording", help="JSON-lines file with recorded stream deltas")
+    parser.add_argument("--size-mb", type=float, default=0.25, help="Size of the synthetic stream (legacy re-scan is quadratic)")
+    parser.add_argument("--delta-size", type=int, default=64, help="Characters per synthetic delta")
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the incremental parser")
+    args = parser.parse_args()
+
+    deltas = load_recording(args.recording) if args.recording else synthesize_stream(args.size_mb, args.delta_size)
+    total_chars = sum(len(d) for d in deltas)
+    print(f"Replaying {len(deltas)} deltas ({total_chars / (1024 * 1024):.2f} MB) against {len(DEFAULT_TAGS)} tags")
+
+    registry = build_registry(DEFAULT_TAGS)
+    processor = ResponseProcessor(tool_registry=registry, add_message_callback=None)
+
+    start = time.perf_counter()
+    streaming_chunks = run_streaming(registry.tag_matcher, deltas)
+    streaming_time = time.perf_counter() - start
+    print(f"StreamingXMLToolParser: {streaming_time:.3f}s, {len(streaming_chunks)} chunks")
+
+    if args.skip_legacy:
+        return
+
+    start = time.perf_counter()
+    legacy_chunks = run_legacy(processor, deltas)
+    legacy_time = time.perf_counter() - start
+    print(f"Legacy re-scan:         {legacy_time:.3f}s, {len(legacy_chunks)} chunks")
+    print(f"Speedup: {legacy_time / streaming_time if streaming_time else float('inf'):.1f}x")
+    if legacy_chunks != streaming_chunks:
+        print("WARNING: chunk lists differ between legacy and streaming parsers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+"""
+Script to delete expired browser screenshots from storage.
+
+Usage:
+    python -m utils.scripts.cleanup_browser_screenshots [--days 30]
+
+This script:
+1. Lists the browser_screenshots bucket folder by folder, oldest first
+2. Deletes every screenshot not stored again within the retention period
+
+Screenshots are renewed whenever a run stores the same image again, so the
+ones still in use are kept. Browser states older than the retention period
+show no screenshot anymore. Run it daily, e.g. from cron.
+
+Make sure your environment variables are properly set:
+- SUPABASE_URL
+- SUPABASE_SERVICE_ROLE_KEY
+"""
+
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+# Load script-specific environment variables
+load_dotenv(".env")
+
+from services.screenshot_store import SCREENSHOT_RETENTION_DAYS, screenshot_store
+from utils.logger import logger
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Delete expired browser screenshots")
+    parser.add_argument("--days", type=int, default=SCREENSHOT_RETENTION_DAYS,
+                        help="Days a screenshot is kept after it was last stored")
+    args = parser.parse_args()
+
+    deleted = await screenshot_store.cleanup(args.days)
+    logger.info(f"Screenshot cleanup done, {deleted} deleted")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Load test for the agent run response transport against a local Redis.
+
+Usage:
+    python -m utils.scripts.load_test_response_stream [--readers 200] [--responses 2000] [--rate 50] [--transport stream]
+        [--batch-size 50] [--flush-interval 0.05]
+
+This script:
+1. Starts one producer that writes responses at the given rate through a
+   ResponseStreamWriter, the way run_agent_background does, and finishes with
+   a completed status message (--batch-size 1 writes every response on its own)
+2. Starts N concurrent readers that build SSE frames the way stream_agent_run
+   does (sharing the process-wide stream multiplexer), until they see the
+   completed status
+3. Prints delivery latency percentiles, frames delivered and the number of
+   Redis commands the server processed during the run
+
+--transport hub has the readers share the process-wide run broadcast hub, so
+the frames are built once for all of them, like concurrent viewers of a run
+in one API process.
+
+--transport list replays the previous transport (RPUSH + PUBLISH "new" per
+response, readers woken by pub/sub calling LRANGE) for comparison.
+
+Redis is reached through services.redis, so REDIS_HOST/REDIS_PORT apply
+(e.g. REDIS_HOST=localhost for a local server). The test keys are deleted
+when the run finishes.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+from contextlib import aclosing
+from typing import List
+
+from agent import response_stream, run_broadcast
+from services import redis
+
+COMPLETED = {"type": "status", "status": "completed", "message": "Agent run completed successfully"}
+
+
+def make_response(sequence: int, size: int) -> dict:
+    """Build an assistant chunk like the ones the agent streams."""
+    return {
+        "type": "content",
+        "content": "x" * size,
+        "sequence": sequence,
+        "sent_at": time.time(),
+    }
+
+
+async def produce_stream(agent_run_id: str, count: int, rate: float, size: int, args):
+    """Write responses to the run's stream through a coalescing writer."""
+    writer = response_stream.ResponseStreamWriter(
+        agent_run_id, max_batch_size=args.batch_size, flush_interval=args.flush_interval
+    )
+    for sequence in range(count):
+        await writer.add(make_response(sequence, size))
+        await asyncio.sleep(1 / rate)
+    await writer.add(COMPLETED)
+
+
+async def read_stream(agent_run_id: str, latencies: List[float]) -> int:
+    """Read the run like stream_agent_run; returns the number of frames built."""
+    frames = 0
+    async with aclosing(response_stream.follow_entries(agent_run_id)) as entries:
+        async for _, fields in entries:
+            frame, terminal = run_broadcast.encode_frame(fields)
+            frames += 1
+            response = json.loads(frame[6:])
+            if "sent_at" in response:
+                latencies.append(time.time() - response["sent_at"])
+            if terminal:
+                break
+    return frames
+
+
+async def read_hub(agent_run_id: str, latencies: List[float]) -> int:
+    """Read the run through its broadcast hub; returns the number of frames sent."""
+    frames = 0
+    hub = run_broadcast.run_broadcaster.open(agent_run_id, response_stream.STREAM_START_ID)
+    async with aclosing(run_broadcast.follow_frames(hub)) as entries:
+        async for _, frame, terminal in entries:
+            frames += 1
+            response = json.loads(frame[6:])
+            if "sent_at" in response:
+                latencies.append(time.time() - response["sent_at"])
+            if terminal:
+                break
+    return frames
+
+
+async def produce_list(agent_run_id: str, count: int, rate: float, size: int, args):
+    """Push responses with the previous list + pub/sub notification transport."""
+    list_key = f"agent_run:{agent_run_id}:responses"
+    channel = f"agent_run:{agent_run_id}:new_response"
+    for sequence in range(count + 1):
+        response = make_response(sequence, size) if sequence < count else COMPLETED
+        await redis.rpush(list_key, json.dumps(response))
+        await redis.publish(channel, "new")
+        if sequence < count:
+            await asyncio.sleep(1 / rate)
+
+
+async def read_list(agent_run_id: str, latencies: List[float]) -> int:
+    """Read the run with the previous transport; returns the number of frames built."""
+    list_key = f"agent_run:{agent_run_id}:responses"
+    channel = f"agent_run:{agent_run_id}:new_response"
+    pubsub = await redis.create_pubsub()
+    await pubsub.subscribe(channel)
+    frames = 0
+    try:
+        async for message in pubsub.listen():
+            if message.get("type") != "message":
+                continue
+            for response_json in await redis.lrange(list_key, frames, -1):
+                response = json.loads(response_json)
+                frame = f"data: {json.dumps(response)}\n\n"
+                frames += 1
+                if "sent_at" in response:
+                    latencies.append(time.time() - response["sent_at"])
+                if response.get("status") in response_stream.TERMINAL_STATUSES:
+                    return frames
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.close()
+    return frames
+
+
+async def total_commands() -> int:
+    """Number of commands the Redis server has processed."""
+    client = await redis.get_client()
+    return (await client.info("stats"))["total_commands_processed"]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(args):
+    agent_run_id = f"loadtest-{uuid.uuid4()}"
+    produce, read = {
+        "stream": (produce_stream, read_stream),
+        "hub": (produce_stream, read_hub),
+        "list": (produce_list, read_list),
+    }[args.transport]
+
+    latencies: List[float] = []
+    commands_before = await total_commands()
+    start = time.perf_counter()
+    try:
+        readers = [asyncio.create_task(read(agent_run_id, latencies)) for _ in range(args.readers)]
+        # Let the readers subscribe before the first response
+        await asyncio.sleep(0.5)
+        await produce(agent_run_id, args.responses, args.rate, args.size, args)
+        frames = await asyncio.wait_for(asyncio.gather(*readers), timeout=args.timeout)
+    finally:
+        elapsed = time.perf_counter() - start
+        await redis.delete(response_stream.response_stream_key(agent_run_id))
+        await redis.delete(f"agent_run:{agent_run_id}:responses")
+        run_broadcast.run_broadcaster.close()
+        await response_stream.stream_multiplexer.close()
+    commands = await total_commands() - commands_before
+
+    print(f"transport {args.transport}: {args.readers} readers, {args.responses} responses at {args.rate}/s")
+    print(f"  frames delivered: {sum(frames)} (expected {args.readers * (args.responses + 1)})")
+    print(f"  elapsed: {elapsed:.2f}s, Redis commands: {commands} ({commands / max(1, args.responses):.1f} per response)")
+    if latencies:
+        print(f"  latency ms: p50 {percentile(latencies, 0.5) * 1000:.1f}, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f}, "
+              f"p99 {percentile(latencies, 0.99) * 1000:.1f}, "
+              f"max {max(latencies) * 1000:.1f}, mean {statistics.mean(latencies) * 1000:.1f}")
+    await redis.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the agent run response transport")
+    parser.add_argument("--readers", type=int, default=200, help="Concurrent SSE readers")
+    parser.add_argument("--responses", type=int, default=2000, help="Responses produced by the run")
+    parser.add_argument("--rate", type=float, default=50, help="Responses per second")
+    parser.add_argument("--size", type=int, default=40, help="Characters of content per response")
+    parser.add_argument("--transport", choices=["stream", "hub", "list"], default="stream")
+    parser.add_argument("--batch-size", type=int, default=50, help="Writer batch size for the stream transport")
+    parser.add_argument("--flush-interval", type=float, default=0.05, help="Writer coalescing window in seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for readers after the producer finishes")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
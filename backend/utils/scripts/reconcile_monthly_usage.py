@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+Script to backfill and reconcile the monthly agent run usage ledger.
+
+Usage:
+    python -m utils.scripts.reconcile_monthly_usage [--month 2025-04] [--account-id <uuid>] [--tolerance 1]
+
+This script:
+1. Gets the accounts to reconcile (all basejump accounts, or the one given)
+2. Recomputes each account's usage for the month from agent_runs with the
+   reconcile_account_monthly_usage database function, which stores the result
+3. Prints every account whose stored usage was off by more than the tolerance
+
+Running it for a month the ledger did not exist yet backfills that month.
+Runs that are still going are not part of the ledger; they are counted from
+Redis until they end.
+
+Make sure your environment variables are properly set:
+- SUPABASE_URL
+- SUPABASE_SERVICE_ROLE_KEY
+"""
+
+import argparse
+import asyncio
+from datetime import date, datetime
+from typing import List
+
+from dotenv import load_dotenv
+
+# Load script-specific environment variables
+load_dotenv(".env")
+
+from services.supabase import DBConnection
+from services import usage_ledger
+from utils.logger import logger
+
+PAGE_SIZE = 1000
+
+
+async def get_account_ids(client) -> List[str]:
+    """Get the IDs of all accounts, page by page."""
+    account_ids = []
+    page = 0
+    while True:
+        result = await client.schema('basejump').from_('accounts') \
+            .select('id') \
+            .range(page * PAGE_SIZE, (page + 1) * PAGE_SIZE - 1) \
+            .execute()
+        account_ids.extend(account['id'] for account in result.data or [])
+        if not result.data or len(result.data) < PAGE_SIZE:
+            return account_ids
+        page += 1
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill and reconcile the monthly usage ledger")
+    parser.add_argument("--month", help="Month to reconcile as YYYY-MM (default: current month)")
+    parser.add_argument("--account-id", help="Only reconcile this account")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="Seconds of drift to report")
+    args = parser.parse_args()
+
+    month = datetime.strptime(args.month, "%Y-%m").date() if args.month else usage_ledger.month_start().date()
+    month = date(month.year, month.month, 1)
+
+    db = DBConnection()
+    client = await db.client
+    account_ids = [args.account_id] if args.account_id else await get_account_ids(client)
+    logger.info(f"Reconciling usage of {len(account_ids)} accounts for {month.isoformat()}")
+
+    drifted = 0
+    for i, account_id in enumerate(account_ids, 1):
+        try:
+            result = await client.rpc('reconcile_account_monthly_usage', {
+                'p_account_id': account_id,
+                'p_month': month.isoformat(),
+            }).execute()
+        except Exception as e:
+            logger.error(f"Failed to reconcile usage of account {account_id}: {str(e)}")
+            continue
+        row = result.data[0] if result.data else {}
+        previous = row.get('previous_seconds') or 0.0
+        actual = row.get('seconds') or 0.0
+        if abs(actual - previous) > args.tolerance:
+            drifted += 1
+            print(f"{account_id}: {previous:.1f}s -> {actual:.1f}s ({actual - previous:+.1f}s)")
+        if i % 100 == 0:
+            logger.info(f"Reconciled {i}/{len(account_ids)} accounts")
+
+    print(f"Reconciled {len(account_ids)} accounts for {month.isoformat()}, {drifted} corrected")
+    await DBConnection.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,10 +1,11 @@
-import React, { useMemo } from "react";
+import React, { useEffect, useMemo, useState } from "react";
 import { Globe, MonitorPlay, ExternalLink, CheckCircle, AlertTriangle, CircleDashed } from "lucide-react";
 import { ToolViewProps } from "./types";
 import { extractBrowserUrl, extractBrowserOperation, formatTimestamp, getToolTitle } from "./utils";
 import { ApiMessageType } from '@/components/thread/types';
 import { safeJsonParse } from '@/components/thread/utils';
 import { cn } from "@/lib/utils";
+import { getBrowserScreenshot } from "@/lib/api";
 
 export function BrowserToolView({ 
   name = "browser-operation",
@@ -50,8 +51,10 @@ export function BrowserToolView({
     console.error("[BrowserToolView] Error parsing tool content for message_id:", error);
   }
 
-  // Find the browser_state message and extract the screenshot
+  // Find the browser_state message and extract the screenshot; it is either
+  // inline or stored by hash and fetched from the backend
   let screenshotBase64: string | null = null;
+  let screenshotThreadId: string | null = null;
   if (browserStateMessageId && messages.length > 0) {
     const browserStateMessage = messages.find(msg => 
         (msg.type as string) === 'browser_state' && 
@@ -59,10 +62,38 @@ export function BrowserToolView({
     );
     
     if (browserStateMessage) {
-        const browserStateContent = safeJsonParse<{ screenshot_base64?: string }>(browserStateMessage.content, {});
+        const browserStateContent = safeJsonParse<{ screenshot_base64?: string; screenshot_hash?: string }>(browserStateMessage.content, {});
         screenshotBase64 = browserStateContent?.screenshot_base64 || null;
+        if (!screenshotBase64 && browserStateContent?.screenshot_hash && browserStateMessage.thread_id) {
+          screenshotThreadId = browserStateMessage.thread_id;
+        }
     }
   }
+
+  const [storedScreenshotUrl, setStoredScreenshotUrl] = useState<string | null>(null);
+  useEffect(() => {
+    if (!screenshotThreadId || !browserStateMessageId) {
+      setStoredScreenshotUrl(null);
+      return;
+    }
+    let objectUrl: string | null = null;
+    let cancelled = false;
+    getBrowserScreenshot(screenshotThreadId, browserStateMessageId)
+      .then(blob => {
+        if (cancelled) return;
+        objectUrl = URL.createObjectURL(blob);
+        setStoredScreenshotUrl(objectUrl);
+      })
+      .catch(() => {
+        if (!cancelled) setStoredScreenshotUrl(null);
+      });
+    return () => {
+      cancelled = true;
+      if (objectUrl) URL.revokeObjectURL(objectUrl);
+    };
+  }, [screenshotThreadId, browserStateMessageId]);
+
+  const screenshotSrc = screenshotBase64 ? `data:image/jpeg;base64,${screenshotBase64}` : storedScreenshotUrl;
   
   // Check if we have a VNC preview URL from the project
   const vncPreviewUrl = project?.sandbox?.vnc_preview ? 
@@ -110,10 +141,10 @@ export function BrowserToolView({
               isRunning && vncIframe ? (
                 // Use the memoized iframe for live preview
                 vncIframe
-              ) : screenshotBase64 ? (
+              ) : screenshotSrc ? (
                 <div className="flex items-center justify-center w-full h-full max-h-[650px] overflow-auto">
                   <img 
-                    src={`data:image/jpeg;base64,${screenshotBase64}`} 
+                    src={screenshotSrc} 
                     alt="Browser Screenshot"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -139,10 +170,10 @@ export function BrowserToolView({
               )
             ) : (
               // For non-last tool calls, only show screenshot if available, otherwise show "No Browser State image found"
-              screenshotBase64 ? (
+              screenshotSrc ? (
                 <div className="flex items-center justify-center w-full h-full max-h-[650px] overflow-auto">
                   <img 
-                    src={`data:image/jpeg;base64,${screenshotBase64}`} 
+                    src={screenshotSrc} 
                     alt="Browser Screenshot"
                     className="max-w-full max-h-full object-contain"
                   />
@@ -1025,6 +1025,33 @@ export const getSandboxFileContent = async (sandboxId: string, path: string): Pr
   }
 };
 
+export const getBrowserScreenshot = async (threadId: string, messageId: string): Promise<Blob> => {
+  try {
+    const supabase = createClient();
+    const { data: { session } } = await supabase.auth.getSession();
+
+    const headers: Record<string, string> = {};
+    if (session?.access_token) {
+      headers['Authorization'] = `Bearer ${session.access_token}`;
+    }
+
+    const response = await fetch(`${API_URL}/thread/${threadId}/browser-state/${messageId}/screenshot`, {
+      headers,
+    });
+
+    if (!response.ok) {
+      const errorText = await response.text().catch(() => 'No error details available');
+      console.error(`Error getting browser screenshot: ${response.status} ${response.statusText}`, errorText);
+      throw new Error(`Error getting browser screenshot: ${response.statusText} (${response.status})`);
+    }
+
+    return await response.blob();
+  } catch (error) {
+    console.error('Failed to get browser screenshot:', error);
+    throw error;
+  }
+};
+
 export const updateThread = async (threadId: string, data: Partial<Thread>): Promise<Thread> => {
   const supabase = createClient();
   